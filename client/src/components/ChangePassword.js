@@ -60,6 +60,8 @@ const ChangePassword = () => {
           },
         }
       );
+      // The old token is revoked by the password change
+      localStorage.setItem("token", response.data.token);
       alert("Password changed successfully!");
       navigate("/profile/me"); // Redirect back to the profile page
     } catch (err) {
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from hashtags.trending import prune_trend_buckets
+
+
+class Command(BaseCommand):
+    help = 'Deletes the trending-hashtag count buckets that are older than their retention period (run periodically, e.g. hourly).'
+
+    def handle(self, *args, **options):
+        deleted = prune_trend_buckets()
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} bucket(s).'))
@@ -0,0 +1,50 @@
+# Generated by Django 4.2.16 on 2026-10-18 14:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Count
+from django.db.models.functions import Trunc
+from django.utils import timezone
+from datetime import timedelta
+
+
+def backfill_trend_buckets(apps, schema_editor):
+    # Count the tags added during the last 7 days per hour, and during the last hour per minute
+    PostHashtagRel = apps.get_model('hashtags', 'PostHashtagRel')
+    HashtagTrendBucket = apps.get_model('hashtags', 'HashtagTrendBucket')
+    now = timezone.now()
+    buckets = []
+    for bucket_size, kind, since in ((60, 'minute', timedelta(hours=1)), (3600, 'hour', timedelta(days=7))):
+        rows = (PostHashtagRel.objects.filter(created_time__gte=now - since)
+                .annotate(bucket=Trunc('created_time', kind)).values('hashtag_id', 'bucket').annotate(total=Count('id')))
+        buckets += [HashtagTrendBucket(hashtag_id=row['hashtag_id'], bucket_size=bucket_size, bucket_start=row['bucket'], count=row['total'])
+                    for row in rows]
+    HashtagTrendBucket.objects.bulk_create(buckets, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hashtags', '0006_rename_post_hashtag_rel_posthashtagrel'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HashtagTrendBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket_size', models.PositiveIntegerField()),
+                ('bucket_start', models.DateTimeField()),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('hashtag', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='trend_buckets', to='hashtags.hashtag')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['bucket_size', 'bucket_start'], name='hashtag_trend_window_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='hashtagtrendbucket',
+            constraint=models.UniqueConstraint(fields=('hashtag', 'bucket_size', 'bucket_start'), name='unique_hashtag_trend_bucket'),
+        ),
+        migrations.RunPython(backfill_trend_buckets, migrations.RunPython.noop),
+    ]
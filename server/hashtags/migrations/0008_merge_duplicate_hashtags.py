@@ -0,0 +1,53 @@
+from django.db import migrations
+
+
+def normalize(text):
+    # Same rules as hashtags.resolve.normalize_hashtag_text at the time of this migration
+    return ' '.join((text or '').strip().lstrip('#').split()).lower()[:100]
+
+
+def merge_duplicate_hashtags(apps, schema_editor):
+    # Before hashtag_text becomes unique: normalize every text, and merge the hashtags that end up with the same one
+    Hashtag = apps.get_model('hashtags', 'Hashtag')
+    PostHashtagRel = apps.get_model('hashtags', 'PostHashtagRel')
+    HashtagTrendBucket = apps.get_model('hashtags', 'HashtagTrendBucket')
+
+    keepers = {}
+    for hashtag in Hashtag.objects.order_by('id'):
+        text = normalize(hashtag.hashtag_text) or f'hashtag-{hashtag.id}'
+        keeper = keepers.get(text)
+        if keeper is None:
+            keepers[text] = hashtag
+            if hashtag.hashtag_text != text:
+                hashtag.hashtag_text = text
+                hashtag.save(update_fields=['hashtag_text'])
+            continue
+
+        # Move the relations and the trending counts of the duplicate to the hashtag that is kept
+        PostHashtagRel.objects.filter(hashtag_id=hashtag).update(hashtag_id=keeper)
+        for bucket in HashtagTrendBucket.objects.filter(hashtag=hashtag):
+            kept_bucket, created = HashtagTrendBucket.objects.get_or_create(
+                hashtag=keeper, bucket_size=bucket.bucket_size, bucket_start=bucket.bucket_start, defaults={'count': 0})
+            kept_bucket.count += bucket.count
+            kept_bucket.save(update_fields=['count'])
+        hashtag.delete()
+
+    # Drop the relations that are now duplicated (same post and hashtag), keeping the oldest
+    seen = set()
+    duplicate_ids = []
+    for rel_id, post_id, hashtag_id in PostHashtagRel.objects.order_by('id').values_list('id', 'post_id', 'hashtag_id'):
+        if (post_id, hashtag_id) in seen:
+            duplicate_ids.append(rel_id)
+        seen.add((post_id, hashtag_id))
+    PostHashtagRel.objects.filter(id__in=duplicate_ids).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hashtags', '0007_hashtagtrendbucket_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_hashtags, migrations.RunPython.noop),
+    ]
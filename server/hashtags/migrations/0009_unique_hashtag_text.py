@@ -0,0 +1,22 @@
+# Generated by Django 4.2.16 on 2026-10-18 14:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hashtags', '0008_merge_duplicate_hashtags'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='hashtag',
+            name='hashtag_text',
+            field=models.CharField(max_length=100, unique=True),
+        ),
+        migrations.AddConstraint(
+            model_name='posthashtagrel',
+            constraint=models.UniqueConstraint(fields=('post_id', 'hashtag_id'), name='unique_post_hashtag'),
+        ),
+    ]
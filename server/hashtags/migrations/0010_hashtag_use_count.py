@@ -0,0 +1,18 @@
+# Generated by Django 4.2.16 on 2026-10-18 14:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hashtags', '0009_unique_hashtag_text'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='hashtag',
+            name='use_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
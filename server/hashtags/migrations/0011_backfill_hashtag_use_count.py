@@ -0,0 +1,23 @@
+from django.db import migrations
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_use_count(apps, schema_editor):
+    # One UPDATE setting each hashtag's use_count to its number of post relations
+    Hashtag = apps.get_model('hashtags', 'Hashtag')
+    PostHashtagRel = apps.get_model('hashtags', 'PostHashtagRel')
+
+    counts = PostHashtagRel.objects.filter(hashtag_id=OuterRef('pk')).order_by().values('hashtag_id').annotate(total=Count('id')).values('total')
+    Hashtag.objects.update(use_count=Coalesce(Subquery(counts), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hashtags', '0010_hashtag_use_count'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_use_count, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY doesn't block writes to the table, but can't run in a transaction
+    atomic = False
+
+    dependencies = [
+        ('hashtags', '0011_backfill_hashtag_use_count'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='posthashtagrel',
+            index=models.Index(fields=['hashtag_id', 'post_id'], name='posthashtag_hashtag_post_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='posthashtagrel',
+            index=models.Index(fields=['created_time'], name='posthashtag_created_idx'),
+        ),
+    ]
@@ -4,7 +4,8 @@ from posts.models import Post
 # Create your models here.
 class Hashtag(models.Model):
     # Don't need to specify primary key because Django will automatically create an auto-incrementing primary key
-    hashtag_text = models.CharField(max_length=100)
+    hashtag_text = models.CharField(max_length=100, unique=True)  # Normalized text, see hashtags/resolve.py
+    use_count = models.PositiveIntegerField(default=0)  # Number of posts with this hashtag, used to rank autocomplete suggestions
     created_time = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
@@ -16,4 +17,31 @@ class PostHashtagRel(models.Model):
     created_time = models.DateTimeField(auto_now_add=True)
     
     def __str__(self):
-        return f'Post {self.post_id} - Hashtag {self.hashtag_id}'
\ No newline at end of file
+        return f'Post {self.post_id} - Hashtag {self.hashtag_id}'
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['post_id', 'hashtag_id'], name='unique_post_hashtag'),
+        ]
+        indexes = [
+            models.Index(fields=['hashtag_id', 'post_id'], name='posthashtag_hashtag_post_idx'),  # Posts of a hashtag
+            models.Index(fields=['created_time'], name='posthashtag_created_idx'),  # Recent uses
+        ]
+
+class HashtagTrendBucket(models.Model):
+    # Number of times a hashtag was added to posts during one time bucket, maintained by add_post_hashtags_rel
+    hashtag = models.ForeignKey(Hashtag, on_delete=models.CASCADE, related_name='trend_buckets')
+    bucket_size = models.PositiveIntegerField()  # Bucket length in seconds (60 or 3600, see hashtags/trending.py)
+    bucket_start = models.DateTimeField()
+    count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f'Hashtag {self.hashtag_id} x{self.count} at {self.bucket_start}'
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['hashtag', 'bucket_size', 'bucket_start'], name='unique_hashtag_trend_bucket'),
+        ]
+        indexes = [
+            models.Index(fields=['bucket_size', 'bucket_start'], name='hashtag_trend_window_idx'),  # Window scans
+        ]
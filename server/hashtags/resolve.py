@@ -0,0 +1,92 @@
+from django.db.models import F
+
+from hashtags.models import Hashtag, PostHashtagRel
+from hashtags.trending import record_hashtag_uses, remove_hashtag_uses_at
+
+HASHTAG_MAX_LENGTH = Hashtag._meta.get_field('hashtag_text').max_length
+
+
+def normalize_hashtag_text(text):
+    """
+    Normalizes a hashtag text: no leading '#', no surrounding or repeated whitespace, lowercase.
+    Returns an empty string for texts that are not valid hashtags.
+    """
+    if not isinstance(text, str):
+        return ''
+    return ' '.join(text.strip().lstrip('#').split()).lower()[:HASHTAG_MAX_LENGTH]
+
+
+def normalize_hashtag_texts(texts):
+    # Normalized, de-duplicated texts, in their original order
+    normalized = (normalize_hashtag_text(text) for text in texts)
+    return list(dict.fromkeys(text for text in normalized if text))
+
+
+def resolve_hashtags(texts):
+    """
+    Resolves any number of hashtag texts to Hashtag rows, creating the missing ones.
+    - One query for the existing hashtags, and one bulk INSERT ... ON CONFLICT DO NOTHING (plus one query to read
+      back their ids) for the missing ones, so concurrent requests can't create duplicates.
+    Returns a tuple (list of Hashtag in the order of the normalized texts, set of the texts that were missing).
+    """
+    texts = normalize_hashtag_texts(texts)
+    if not texts:
+        return [], set()
+
+    hashtags = {hashtag.hashtag_text: hashtag for hashtag in Hashtag.objects.filter(hashtag_text__in=texts)}
+    missing = {text for text in texts if text not in hashtags}
+    if missing:
+        Hashtag.objects.bulk_create([Hashtag(hashtag_text=text) for text in missing], ignore_conflicts=True)
+        hashtags.update({hashtag.hashtag_text: hashtag for hashtag in Hashtag.objects.filter(hashtag_text__in=missing)})
+    return [hashtags[text] for text in texts], missing
+
+
+def add_hashtag_ids_to_post(post_id, hashtag_ids):
+    """
+    Adds hashtags (by id) to a post, skipping the ones it already has.
+    Only the relations actually created update the use counts and the trending counters.
+    """
+    hashtag_ids = set(map(int, hashtag_ids))
+    if not hashtag_ids:
+        return
+    hashtag_ids -= set(PostHashtagRel.objects.filter(post_id=post_id, hashtag_id__in=hashtag_ids).values_list('hashtag_id', flat=True))
+    if not hashtag_ids:
+        return
+    PostHashtagRel.objects.bulk_create([PostHashtagRel(post_id_id=post_id, hashtag_id_id=hashtag_id) for hashtag_id in sorted(hashtag_ids)], ignore_conflicts=True)
+    Hashtag.objects.filter(id__in=hashtag_ids).update(use_count=F('use_count') + 1)
+    record_hashtag_uses(hashtag_ids)
+
+
+def add_hashtags_to_post(post, hashtags):
+    """Adds Hashtag rows to a post (see add_hashtag_ids_to_post)."""
+    add_hashtag_ids_to_post(post.id, [hashtag.id for hashtag in hashtags])
+
+
+def remove_hashtags_from_post(post, hashtag_ids=None):
+    """
+    Deletes the relations of a post to some hashtags (all of them by default), decrements their use counts, and
+    removes their uses from the trending buckets of the time they were added.
+    """
+    rels = PostHashtagRel.objects.filter(post_id=post)
+    if hashtag_ids is not None:
+        rels = rels.filter(hashtag_id__in=hashtag_ids)
+    removed = list(rels.values_list('hashtag_id', 'created_time'))
+    if removed:
+        rels.delete()
+        Hashtag.objects.filter(id__in=[hashtag_id for hashtag_id, _ in removed], use_count__gt=0).update(use_count=F('use_count') - 1)
+        remove_hashtag_uses_at(removed)
+
+
+def set_post_hashtags(post, texts):
+    """
+    Makes the hashtags of a post exactly the given texts, applying only the difference:
+    relations of removed hashtags are deleted, relations of new hashtags are created, the others are left untouched.
+    """
+    hashtags, _ = resolve_hashtags(texts)
+    wanted_ids = {hashtag.id for hashtag in hashtags}
+    current_ids = set(PostHashtagRel.objects.filter(post_id=post).values_list('hashtag_id', flat=True))
+
+    removed_ids = current_ids - wanted_ids
+    if removed_ids:
+        remove_hashtags_from_post(post, removed_ids)
+    add_hashtags_to_post(post, [hashtag for hashtag in hashtags if hashtag.id not in current_ids])
@@ -1,3 +1,148 @@
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from hashtags.models import Hashtag, HashtagTrendBucket, PostHashtagRel
+from hashtags.resolve import resolve_hashtags
+from hashtags.trending import record_hashtag_uses
+from hashtags.views import add_post_hashtags_rel
+from posts.models import Post
+from posts.tests import auth_header
+from users.models import User
+
+
+class TrendingHashtagsTests(TestCase):
+    """Tests for the time-bucketed trending hashtags behind get_popular_hashtags."""
+
+    def setUp(self):
+        self.client = APIClient()
+        cache.clear()
+        self.user = User.objects.create(email='author@bu.edu', display_name='author', password='x')
+
+    def tag_post(self, *hashtags):
+        post = Post.objects.create(title='Post', content='content', author=self.user)
+        add_post_hashtags_rel(post, list(hashtags))
+
+    def popular(self, **params):
+        response = self.client.get('/hashtags/get_popular_hashtags/', params, **auth_header(self.user))
+        self.assertEqual(response.status_code, 200, response.content)
+        return [(item['hashtag_text'], item['count']) for item in response.data['results']]
+
+    def test_top_hashtags_by_window(self):
+        self.tag_post('hockey', 'boston')
+        self.tag_post('hockey')
+        old = Hashtag.objects.create(hashtag_text='marathon')
+        record_hashtag_uses([old.id] * 3, timezone.now() - timedelta(hours=30))
+
+        self.assertEqual(self.popular(), [('hockey', 2), ('boston', 1)])
+        self.assertEqual(dict(self.popular(window='1h')), {'hockey': 2, 'boston': 1})
+        self.assertEqual(self.popular(window='7d'), [('marathon', 3), ('hockey', 2), ('boston', 1)])
+        self.assertEqual(HashtagTrendBucket.objects.get(hashtag=old, bucket_size=3600).count, 3)
+
+    def test_decay_favors_recent_uses(self):
+        self.tag_post('hockey')
+        old = Hashtag.objects.create(hashtag_text='marathon')
+        record_hashtag_uses([old.id] * 3, timezone.now() - timedelta(days=3))
+
+        self.assertEqual(self.popular(window='7d', decay=12), [('hockey', 1), ('marathon', 3)])
+        self.assertEqual(self.client.get('/hashtags/get_popular_hashtags/?window=2h', **auth_header(self.user)).status_code, 400)
+
+    def test_removed_uses_stop_trending(self):
+        self.tag_post('hockey')
+        post = Post.objects.create(title='Post', content='content', author=self.user)
+        add_post_hashtags_rel(post, ['hockey', 'boston', 'marathon'])
+        self.assertEqual(dict(self.popular()), {'hockey': 2, 'boston': 1, 'marathon': 1})  # Ties are ranked by id
+
+        response = self.client.put(f'/posts/update_post/{post.id}/', {'hashtags': '["hockey", "boston"]'}, format='json', **auth_header(self.user))
+        self.assertEqual(response.status_code, 200, response.content)
+        cache.clear()
+        self.assertEqual(self.popular(window='1h'), [('hockey', 2), ('boston', 1)])
+
+        response = self.client.delete(f'/posts/delete_post/{post.id}/', **auth_header(self.user))
+        self.assertEqual(response.status_code, 204, response.content)
+        cache.clear()
+        for window in ('1h', '24h', '7d'):
+            self.assertEqual(self.popular(window=window), [('hockey', 1)])
+        self.assertFalse(HashtagTrendBucket.objects.filter(count__lt=0).exists())
+
+
+class HashtagResolutionTests(TestCase):
+    """Tests for the bulk hashtag resolution used when creating and updating posts."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create(email='author@bu.edu', display_name='author', password='x')
+
+    def test_resolve_normalizes_and_creates_in_bulk(self):
+        Hashtag.objects.create(hashtag_text='hockey')
+        texts = ['#Hockey', ' hockey ', 'Boston  Terriers', ''] + [f'tag{i}' for i in range(20)]
+        with CaptureQueriesContext(connection) as ctx:
+            hashtags, missing = resolve_hashtags(texts)
+        self.assertEqual(len(ctx.captured_queries), 3)
+        self.assertEqual([hashtag.hashtag_text for hashtag in hashtags[:2]], ['hockey', 'boston terriers'])
+        self.assertEqual(len(missing), 21)
+        self.assertEqual(Hashtag.objects.count(), 22)
+
+    def test_update_post_applies_only_the_diff(self):
+        post = Post.objects.create(title='Post', content='content', author=self.user)
+        add_post_hashtags_rel(post, ['hockey', 'boston'])
+        kept = PostHashtagRel.objects.get(hashtag_id__hashtag_text='hockey')
+
+        response = self.client.put(f'/posts/update_post/{post.id}/', {'hashtags': '["Hockey", "#terriers"]'}, format='multipart', **auth_header(self.user))
+        self.assertEqual(response.status_code, 200, response.content)
+        rels = PostHashtagRel.objects.filter(post_id=post).order_by('id')
+        self.assertEqual([rel.hashtag_id.hashtag_text for rel in rels], ['hockey', 'terriers'])
+        self.assertEqual(rels[0].id, kept.id)
+
+    def test_create_bulk(self):
+        Hashtag.objects.create(hashtag_text='hockey')
+        response = self.client.post('/hashtags/hashtags_create_bulk/', [{'hashtag_text': 'Hockey'}, {'hashtag_text': 'boston'}], format='json', **auth_header(self.user))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([item['hashtag_text'] for item in response.data['hashtags']], ['hockey', 'boston'])
+        self.assertEqual([item['hashtag_text'] for item in response.data['added']], ['boston'])
+
+
+class HashtagAutocompleteTests(TestCase):
+    """Tests for the prefix autocomplete endpoint and the hashtag use counts it ranks by."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create(email='author@bu.edu', display_name='author', password='x')
+
+    def test_use_count_follows_post_hashtags(self):
+        post = Post.objects.create(title='Post', content='content', author=self.user)
+        add_post_hashtags_rel(post, ['hockey', 'boston'])
+        add_post_hashtags_rel(post, ['hockey'])  # Already on the post, not counted twice
+        self.client.put(f'/posts/update_post/{post.id}/', {'hashtags': '["hockey"]'}, format='multipart', **auth_header(self.user))
+        self.assertEqual(dict(Hashtag.objects.values_list('hashtag_text', 'use_count')), {'hockey': 1, 'boston': 0})
+
+        self.client.delete(f'/posts/delete_post/{post.id}/', **auth_header(self.user))
+        self.assertEqual(Hashtag.objects.get(hashtag_text='hockey').use_count, 0)
+
+    def test_autocomplete_ranks_by_popularity_and_paginates(self):
+        for text, use_count in [('hockey', 5), ('hockeyeast', 9), ('holiday', 1), ('homecoming', 9), ('boston', 50)]:
+            Hashtag.objects.create(hashtag_text=text, use_count=use_count)
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/hashtags/hashtags_autocomplete/', {'prefix': '#Ho', 'pageSize': 2}, **auth_header(self.user))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['hashtag_text'] for item in response.data['results']], ['hockeyeast', 'homecoming'])
+        self.assertTrue(response.data['hasMore'])
+        self.assertFalse([query for query in ctx.captured_queries if 'COUNT(' in query['sql']])
+
+        response = self.client.get('/hashtags/hashtags_autocomplete/', {'prefix': 'ho', 'pageSize': 2, 'page': 2}, **auth_header(self.user))
+        self.assertEqual([item['hashtag_text'] for item in response.data['results']], ['hockey', 'holiday'])
+        self.assertFalse(response.data['hasMore'])
 
-# Create your tests here.
+    def test_autocomplete_rejects_bad_parameters(self):
+        response = self.client.get('/hashtags/hashtags_autocomplete/', {'prefix': ' # '}, **auth_header(self.user))
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/hashtags/hashtags_autocomplete/', {'prefix': 'ho', 'pageSize': 500}, **auth_header(self.user))
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/hashtags/hashtags_autocomplete/', {'prefix': 'ho', 'page': 0}, **auth_header(self.user))
+        self.assertEqual(response.status_code, 400)
@@ -0,0 +1,131 @@
+import math
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import ExpressionWrapper, F, FloatField, Sum, Value
+from django.db.models.functions import Exp, Extract
+from django.utils import timezone
+
+from .models import HashtagTrendBucket
+
+# Trending hashtags are counted in time buckets when tags are added to posts, instead of scanning PostHashtagRel:
+# per-minute buckets for short windows and per-hour buckets for long ones.
+MINUTE = 60
+HOUR = 3600
+BUCKET_SIZES = (MINUTE, HOUR)
+
+# Window name -> (length, bucket size used to answer it)
+WINDOWS = {
+    '1h': (timedelta(hours=1), MINUTE),
+    '24h': (timedelta(hours=24), HOUR),
+    '7d': (timedelta(days=7), HOUR),
+}
+
+# How long buckets of each size are kept (see prune_trend_buckets)
+RETENTION = {
+    MINUTE: timedelta(hours=2),
+    HOUR: timedelta(days=8),
+}
+
+
+def bucket_start(moment, bucket_size):
+    return moment - timedelta(seconds=int(moment.timestamp()) % bucket_size, microseconds=moment.microsecond)
+
+
+def record_hashtag_uses(hashtag_ids, moment=None):
+    """
+    Adds one use of each hashtag id (repeats count several times) to the current buckets.
+    - A single INSERT ... ON CONFLICT DO UPDATE statement, so concurrent posts never lose increments.
+    """
+    moment = moment or timezone.now()
+    record_hashtag_uses_at((hashtag_id, moment) for hashtag_id in hashtag_ids)
+
+
+def record_hashtag_uses_at(uses, batch_size=1000):
+    """Adds uses given as (hashtag id, moment) pairs to their buckets, e.g. to load past uses in bulk."""
+    counts = Counter((hashtag_id, bucket_size, bucket_start(moment, bucket_size)) for hashtag_id, moment in uses for bucket_size in BUCKET_SIZES)
+    rows = list(counts.items())
+    table = HashtagTrendBucket._meta.db_table
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+        params = [value for (hashtag_id, bucket_size, start_time), count in batch for value in (hashtag_id, bucket_size, start_time, count)]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} (hashtag_id, bucket_size, bucket_start, count) VALUES {", ".join(["(%s, %s, %s, %s)"] * len(batch))} '
+                f'ON CONFLICT (hashtag_id, bucket_size, bucket_start) DO UPDATE SET count = {table}.count + EXCLUDED.count',
+                params,
+            )
+
+
+def remove_hashtag_uses_at(uses):
+    """
+    Removes uses given as (hashtag id, moment) pairs from their buckets, e.g. when tags are removed from a post or
+    the post is deleted, so that they stop trending. Counts never go below 0.
+    """
+    counts = Counter((hashtag_id, bucket_size, bucket_start(moment, bucket_size)) for hashtag_id, moment in uses for bucket_size in BUCKET_SIZES)
+    if not counts:
+        return
+    params = [value for (hashtag_id, bucket_size, start_time), count in counts.items() for value in (hashtag_id, bucket_size, start_time, count)]
+    table = HashtagTrendBucket._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'UPDATE {table} SET count = GREATEST({table}.count - removed.count, 0) '
+            f'FROM (VALUES {", ".join(["(%s::integer, %s::integer, %s::timestamptz, %s::integer)"] * len(counts))}) '
+            f'AS removed (hashtag_id, bucket_size, bucket_start, count) '
+            f'WHERE {table}.hashtag_id = removed.hashtag_id AND {table}.bucket_size = removed.bucket_size '
+            f'AND {table}.bucket_start = removed.bucket_start',
+            params,
+        )
+
+
+def compute_trending(window='24h', limit=10, half_life=None):
+    """
+    Returns the top hashtags of a window as dicts with 'id', 'hashtag_text' and 'count'.
+    - half_life (in hours): also score each use with an exponential decay, exp(-ln(2) * age / half_life),
+      and rank by that 'score' instead of the raw count.
+    """
+    length, bucket_size = WINDOWS[window]
+    now = timezone.now()
+    buckets = HashtagTrendBucket.objects.filter(bucket_size=bucket_size, bucket_start__gte=bucket_start(now - length, bucket_size))
+
+    rows = buckets.values('hashtag_id', 'hashtag__hashtag_text').annotate(total=Sum('count')).filter(total__gt=0)  # Removed uses leave empty buckets
+    if half_life:
+        # Age of the bucket in hours, computed in the database
+        age = (Value(now.timestamp()) - Extract('bucket_start', 'epoch')) / Value(3600.0)
+        decay = Exp(ExpressionWrapper(Value(-math.log(2) / half_life) * age, output_field=FloatField()))
+        rows = rows.annotate(score=Sum(ExpressionWrapper(F('count') * decay, output_field=FloatField()))).order_by('-score', 'hashtag_id')
+    else:
+        rows = rows.order_by('-total', 'hashtag_id')
+
+    result = []
+    for row in rows[:limit]:
+        item = {'id': row['hashtag_id'], 'hashtag_text': row['hashtag__hashtag_text'], 'count': row['total']}
+        if half_life:
+            item['score'] = row['score']
+        result.append(item)
+    return result
+
+
+def get_trending(window='24h', limit=10, half_life=None):
+    """
+    Cached version of compute_trending: the top-K of each window is recomputed at most once per
+    HASHTAG_TRENDING_CACHE_SECONDS, so requests are answered from the cache in constant time.
+    """
+    key = f'hashtags:trending:{window}:{limit}:{half_life}'
+    result = cache.get(key)
+    if result is None:
+        result = compute_trending(window, limit, half_life)
+        cache.set(key, result, settings.HASHTAG_TRENDING_CACHE_SECONDS)
+    return result
+
+
+def prune_trend_buckets():
+    """Deletes the buckets older than their retention period. Returns the number of deleted buckets."""
+    now = timezone.now()
+    deleted = 0
+    for bucket_size, retention in RETENTION.items():
+        deleted += HashtagTrendBucket.objects.filter(bucket_size=bucket_size, bucket_start__lt=now - retention).delete()[0]
+    return deleted
@@ -14,4 +14,5 @@ urlpatterns = [
     path("get_post_hashtags_by_post_id/<int:post_id>/", views.get_post_hashtags_by_post_id),
     path("get_posts_by_hashtag_id/<int:hashtag_id>/", views.get_posts_by_hashtag_id),
     path("get_popular_hashtags/", views.get_popular_hashtags),
+    path("hashtags_autocomplete/", views.hashtags_autocomplete),
 ]
\ No newline at end of file
@@ -5,22 +5,19 @@ from rest_framework import status
 from hashtags.models import Hashtag, PostHashtagRel
 from hashtags.serializer import HashtagSerializer
 from users.decorators import jwt_required
-import jwt
-from django.conf import settings
-from datetime import datetime, timedelta
 from django.db.models import Count
-from posts.serializers import PostSerializer
-from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
+from posts.hydration import hydrate_posts
+from terrierconnect.pagination import paginate, PaginationError
+from hashtags.trending import WINDOWS, get_trending
+from hashtags.resolve import add_hashtag_ids_to_post, add_hashtags_to_post, normalize_hashtag_text, resolve_hashtags, set_post_hashtags
+
+AUTOCOMPLETE_MAX_PAGE_SIZE = 50
 
 # Create your views here.
 @jwt_required # This is a decorator to check if the user has a valid JWT token. Add this decorator to the APIs that you want to protect.
 @api_view(['GET'])
 def hashtags_list(request):
-    # Example: You can get the token from the request header, and then decode the token to get the user information
-    token = request.headers.get('Authorization', '').split(' ')[-1]
-    user_info= jwt.decode(token, settings.SECRET_KEY, algorithms=['HS256'])
-    print(f'user_info', user_info)
-
+    # The token was already verified by @jwt_required: use get_user_info(request) (posts/views.py) for its payload
     hashtags = Hashtag.objects.all()
     serializer = HashtagSerializer(hashtags, many=True)
     return Response(serializer.data)
@@ -28,11 +25,12 @@ def hashtags_list(request):
 @jwt_required
 @api_view(['POST'])
 def hashtags_create(request):
-    hashtag_text = request.data.get('hashtag_text')
-    if Hashtag.objects.filter(hashtag_text=hashtag_text).exists():
+    data = request.data.copy()
+    data['hashtag_text'] = normalize_hashtag_text(request.data.get('hashtag_text'))
+    if Hashtag.objects.filter(hashtag_text=data['hashtag_text']).exists():
         return Response({'error': 'Hashtag with this text already exists'}, status=status.HTTP_400_BAD_REQUEST)
     
-    serializer = HashtagSerializer(data=request.data)
+    serializer = HashtagSerializer(data=data)
     if serializer.is_valid():
         serializer.save()
         return Response(serializer.data, status=status.HTTP_201_CREATED)
@@ -56,6 +54,37 @@ def hashtags_search(request):
     serializer = HashtagSerializer(hashtags, many=True)
     return Response(serializer.data)
 
+@jwt_required
+@api_view(['GET'])
+def hashtags_autocomplete(request):
+    """
+    Suggests hashtags starting with a prefix, most used first.
+    - The prefix is normalized like hashtag texts, so the LIKE 'prefix%' filter uses the varchar_pattern_ops index
+      that Postgres builds for the unique hashtag_text column.
+    - Paged with page/pageSize (at most AUTOCOMPLETE_MAX_PAGE_SIZE suggestions per page), without a total: it would
+      cost a COUNT(*) on every keystroke. hasMore tells whether a next page exists.
+    """
+    prefix = normalize_hashtag_text(request.query_params.get('prefix', ''))
+    if not prefix:
+        return Response({'error': 'prefix parameter is required'}, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        page_size = int(request.query_params.get('pageSize', 10))
+        page = int(request.query_params.get('page', 1))
+    except ValueError:
+        page_size = page = 0
+    if not 0 < page_size <= AUTOCOMPLETE_MAX_PAGE_SIZE:
+        return Response({'error': f'pageSize must be between 1 and {AUTOCOMPLETE_MAX_PAGE_SIZE}'}, status=status.HTTP_400_BAD_REQUEST)
+    if page < 1:
+        return Response({'error': 'Invalid page number.'}, status=status.HTTP_400_BAD_REQUEST)
+
+    # One more row than the page tells whether there is a next page
+    offset = (page - 1) * page_size
+    hashtags = list(Hashtag.objects.filter(hashtag_text__startswith=prefix).order_by('-use_count', 'hashtag_text')[offset:offset + page_size + 1])
+
+    results = [{'id': hashtag.id, 'hashtag_text': hashtag.hashtag_text, 'count': hashtag.use_count} for hashtag in hashtags[:page_size]]
+    return Response({'page': page, 'pageSize': page_size, 'hasMore': len(hashtags) > page_size, 'results': results})
+
 @jwt_required
 @api_view(['PUT'])
 def hashtags_update(request, pk):
@@ -63,7 +92,9 @@ def hashtags_update(request, pk):
         hashtag = Hashtag.objects.get(pk=pk)
     except Hashtag.DoesNotExist:
         return Response(status=status.HTTP_404_NOT_FOUND)
-    serializer = HashtagSerializer(instance=hashtag, data=request.data)
+    data = request.data.copy()
+    data['hashtag_text'] = normalize_hashtag_text(request.data.get('hashtag_text'))
+    serializer = HashtagSerializer(instance=hashtag, data=data)
     if serializer.is_valid():
         serializer.save()
         return Response(serializer.data)
@@ -82,20 +113,12 @@ def hashtags_delete(request, pk):
 @jwt_required
 @api_view(['POST'])
 def hashtags_create_bulk(request):
-    hashtags = request.data
-    hashtags_list = []
-
-    for hashtag in hashtags:
-        hashtag_text = hashtag.get("hashtag_text")
-        if hashtag_text and not Hashtag.objects.filter(hashtag_text=hashtag_text).exists():
-            hashtags_list.append(Hashtag(hashtag_text=hashtag_text))
-
-    hashtags_to_return = Hashtag.objects.filter(hashtag_text__in=[hashtag.get('hashtag_text') for hashtag in hashtags])
-    serializer = HashtagSerializer(hashtags_to_return, many=True)
+    # Resolve all the texts at once, creating the missing hashtags (see hashtags/resolve.py)
+    hashtags, missing = resolve_hashtags([hashtag.get('hashtag_text') for hashtag in request.data])
+    serializer = HashtagSerializer(hashtags, many=True)
 
-    if hashtags_list:
-        Hashtag.objects.bulk_create(hashtags_list)
-        added_serializer = HashtagSerializer(hashtags_list, many=True)
+    if missing:
+        added_serializer = HashtagSerializer([hashtag for hashtag in hashtags if hashtag.hashtag_text in missing], many=True)
         return Response({'message': 'Hashtags created successfully', 'hashtags': serializer.data, 'added': added_serializer.data}, status=status.HTTP_201_CREATED)
     
     return Response({'message': 'No new hashtags to add', 'hashtags': serializer.data}, status=status.HTTP_400_BAD_REQUEST)
@@ -107,137 +130,80 @@ def add_post_hashtags_rel_by_ids(request):
     hashtag_ids = request.data.get('hashtag_ids')
     if not post_id or not hashtag_ids:
         return Response({'error': 'post_id and hashtag_ids are required'}, status=status.HTTP_400_BAD_REQUEST)
-    post_hashtag_rels = []
+    existing_ids = set(Hashtag.objects.filter(id__in=hashtag_ids).values_list('id', flat=True))
     for hashtag_id in hashtag_ids:
-        if not Hashtag.objects.filter(id=hashtag_id).exists():
+        if int(hashtag_id) not in existing_ids:
             return Response({'error': f'Hashtag with id {hashtag_id} does not exist'}, status=status.HTTP_400_BAD_REQUEST)
-        post_hashtag_rels.append(PostHashtagRel(post_id=post_id, hashtag_id=hashtag_id))
-    PostHashtagRel.objects.bulk_create(post_hashtag_rels)
+    add_hashtag_ids_to_post(post_id, hashtag_ids)  # Also updates the use counts and the trending counters
     
     return Response({'message': 'Post-Hashtag relations created successfully'}, status=status.HTTP_201_CREATED)
 
 @jwt_required
 @api_view(['GET'])
 def get_post_hashtags_by_post_id(request, post_id):
-    page = request.query_params.get('page', 1)  # Default to page 1
-    page_size = request.query_params.get('pageSize', 10)  # Default to 10 items per page
-
-    post_hashtag_rels = PostHashtagRel.objects.filter(post_id=post_id)
-    hashtags = [post_hashtag_rel.hashtag_id for post_hashtag_rel in post_hashtag_rels]
+    hashtags = Hashtag.objects.filter(posthashtagrel__post_id=post_id).order_by('posthashtagrel__id')
     
     # Pagination
-    paginator = Paginator(hashtags, page_size)
     try:
-        paginated_hashtags = paginator.page(page)
-    except PageNotAnInteger:
-        return Response({'error': 'Invalid page number'}, status=400)
-    except EmptyPage:
-        return Response({'error': 'Page out of range'}, status=400)
+        paginated_hashtags, pagination = paginate(request, hashtags, empty_page_status=status.HTTP_400_BAD_REQUEST)
+    except PaginationError as e:
+        return Response({'error': str(e)}, status=e.status_code)
     
     serializer = HashtagSerializer(paginated_hashtags, many=True)
 
-    return Response({
-        'page': page,
-        'pageSize': page_size,
-        'totalItems': paginator.count,
-        'totalPages': paginator.num_pages,
-        'results': serializer.data
-    })
+    return Response({**pagination, 'results': serializer.data})
 
 @jwt_required
 @api_view(['GET'])
 def get_posts_by_hashtag_id(request, hashtag_id):
-    page = request.query_params.get('page', 1)  # Default to page 1
-    page_size = request.query_params.get('pageSize', 10)  # Default to 10 items per page
     order_by = request.query_params.get('orderBy', '-post_id__create_time')  # Default to order by create_time in descending order
 
-    post_hashtag_rels = PostHashtagRel.objects.filter(hashtag_id=hashtag_id).order_by(order_by)
-    posts = [post_hashtag_rel.post_id for post_hashtag_rel in post_hashtag_rels]
+    post_hashtag_rels = PostHashtagRel.objects.filter(hashtag_id=hashtag_id).select_related('post_id__author').order_by(order_by)
 
     # Pagination
-    paginator = Paginator(posts, page_size)
     try:
-        paginated_posts = paginator.page(page)
-    except PageNotAnInteger:
-        return Response({'error': 'Invalid page number'}, status=400)
-    except EmptyPage:
-        return Response({'error': 'Page out of range'}, status=400)
-
-    serializer = PostSerializer(paginated_posts, many=True)
-
-    return Response({
-        'page': page,
-        'pageSize': page_size,
-        'totalItems': paginator.count,
-        'totalPages': paginator.num_pages,
-        'results': serializer.data
-    })
+        paginated_rels, pagination = paginate(request, post_hashtag_rels, empty_page_status=status.HTTP_400_BAD_REQUEST)
+    except PaginationError as e:
+        return Response({'error': str(e)}, status=e.status_code)
+
+    # Serialize only the posts of the current page, with their authors and hashtags
+    posts = [post_hashtag_rel.post_id for post_hashtag_rel in paginated_rels]
+
+    return Response({**pagination, 'results': hydrate_posts(posts)})
 
 @jwt_required
 @api_view(['GET'])
 def get_popular_hashtags(request):
-    page = request.query_params.get('page', 1)  # Default to page 1
-    page_size = request.query_params.get('pageSize', 10)  # Default to 10 items per page
-
-    # Get PostHashtagsRel records to only include those created in the last 24 hours.
-    last_24_hours = datetime.now() - timedelta(hours=24)
-    post_hashtag_rels = PostHashtagRel.objects.filter(created_time__gte=last_24_hours)
-    hashtag_objs = [post_hashtag_rel.hashtag_id for post_hashtag_rel in post_hashtag_rels]
-    hashtag_serializer = HashtagSerializer(hashtag_objs, many=True)
-
-    hashtag_count = {}
-    hashtag_text_map = {}
-
-    for hashtag in hashtag_serializer.data:
-        hashtag_id = hashtag.get('id')
-        if hashtag_id in hashtag_count:
-            hashtag_count[hashtag_id] += 1
-        else:
-            hashtag_count[hashtag_id] = 1
-            hashtag_text_map[hashtag_id] = hashtag.get('hashtag_text')
-
-    # Limits the results to the top 10 trending hashtags.
-    sorted_hashtag_count = dict(sorted(hashtag_count.items(), key=lambda item: item[1], reverse=True)[:10])
+    # Optional parameters: window (1h, 24h or 7d), limit (top-K, 10 by default) and decay (half-life in hours)
+    window = request.query_params.get('window', '24h')
+    if window not in WINDOWS:
+        return Response({'error': f'Invalid window, expected one of {", ".join(WINDOWS)}'}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        limit = min(int(request.query_params.get('limit', 10)), 100)
+        half_life = float(request.query_params['decay']) if request.query_params.get('decay') else None
+    except ValueError:
+        return Response({'error': 'Invalid limit or decay'}, status=status.HTTP_400_BAD_REQUEST)
+    if limit < 1 or (half_life is not None and half_life <= 0):
+        return Response({'error': 'Invalid limit or decay'}, status=status.HTTP_400_BAD_REQUEST)
 
-    result = [{'id': key, 'hashtag_text': hashtag_text_map[key], 'count': value} for key, value in sorted_hashtag_count.items()]
+    # Top hashtags from the time-bucketed counters (see hashtags/trending.py)
+    result = get_trending(window, limit, half_life)
 
     # Pagination
-    paginator = Paginator(result, page_size)
     try:
-        paginated_result = paginator.page(page)
-    except PageNotAnInteger:
-        return Response({'error': 'Invalid page number'}, status=400)
-    except EmptyPage:
-        return Response({'error': 'Page out of range'}, status=400)
-
-    return Response({
-        'page': page,
-        'pageSize': page_size,
-        'totalItems': paginator.count,
-        'totalPages': paginator.num_pages,
-        'results': list(paginated_result)
-    })
+        paginated_result, pagination = paginate(request, result, empty_page_status=status.HTTP_400_BAD_REQUEST)
+    except PaginationError as e:
+        return Response({'error': str(e)}, status=e.status_code)
+
+    return Response({**pagination, 'results': paginated_result})
 
 def add_post_hashtags_rel(post, hashtags):
     if not hashtags and len(hashtags) == 0:
         return
-    # Get hashtags id by hashtag_text in the list of hashtags
-    hashtag_instances = []
-    for hashtag_text in hashtags:
-        try:
-            hashtag = Hashtag.objects.get(hashtag_text=hashtag_text)
-        except Hashtag.DoesNotExist:
-            hashtag = None
-        if hashtag:
-            hashtag_instances.append(hashtag)
-        else:
-            new_hashtag = Hashtag.objects.create(hashtag_text=hashtag_text)
-            hashtag_instances.append(new_hashtag)
-    
-    # Create PostHashtagRel objects
-    post_hashtag_rels = []
-    for hashtag_instance in hashtag_instances:
-        post_hashtag_rels.append(PostHashtagRel(post_id=post, hashtag_id=hashtag_instance))
-    
-    PostHashtagRel.objects.bulk_create(post_hashtag_rels)
-    return
\ No newline at end of file
+    # Get or create all the hashtags at once, then create the PostHashtagRel objects
+    hashtag_instances, _ = resolve_hashtags(hashtags)
+    add_hashtags_to_post(post, hashtag_instances)
+
+def update_post_hashtags_rel(post, hashtags):
+    # Replace the hashtags of a post, only adding and removing the relations that changed
+    set_post_hashtags(post, hashtags)
\ No newline at end of file
@@ -0,0 +1,13 @@
+from django.apps import AppConfig
+
+
+class ImagesConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'images'
+
+    def ready(self):
+        # Release the blobs of the image fields when they are replaced or deleted
+        from django.apps import apps
+        from .storage import BLOB_FIELDS, track_blob_references
+        for model_label, field_name in BLOB_FIELDS:
+            track_blob_references(apps.get_model(model_label), field_name)
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from images.pipeline import process_image
+from posts.models import Post
+from users.models import User
+
+# (model, image field, variants field) of every image processed by the pipeline
+IMAGE_FIELDS = [
+    (Post, 'image_url', 'image_variants'),
+    (User, 'avatar_url', 'avatar_variants'),
+]
+
+
+class Command(BaseCommand):
+    help = 'Generates the resized variants of existing post images and avatars.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Regenerate the variants of every image, not only the missing ones.')
+
+    def handle(self, *args, **options):
+        processed = 0
+        for model, field_name, variants_field in IMAGE_FIELDS:
+            rows = model.objects.exclude(**{f'{field_name}__isnull': True}).exclude(**{field_name: ''})
+            if not options['all']:
+                rows = rows.filter(**{f'{variants_field}__isnull': True})
+            for pk in rows.order_by('pk').values_list('pk', flat=True).iterator():
+                process_image(model._meta.label, pk, field_name, variants_field)
+                processed += 1
+        self.stdout.write(self.style.SUCCESS(f'Processed {processed} image(s).'))
@@ -0,0 +1,47 @@
+from collections import Counter
+from datetime import timedelta
+
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from images.models import Blob
+from images.storage import BLOB_FIELDS, delete_orphaned_files, is_blob, lock_blob
+
+
+class Command(BaseCommand):
+    help = 'Recounts the references to each blob of the image storage and deletes the unreferenced ones.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace-minutes', type=int, default=60,
+                            help='Keep unreferenced blobs younger than this, they may belong to a request in progress.')
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would change.')
+
+    def handle(self, *args, **options):
+        references = Counter()
+        for model_label, field_name in BLOB_FIELDS:
+            names = apps.get_model(model_label).objects.values_list(field_name, flat=True).iterator()
+            references.update(name for name in names if is_blob(name))
+
+        fixed = 0
+        orphans = []
+        cutoff = timezone.now() - timedelta(minutes=options['grace_minutes'])
+        for blob in Blob.objects.order_by('id').iterator():
+            count = references.get(blob.name, 0)
+            if count == 0 and blob.created_time < cutoff:
+                orphans.append(blob)
+            elif count != blob.ref_count:
+                fixed += 1
+                if not options['dry_run']:
+                    Blob.objects.filter(pk=blob.pk).update(ref_count=count)
+
+        if not options['dry_run']:
+            for blob in orphans:
+                # Skipped if the blob was stored again since it was counted
+                with transaction.atomic():
+                    lock_blob(blob.name)
+                    deleted, _ = Blob.objects.filter(pk=blob.pk, ref_count=blob.ref_count).delete()
+                if deleted:
+                    delete_orphaned_files(blob.name)
+        self.stdout.write(self.style.SUCCESS(f'Fixed {fixed} reference count(s), deleted {len(orphans)} unreferenced blob(s).'))
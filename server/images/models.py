@@ -0,0 +1,12 @@
+from django.db import models
+
+
+class Blob(models.Model):
+    """A file of the content-addressed storage (see images/storage.py), shared by every row referencing it."""
+    name = models.CharField(max_length=255, unique=True)  # Storage path, derived from the SHA-256 digest of the content
+    size = models.PositiveBigIntegerField()
+    ref_count = models.PositiveIntegerField(default=0)  # Number of rows referencing the blob
+    created_time = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.name
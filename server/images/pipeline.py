@@ -0,0 +1,164 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections, transaction
+from django.dispatch import Signal
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# Uploaded images are stored as-is, then resized variants are generated after the request, in a small thread pool:
+# each variant is written as WebP and JPEG (for clients without WebP support) under IMAGE_VARIANTS_DIR, and their
+# paths and sizes are stored in a JSON field of the model (Post.image_variants, User.avatar_variants).
+# Until they are ready that field is null, and clients fall back to the original image.
+
+# Variant name -> longest side in pixels (smaller images are never upscaled)
+VARIANTS = {
+    'full': 1600,
+    'feed': 640,
+    'thumb': 160,
+}
+
+# Format name (file extension) -> Pillow format and save options
+FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+# Sent with the model class and the pk of the row once its variants are stored
+variants_ready = Signal()
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.IMAGE_VARIANTS_WORKERS, thread_name_prefix='image-variants')
+        return _executor
+
+
+def is_image(file):
+    """Checks that an uploaded file is an image Pillow can read, from its header only (the file stays on disk)."""
+    try:
+        with Image.open(file) as image:
+            image.verify()
+        return True
+    except (OSError, SyntaxError, Image.DecompressionBombError):
+        return False
+    finally:
+        file.seek(0)
+
+
+def _variant_path(name, variant, extension):
+    return f'{settings.IMAGE_VARIANTS_DIR}/{os.path.splitext(name)[0]}/{variant}.{extension}'
+
+
+def _save(path, image, extension):
+    pillow_format, options = FORMATS[extension]
+    if pillow_format == 'JPEG' and image.mode != 'RGB':
+        # JPEG has no alpha channel: flatten transparent images on a white background
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A') if 'A' in image.getbands() else None)
+        image = background
+    buffer = BytesIO()
+    image.save(buffer, pillow_format, **options)
+    if default_storage.exists(path):
+        default_storage.delete(path)
+    return default_storage.save(path, ContentFile(buffer.getvalue()))
+
+
+def generate_variants(name, storage=default_storage):
+    """
+    Creates the resized variants of an image, read from storage and written to default_storage.
+    - JPEG originals are decoded at a reduced scale when possible (Image.draft), and each variant is resized from the
+      previous, larger one, so large camera pictures are cheap to process.
+    Returns a dict {variant: {'width': ..., 'height': ..., 'webp': path, 'jpeg': path}}.
+    Raises:
+    - OSError (including PIL.UnidentifiedImageError) if the file is missing or not an image.
+    """
+    largest = max(VARIANTS.values())
+    with storage.open(name) as file, Image.open(file) as original:
+        original.draft('RGB', (largest, largest))
+        image = ImageOps.exif_transpose(original)  # Apply the camera orientation before dropping the EXIF data
+        image = image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+
+    variants = {}
+    for variant, size in sorted(VARIANTS.items(), key=lambda item: -item[1]):
+        image = image.copy()
+        image.thumbnail((size, size), Image.LANCZOS, reducing_gap=3.0)
+        variants[variant] = {'width': image.width, 'height': image.height}
+        for extension in FORMATS:
+            variants[variant][extension] = _save(_variant_path(name, variant, extension), image, extension)
+    return variants
+
+
+def delete_variants(name):
+    """Deletes the variants of an image."""
+    for variant in VARIANTS:
+        for extension in FORMATS:
+            default_storage.delete(_variant_path(name, variant, extension))
+
+
+def process_image(model_label, pk, field_name, variants_field):
+    """
+    Generates and stores the variants of the image field of a row, unless the image changed in the meantime.
+    - Rows sharing the same (content-addressed) image reuse the variants already generated for it.
+    """
+    model = apps.get_model(model_label)
+    name = model.objects.filter(pk=pk).values_list(field_name, flat=True).first()
+    if not name:
+        return
+    variants = model.objects.filter(**{field_name: name, f'{variants_field}__isnull': False}).values_list(variants_field, flat=True).first()
+    if variants is None:
+        try:
+            variants = generate_variants(name, model._meta.get_field(field_name).storage)
+        except (OSError, Image.DecompressionBombError):
+            logger.exception('Could not generate the variants of %s', name)
+            return
+    if model.objects.filter(pk=pk, **{field_name: name}).update(**{variants_field: variants}):
+        variants_ready.send(sender=model, pk=pk)
+
+
+def _process_in_worker(*args):
+    try:
+        process_image(*args)
+    finally:
+        connections.close_all()  # Worker threads have their own connections
+
+
+def schedule_variants(instance, field_name, variants_field):
+    """
+    Generates the variants of an image field once the current transaction commits, off the request path.
+    - The variants of the previous image are cleared right away, so they are never served for the new one.
+    - With IMAGE_VARIANTS_ASYNC disabled (e.g. in tests) they are generated synchronously on commit.
+    """
+    type(instance).objects.filter(pk=instance.pk).update(**{variants_field: None})
+    setattr(instance, variants_field, None)
+    if not getattr(instance, field_name):
+        return
+
+    args = (instance._meta.label, instance.pk, field_name, variants_field)
+    if settings.IMAGE_VARIANTS_ASYNC:
+        transaction.on_commit(lambda: _get_executor().submit(_process_in_worker, *args))
+    else:
+        transaction.on_commit(lambda: process_image(*args))
+
+
+def variant_urls(variants):
+    """Returns the variants of an image with URLs instead of storage paths, or None if they are not ready."""
+    if not variants:
+        return None
+    return {
+        variant: {key: default_storage.url(value) if key in FORMATS else value for key, value in files.items()}
+        for variant, files in variants.items()
+    }
@@ -0,0 +1,155 @@
+import hashlib
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+from django.db import connection, transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_init, post_save
+from django.utils.deconstruct import deconstructible
+
+from .models import Blob
+from .pipeline import delete_variants
+
+# Uploaded images are stored once per content: the storage hashes each file while copying it, and stores it under
+# BLOB_STORAGE_DIR/<first 2 hex digits>/<sha256>.<ext>. Uploading the same file again reuses the existing blob.
+# Since the content of a name never changes, blob URLs can be cached forever (see images/views.py).
+#
+# Blobs are reference counted: saving a file through the storage takes a reference, and the rows of BLOB_FIELDS
+# release it when their file is replaced or the row is deleted. Files are removed with their last reference.
+# Concurrent saves and releases of the same blob are serialized with a transaction-level advisory lock.
+
+# (model label, file field) of every field stored in the blob storage
+BLOB_FIELDS = [
+    ('posts.Post', 'image_url'),
+    ('users.User', 'avatar_url'),
+]
+
+HASH_CHUNK_SIZE = 64 * 1024
+
+
+def lock_blob(name):
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_advisory_xact_lock(hashtext(%s))', [name])
+
+
+@deconstructible
+class BlobStorage(FileSystemStorage):
+    """FileSystemStorage storing each distinct file once, under the digest of its content, with reference counting."""
+
+    def _save(self, name, content):
+        extension = os.path.splitext(name)[1].lower()
+        digest, size, temp_path = self._hash(content)
+        name = f'{settings.BLOB_STORAGE_DIR}/{digest[:2]}/{digest}{extension}'
+
+        with transaction.atomic():
+            lock_blob(name)
+            blob, _ = Blob.objects.get_or_create(name=name, defaults={'size': size})
+            if self.exists(name):
+                if temp_path:
+                    os.remove(temp_path)
+            else:
+                path = self.path(name)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                file_move_safe(temp_path or content.temporary_file_path(), path)
+                if self.file_permissions_mode is not None:
+                    os.chmod(path, self.file_permissions_mode)
+            Blob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') + 1)
+        return name
+
+    def _hash(self, content):
+        """
+        Hashes the content in chunks, so it is never fully loaded in memory.
+        Uploads already on disk are only read (and moved into place afterwards); others are copied to a temporary
+        file of the storage directory at the same time.
+        Returns a tuple (hex digest, size, temporary path or None).
+        """
+        digest = hashlib.sha256()
+        size = 0
+        content.seek(0)
+        if hasattr(content, 'temporary_file_path'):
+            for chunk in content.chunks(HASH_CHUNK_SIZE):
+                digest.update(chunk)
+                size += len(chunk)
+            return digest.hexdigest(), size, None
+
+        os.makedirs(self.path(settings.BLOB_STORAGE_DIR), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=self.path(settings.BLOB_STORAGE_DIR), suffix='.upload')
+        with os.fdopen(fd, 'wb') as temp_file:
+            for chunk in content.chunks(HASH_CHUNK_SIZE):
+                digest.update(chunk)
+                size += len(chunk)
+                temp_file.write(chunk)
+        return digest.hexdigest(), size, temp_path
+
+    def get_available_name(self, name, max_length=None):
+        # The final name only depends on the content, so there is no collision to avoid
+        return name
+
+
+blob_storage = BlobStorage()
+
+
+def get_blob_storage():
+    return blob_storage
+
+
+def is_blob(name):
+    return bool(name) and name.startswith(f'{settings.BLOB_STORAGE_DIR}/')
+
+
+def release(name):
+    """Releases one reference to a blob. The last reference deletes the file and its variants once committed."""
+    if not is_blob(name):
+        return
+    with transaction.atomic():
+        lock_blob(name)
+        blob = Blob.objects.filter(name=name).first()
+        if blob is None:
+            return
+        if blob.ref_count > 1:
+            Blob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') - 1)
+            return
+        blob.delete()
+    transaction.on_commit(lambda: delete_orphaned_files(name))
+
+
+def delete_orphaned_files(name):
+    """Deletes the file and variants of a blob, unless it was stored again in the meantime."""
+    with transaction.atomic():
+        lock_blob(name)
+        if not Blob.objects.filter(name=name).exists():
+            blob_storage.delete(name)
+            delete_variants(name)
+
+
+def _file_name(instance, field_name):
+    # Read from __dict__ so deferred fields are not loaded (None when the field is deferred)
+    value = instance.__dict__.get(field_name)
+    return getattr(value, 'name', value)
+
+
+def _remember_name(instance, field_name):
+    setattr(instance, f'_blob_{field_name}', _file_name(instance, field_name))
+
+
+def track_blob_references(model, field_name):
+    """Releases the blob of a file field when it is replaced or when the row is deleted."""
+
+    def remember(sender, instance, **kwargs):
+        _remember_name(instance, field_name)
+
+    def release_replaced(sender, instance, **kwargs):
+        previous = getattr(instance, f'_blob_{field_name}', None)
+        if previous and previous != _file_name(instance, field_name):
+            release(previous)
+        _remember_name(instance, field_name)
+
+    def release_deleted(sender, instance, **kwargs):
+        release(_file_name(instance, field_name))
+
+    post_init.connect(remember, sender=model, weak=False)
+    post_save.connect(release_replaced, sender=model, weak=False)
+    post_delete.connect(release_deleted, sender=model, weak=False)
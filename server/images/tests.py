@@ -0,0 +1,243 @@
+import shutil
+import tempfile
+from io import BytesIO, StringIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from PIL import Image
+from rest_framework.test import APIClient
+
+from images.models import Blob
+from images.pipeline import VARIANTS, generate_variants
+from posts.models import Post
+from posts.tests import auth_header
+from users import authentication
+from users.models import User
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+def make_image(size=(2400, 1200), image_format='JPEG', name='photo.jpg', color='navy'):
+    buffer = BytesIO()
+    Image.new('RGB', size, color).save(buffer, image_format)
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type=f'image/{image_format.lower()}')
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, IMAGE_VARIANTS_ASYNC=False)
+class ImagePipelineTests(TestCase):
+    """Tests for the resized variants of post images and avatars."""
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create(email='author@bu.edu', display_name='author', password='x')
+
+    def test_generate_variants(self):
+        name = default_storage.save('post_media/photo.jpg', make_image())
+        variants = generate_variants(name)
+
+        self.assertEqual(set(variants), set(VARIANTS))
+        self.assertEqual((variants['feed']['width'], variants['feed']['height']), (640, 320))
+        self.assertEqual((variants['thumb']['width'], variants['thumb']['height']), (160, 80))
+        with default_storage.open(variants['thumb']['webp']) as file, Image.open(file) as image:
+            self.assertEqual((image.format, image.size), ('WEBP', (160, 80)))
+        with default_storage.open(variants['full']['jpeg']) as file, Image.open(file) as image:
+            self.assertEqual((image.format, image.size), ('JPEG', (1600, 800)))
+
+    def test_small_images_are_not_upscaled(self):
+        name = default_storage.save('post_media/small.png', make_image((100, 50), 'PNG', 'small.png'))
+        variants = generate_variants(name)
+        self.assertEqual((variants['full']['width'], variants['thumb']['width']), (100, 100))
+
+    def test_post_upload_exposes_variant_urls(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/posts/add_post/', {'title': 'Post', 'content': 'content', 'image_url': make_image()},
+                                        format='multipart', **auth_header(self.user))
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertIsNone(response.data['image_variants'])  # Generated after the response
+
+        post = Post.objects.get()
+        response = self.client.get(f'/posts/get_post_detail/{post.id}/', **auth_header(self.user))
+        self.assertTrue(response.data['image_variants']['feed']['webp'].startswith('/media/variants/blobs/'))
+
+        # Replacing the image replaces the variants
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.put(f'/posts/update_post/{post.id}/', {'image_url': make_image((800, 800), name='square.jpg')},
+                                       format='multipart', **auth_header(self.user))
+        self.assertEqual(response.status_code, 200, response.content)
+        post.refresh_from_db()
+        self.assertEqual(post.image_variants['feed']['height'], 640)
+
+    def test_json_update_keeps_the_image(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/posts/add_post/', {'title': 'Post', 'content': 'content', 'image_url': make_image()},
+                                        format='multipart', **auth_header(self.user))
+        post = Post.objects.get()
+        image_name = post.image_url.name
+
+        # editpost.js sends a JSON body, without files
+        response = self.client.put(f'/posts/update_post/{post.id}/', {'title': 'Edited', 'content': 'edited', 'hashtags': '["terriers"]'},
+                                   format='json', **auth_header(self.user))
+        self.assertEqual(response.status_code, 200, response.content)
+        post.refresh_from_db()
+        self.assertEqual((post.title, post.image_url.name), ('Edited', image_name))
+        self.assertEqual(list(post.posthashtagrel_set.values_list('hashtag_id__hashtag_text', flat=True)), ['terriers'])
+
+    def test_avatar_must_be_an_image(self):
+        avatar = SimpleUploadedFile('avatar.png', b'not an image', content_type='image/png')
+        response = self.client.post('/users/register', {
+            'email': 'new@bu.edu', 'username': 'new', 'password': 'Terriers#2024', 'confirmPassword': 'Terriers#2024', 'avatar': avatar,
+        }, format='multipart')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(User.objects.filter(email='new@bu.edu').exists())
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, IMAGE_VARIANTS_ASYNC=False)
+class BlobStorageTests(TestCase):
+    """Tests for the content-addressed, reference-counted storage of post images and avatars."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create(email='author@bu.edu', display_name='author', password='x')
+
+    def add_post(self, image):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/posts/add_post/', {'title': 'Post', 'content': 'content', 'image_url': image},
+                                        format='multipart', **auth_header(self.user))
+        self.assertEqual(response.status_code, 201, response.content)
+        return Post.objects.get(pk=response.data['id'])
+
+    def test_identical_uploads_share_one_blob(self):
+        first = self.add_post(make_image(name='a.jpg'))
+        second = self.add_post(make_image(name='b.jpg'))
+        other = self.add_post(make_image(color='red'))
+
+        self.assertEqual(first.image_url.name, second.image_url.name)
+        self.assertTrue(first.image_url.name.startswith('blobs/'))
+        self.assertEqual(second.image_variants, first.image_variants)  # Reused, not generated again
+        self.assertEqual(Blob.objects.get(name=first.image_url.name).ref_count, 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertEqual(Blob.objects.get(name=second.image_url.name).ref_count, 1)
+        self.assertTrue(default_storage.exists(second.image_url.name))
+
+        name, variant = second.image_url.name, second.image_variants['thumb']['webp']
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(Blob.objects.filter(name=name).exists())
+        self.assertFalse(default_storage.exists(name))
+        self.assertFalse(default_storage.exists(variant))
+        self.assertTrue(default_storage.exists(other.image_url.name))
+
+    def test_replaced_avatar_is_released(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.put('/users/update_profile/', {'avatar_url': make_image(name='me.jpg')}, format='multipart', **auth_header(self.user))
+        self.user.refresh_from_db()
+        old_avatar = self.user.avatar_url.name
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.put('/users/update_profile/', {'avatar_url': make_image(color='red', name='me.jpg')}, format='multipart', **auth_header(self.user))
+        self.assertEqual(response.status_code, 200, response.content)
+        self.user.refresh_from_db()
+        self.assertNotEqual(self.user.avatar_url.name, old_avatar)
+        self.assertFalse(default_storage.exists(old_avatar))
+        self.assertEqual(list(Blob.objects.values_list('name', flat=True)), [self.user.avatar_url.name])
+
+    def test_stale_cached_user_releases_the_replaced_avatar(self):
+        post = self.add_post(make_image(name='shared.jpg'))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.put('/users/update_profile/', {'avatar_url': make_image(name='me.jpg')}, format='multipart', **auth_header(self.user))
+        stale_user = User.objects.get(pk=self.user.pk)  # Same image as the post: its blob has 2 references
+        self.assertEqual(stale_user.avatar_url.name, post.image_url.name)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.put('/users/update_profile/', {'avatar_url': make_image(color='red')}, format='multipart', **auth_header(self.user))
+        replaced = User.objects.get(pk=self.user.pk).avatar_url.name
+
+        # Another worker still has the user with the first avatar in its cache
+        authentication.get_cache().set(authentication._user_key(self.user.pk), stale_user)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.put('/users/update_profile/', {'avatar_url': make_image(color='green')}, format='multipart', **auth_header(self.user))
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertTrue(default_storage.exists(post.image_url.name))
+        self.assertEqual(Blob.objects.get(name=post.image_url.name).ref_count, 1)
+        self.assertFalse(Blob.objects.filter(name=replaced).exists())
+        self.assertFalse(default_storage.exists(replaced))
+
+    def test_blobs_are_served_as_immutable(self):
+        post = self.add_post(make_image())
+        response = self.client.get(f'/media/{post.image_url.name}')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('immutable', response['Cache-Control'])
+
+    def test_reconcile_blobs(self):
+        post = self.add_post(make_image())
+        Blob.objects.update(ref_count=5)
+        orphan = Blob.objects.create(name='blobs/00/orphan.jpg', size=1)
+        Blob.objects.filter(pk=orphan.pk).update(created_time=orphan.created_time.replace(year=2000))
+
+        call_command('reconcile_blobs', stdout=StringIO())
+        self.assertEqual(list(Blob.objects.values_list('name', 'ref_count')), [(post.image_url.name, 1)])
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, MEDIA_X_ACCEL_REDIRECT_PREFIX='')
+class MediaServingTests(TestCase):
+    """Tests for the media view: conditional requests, byte ranges and X-Accel-Redirect."""
+
+    def setUp(self):
+        self.content = bytes(range(256)) * 4
+        self.name = default_storage.save('post_media/data.bin', ContentFile(self.content))
+        self.url = f'/media/{self.name}'
+
+    def tearDown(self):
+        default_storage.delete(self.name)
+
+    def test_full_file(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertIn('max-age=', response['Cache-Control'])
+        self.assertNotIn('immutable', response['Cache-Control'])
+        self.assertTrue(response['ETag'] and response['Last-Modified'])
+
+    def test_conditional_get(self):
+        response = self.client.get(self.url)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH='"other"').status_code, 200)
+
+    def test_byte_ranges(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 10-19/{len(self.content)}')
+        self.assertEqual(b''.join(response.streaming_content), self.content[10:20])
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-5')
+        self.assertEqual(b''.join(response.streaming_content), self.content[-5:])
+
+        response = self.client.get(self.url, HTTP_RANGE=f'bytes={len(self.content)}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.content)}')
+
+        # A range is only honored if the file didn't change since the client's copy
+        response = self.client.get(self.url, HTTP_RANGE='bytes=10-19', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_paths_outside_media_root(self):
+        self.assertEqual(self.client.get('/media/../manage.py').status_code, 404)
+        self.assertEqual(self.client.get('/media/post_media/missing.bin').status_code, 404)
+
+    @override_settings(MEDIA_X_ACCEL_REDIRECT_PREFIX='/protected-media/')
+    def test_x_accel_redirect(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected-media/{self.name}')
+        self.assertEqual(response.content, b'')
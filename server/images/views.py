@@ -0,0 +1,139 @@
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from django.views.decorators.http import require_safe
+
+# Blobs and their variants never change once written (their names derive from the content), so they can be cached
+# by browsers and proxies for a year without revalidation.
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+# A single byte range; requests for several ranges get the whole file, as RFC 9110 allows
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def is_immutable(path):
+    return path.startswith((f'{settings.BLOB_STORAGE_DIR}/', f'{settings.IMAGE_VARIANTS_DIR}/{settings.BLOB_STORAGE_DIR}/'))
+
+
+def _cache_headers(path, stat):
+    return {
+        'Cache-Control': IMMUTABLE_CACHE_CONTROL if is_immutable(path) else f'public, max-age={settings.MEDIA_CACHE_SECONDS}',
+        'ETag': f'"{int(stat.st_mtime):x}-{stat.st_size:x}"',  # Same format as nginx
+        'Last-Modified': http_date(stat.st_mtime),
+        'Accept-Ranges': 'bytes',
+    }
+
+
+def _parse_range(header, size):
+    """
+    Parses a Range header against a file size.
+    Returns (first byte, last byte) of the requested range, or None to send the whole file.
+    Raises:
+    - ValueError if the range is not satisfiable.
+    """
+    match = RANGE_RE.match(header.strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if not first:
+        # Suffix range: the last N bytes
+        if int(last) == 0:
+            raise ValueError('Empty suffix range')
+        return max(size - int(last), 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if last and int(last) < start:
+        return None  # Invalid range, ignored
+    if start >= size:
+        raise ValueError('Range starts after the end of the file')
+    return start, end
+
+
+class _FileRange:
+    """File-like object reading at most `length` bytes from the current position of a file."""
+
+    def __init__(self, file, length):
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+@require_safe
+def serve_media(request, path):
+    """
+    Serves a file of MEDIA_ROOT.
+    - Conditional requests (If-None-Match / If-Modified-Since) are answered with 304, and single byte ranges with 206.
+    - Whole files are sent with FileResponse, which the WSGI server streams with sendfile() when it supports it.
+    - With MEDIA_X_ACCEL_REDIRECT_PREFIX set, the file is left to nginx through an X-Accel-Redirect header.
+    - Content-addressed files (blobs and their variants) are sent with immutable far-future caching headers.
+    """
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404('File not found')
+    content_type = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+
+    if settings.MEDIA_X_ACCEL_REDIRECT_PREFIX:
+        # nginx serves the file (with its own ETag, conditional and range handling), and keeps our Cache-Control
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = settings.MEDIA_X_ACCEL_REDIRECT_PREFIX + quote(path)
+        response['Cache-Control'] = IMMUTABLE_CACHE_CONTROL if is_immutable(path) else f'public, max-age={settings.MEDIA_CACHE_SECONDS}'
+        return response
+
+    try:
+        stat = os.stat(full_path)
+    except OSError:
+        raise Http404('File not found')
+    if not os.path.isfile(full_path):
+        raise Http404('File not found')
+
+    headers = _cache_headers(path, stat)
+    not_modified = get_conditional_response(request, etag=headers['ETag'], last_modified=int(stat.st_mtime))
+    if not_modified is not None:
+        for header in ('Cache-Control', 'ETag', 'Last-Modified'):
+            not_modified[header] = headers[header]
+        return not_modified
+
+    byte_range = None
+    if_range = request.headers.get('If-Range')
+    if 'Range' in request.headers and if_range in (None, headers['ETag'], headers['Last-Modified']):
+        try:
+            byte_range = _parse_range(request.headers['Range'], stat.st_size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{stat.st_size}'
+            return response
+
+    if request.method == 'HEAD':
+        response = HttpResponse(content_type=content_type)
+        response['Content-Length'] = stat.st_size
+    elif byte_range is None:
+        response = FileResponse(open(full_path, 'rb'), content_type=content_type)
+    else:
+        start, end = byte_range
+        file = open(full_path, 'rb')
+        file.seek(start)
+        response = FileResponse(_FileRange(file, end - start + 1), content_type=content_type, status=206)
+        response['Content-Length'] = end - start + 1
+        response['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+
+    for header, value in headers.items():
+        response[header] = value
+    return response
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class PostsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'posts'
+
+    def ready(self):
+        # Register the signal receivers that invalidate the search cache and the cached responses
+        from . import cache_invalidation, search_cache  # noqa: F401
@@ -0,0 +1,109 @@
+from django.http import JsonResponse
+from rest_framework import status
+
+from terrierconnect.db.routing import use_primary
+from terrierconnect.pagination import apaginate, PaginationError
+from terrierconnect.response_cache import cached_response
+from users.authentication import aauthenticate_request
+from users.decorators import async_get_view
+from .comment_tree import abuild_comment_tree
+from .hydration import aload_posts, ahydrate_posts
+from .models import Comment, Post
+from .search import search_posts
+from .search_cache import get_cached_results, set_cached_results, normalize_query
+from .timelines import aget_feed_sources, aload_feed_posts
+from .views import get_comment_keyset, get_comment_tree_limits
+
+# Async versions of the read-heavy endpoints of posts/views.py, with the same parameters and responses.
+# They are routed instead of the sync views when ASYNC_READ_VIEWS is on (see posts/urls.py), which is meant for
+# ASGI deployments: while a query runs, the worker keeps serving other requests instead of blocking.
+# Queries use the async ORM; the caches (local memory) and the serializers are called directly, as they don't wait
+# on the database.
+
+
+@async_get_view
+async def list_posts(request):
+    flag = request.GET.get('flag', 'all')  # Default to 'all'
+
+    user = None
+    if flag == 'following':
+        try:
+            user, _ = await aauthenticate_request(request)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=status.HTTP_401_UNAUTHORIZED)
+
+    try:
+        if user:
+            # Read the precomputed timeline of the current user
+            feed_rows, pagination = await apaginate(request, await aget_feed_sources(user), keyset=('-create_time', '-post_id'))
+            paginated_posts = await aload_feed_posts(feed_rows)
+        else:
+            posts = Post.objects.all().select_related('author').order_by('-create_time')
+            paginated_posts, pagination = await apaginate(request, posts, keyset=('-create_time', '-id'))
+    except PaginationError as e:
+        return JsonResponse({'error': str(e)}, status=e.status_code)
+
+    return JsonResponse({**pagination, 'results': await ahydrate_posts(paginated_posts)})
+
+
+# Pinned to the primary: followers open new posts from their feed right after they are created
+@use_primary
+@cached_response('post:{post_id}', authenticated=True, cache_body=True)
+@async_get_view
+async def get_post_detail(request, post_id):
+    try:
+        await aauthenticate_request(request)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=status.HTTP_401_UNAUTHORIZED)
+
+    try:
+        post = await Post.objects.select_related('author').aget(pk=post_id)
+    except Post.DoesNotExist:
+        return JsonResponse({'error': 'Post not found'}, status=status.HTTP_404_NOT_FOUND)
+
+    return JsonResponse((await ahydrate_posts([post]))[0])
+
+
+@async_get_view
+async def full_text_search(request):
+    query = normalize_query(request.GET.get('query', ''))
+    order_by = request.GET.get('orderBy', '-create_time')
+
+    if not query:
+        return JsonResponse({'error': 'No query parameter provided'}, status=status.HTTP_400_BAD_REQUEST)
+
+    # Serve the ids of the page from the search cache when possible (see posts/search_cache.py)
+    page = request.GET.get('page', 1)
+    page_size = request.GET.get('pageSize', 10)
+    cached, cache_key = get_cached_results(query, order_by, page, page_size)
+    if cached is not None:
+        return JsonResponse({**cached['pagination'], 'results': await ahydrate_posts(await aload_posts(cached['ids']))})
+
+    posts = search_posts(query, order_by).select_related('author')
+    try:
+        paginated_posts, pagination = await apaginate(request, posts, empty_page_status=status.HTTP_400_BAD_REQUEST)
+    except PaginationError as e:
+        return JsonResponse({'error': str(e)}, status=e.status_code)
+
+    set_cached_results(cache_key, [post.id for post in paginated_posts], pagination)
+    return JsonResponse({**pagination, 'results': await ahydrate_posts(paginated_posts)})
+
+
+@cached_response('comments:{post_id}', cache_body=True)
+@async_get_view
+async def list_comments(request, post_id):
+    order_by = request.GET.get('orderBy', 'create_time')
+    try:
+        max_depth, max_replies = get_comment_tree_limits(request)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    comments = Comment.objects.filter(post_id=post_id, parent__isnull=True).select_related('author').order_by(order_by)
+
+    try:
+        keyset = get_comment_keyset(request, order_by)
+        paginated_comments, pagination = await apaginate(request, comments, keyset=keyset, empty_page_status=status.HTTP_400_BAD_REQUEST)
+    except PaginationError as e:
+        return JsonResponse({'error': str(e)}, status=e.status_code)
+
+    return JsonResponse({**pagination, 'results': await abuild_comment_tree(paginated_comments, max_depth, max_replies)})
@@ -0,0 +1,97 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from hashtags.models import Hashtag, PostHashtagRel
+from images.pipeline import variants_ready
+from terrierconnect.response_cache import invalidate
+from users.models import User, UserFollowRel
+from .map_clusters import tile_resources
+from .models import Comment, Post
+
+# Invalidation of the cached responses (see terrierconnect/response_cache.py) of the endpoints showing:
+# - 'post:<id>': a post, with its author, hashtags and number of comments (get_post_detail)
+# - 'comments:<post id>': the comment threads of a post, with their authors (list_comments)
+# - 'user:<id>': a profile, with its counters (get_user_info_by_id)
+# - 'followers:<user id>': the followers of a user, with their profiles (list_followers), and their ids (follow_graph)
+# - 'following:<user id>': the ids of the users followed by a user (users/follow_graph.py)
+# - 'tile:<zoom>/<x>/<y>': the map clusters of a tile, at every zoom level of the post's location (map_clusters)
+# Counters are updated with UPDATE statements, which don't send signals: the rows counted are watched instead.
+
+
+@receiver(pre_save, sender=Post)
+def remember_post_location(sender, instance, **kwargs):
+    # A moved post leaves the tiles of its previous location
+    instance._location_before = None
+    if instance.pk:
+        instance._location_before = Post.objects.filter(pk=instance.pk, latitude__isnull=False).values_list('latitude', 'longitude').first()
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def invalidate_post(sender, instance, signal, **kwargs):
+    resources = [f'post:{instance.pk}', f'user:{instance.author_id}']  # posts_count
+    if signal is post_delete:
+        resources.append(f'comments:{instance.pk}')
+    locations = {getattr(instance, '_location_before', None)}
+    if instance.latitude is not None:
+        locations.add((instance.latitude, instance.longitude))
+    for location in locations - {None}:
+        resources += tile_resources(*location)
+    invalidate(*resources)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def invalidate_comment(sender, instance, **kwargs):
+    invalidate(f'comments:{instance.post_id}', f'post:{instance.post_id}')  # comments_count
+
+
+@receiver(post_save, sender=PostHashtagRel)
+@receiver(post_delete, sender=PostHashtagRel)
+def invalidate_post_hashtag(sender, instance, **kwargs):
+    invalidate(f'post:{instance.post_id_id}')
+
+
+@receiver(post_save, sender=Hashtag)
+def invalidate_hashtag(sender, instance, created, **kwargs):
+    if not created:
+        post_ids = PostHashtagRel.objects.filter(hashtag_id=instance.pk).values_list('post_id', flat=True)
+        invalidate(*(f'post:{post_id}' for post_id in post_ids))
+
+
+@receiver(post_save, sender=UserFollowRel)
+@receiver(post_delete, sender=UserFollowRel)
+def invalidate_follow(sender, instance, **kwargs):
+    invalidate(f'followers:{instance.following_id}', f'following:{instance.follower_id}',
+               f'user:{instance.following_id}', f'user:{instance.follower_id}')
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user(sender, instance, **kwargs):
+    invalidate_profile(instance.pk)
+
+
+@receiver(variants_ready, sender=User)
+def invalidate_user_avatar(sender, pk, **kwargs):
+    # The avatar variants are stored with update(), which doesn't send post_save
+    invalidate_profile(pk)
+
+
+@receiver(variants_ready, sender=Post)
+def invalidate_post_image(sender, pk, **kwargs):
+    invalidate(f'post:{pk}')
+
+
+def invalidate_profile(user_id):
+    # The profile is shown in its posts, in the comment threads it took part in and in the followers of the users it
+    # follows. Profiles change rarely, so the reads to find them are cheap overall.
+    post_ids = Post.objects.filter(author_id=user_id).values_list('id', flat=True)
+    commented_post_ids = Comment.objects.filter(author_id=user_id).values_list('post_id', flat=True).distinct()
+    following_ids = UserFollowRel.objects.filter(follower_id=user_id).values_list('following_id', flat=True)
+    invalidate(
+        f'user:{user_id}',
+        *(f'post:{post_id}' for post_id in post_ids),
+        *(f'comments:{post_id}' for post_id in commented_post_ids),
+        *(f'followers:{following_id}' for following_id in following_ids),
+    )
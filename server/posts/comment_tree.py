@@ -0,0 +1,107 @@
+from collections import defaultdict
+
+from django.db.models import Count, F, Window
+from django.db.models.functions import RowNumber
+
+from terrierconnect.pagination import encode_cursor
+from .models import Comment, Post
+from .serializers import CommentSerializer
+
+
+def build_comment_tree(comments, max_depth=None, max_replies=None):
+    """
+    Serializes comments together with their nested replies, in the CommentSerializer response shape.
+    - All the threads the comments belong to are loaded with a single query (using Comment.root),
+      then the nesting is assembled in memory in O(n).
+    - max_depth: number of reply levels to include below the given comments (None for no limit).
+    - max_replies: number of replies to include per comment (None for no limit).
+    A comment whose replies were cut by either limit gets 'hasMoreReplies': True and a 'repliesCursor'
+    to pass as cursor= to the list_replies endpoint to load the rest.
+    """
+    comments = list(comments)
+    if not comments:
+        return []
+    return _assemble_tree(comments, list(_thread_replies(comments)), max_depth, max_replies)
+
+
+async def abuild_comment_tree(comments, max_depth=None, max_replies=None):
+    """Same as build_comment_tree, for async views: the threads are loaded with the async ORM."""
+    comments = list(comments)
+    if not comments:
+        return []
+    return _assemble_tree(comments, [reply async for reply in _thread_replies(comments)], max_depth, max_replies)
+
+
+def _thread_replies(comments):
+    # Every comment of the threads the comments belong to, in one query
+    thread_ids = {comment.root_id or comment.id for comment in comments}
+    return Comment.objects.filter(root_id__in=thread_ids).select_related('author').order_by('create_time', 'id')
+
+
+def _assemble_tree(comments, replies, max_depth, max_replies):
+    replies_by_parent = defaultdict(list)
+    for reply in replies:
+        replies_by_parent[reply.parent_id].append(reply)
+
+    # Walk down from the given comments, keeping only the replies within the limits
+    shown_replies = {}
+    truncated = {}
+    to_visit = [(comment, 0) for comment in comments]
+    visible = []
+    while to_visit:
+        comment, depth = to_visit.pop()
+        visible.append(comment)
+        replies = replies_by_parent.get(comment.id, [])
+        if not replies:
+            continue
+        if max_depth is not None and depth >= max_depth:
+            truncated[comment.id] = ''  # Empty cursor: load the replies from the first one
+            continue
+        if max_replies is not None and len(replies) > max_replies:
+            replies = replies[:max_replies]
+            truncated[comment.id] = encode_cursor([replies[-1].create_time, replies[-1].id], 'next')
+        shown_replies[comment.id] = replies
+        to_visit.extend((reply, depth + 1) for reply in replies)
+
+    # Serialize every visible comment in one pass, then link the replies to their parents
+    data_by_id = {item['id']: item for item in CommentSerializer(visible, many=True).data}
+    for comment_id, replies in shown_replies.items():
+        data_by_id[comment_id]['replies'] = [data_by_id[reply.id] for reply in replies]
+    for comment_id, cursor in truncated.items():
+        data_by_id[comment_id]['hasMoreReplies'] = True
+        data_by_id[comment_id]['repliesCursor'] = cursor
+
+    return [data_by_id[comment.id] for comment in comments]
+
+
+def build_comment_previews(post_ids, limit=1):
+    """
+    Serializes the number of comments and the latest `limit` top-level comments of each post, for feed cards, in
+    three queries whatever the number of posts:
+    - the counts come from the denormalized Post.comments_count;
+    - the latest comments of every post with one ROW_NUMBER() window over the (post, parent) index;
+    - which of them have replies, with one grouped query. Their replies aren't included: like the comments cut by
+      maxDepth in build_comment_tree, they get 'hasMoreReplies' and an empty 'repliesCursor' for list_replies.
+    Returns a dict post id -> {'post_id', 'comments_count', 'latest_comments'}, without the posts that don't exist.
+    """
+    previews = {
+        post_id: {'post_id': post_id, 'comments_count': comments_count, 'latest_comments': []}
+        for post_id, comments_count in Post.objects.filter(id__in=post_ids).values_list('id', 'comments_count')
+    }
+    if not previews or limit < 1:
+        return previews
+
+    latest = list(Comment.objects.filter(post_id__in=previews.keys(), parent__isnull=True).annotate(
+        position=Window(RowNumber(), partition_by=F('post_id'), order_by=[F('create_time').desc(), F('id').desc()]),
+    ).filter(position__lte=limit).select_related('author').order_by('post_id', 'position'))
+    if not latest:
+        return previews
+
+    replied = set(Comment.objects.filter(parent_id__in=[comment.id for comment in latest]).order_by()
+                  .values('parent_id').annotate(replies=Count('id')).values_list('parent_id', flat=True))
+    for comment, data in zip(latest, CommentSerializer(latest, many=True).data):
+        if comment.id in replied:
+            data['hasMoreReplies'] = True
+            data['repliesCursor'] = ''
+        previews[comment.post_id]['latest_comments'].append(data)
+    return previews
@@ -0,0 +1,58 @@
+from django.db.models import Count, F, Max, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+
+from hashtags.models import Hashtag, PostHashtagRel
+from terrierconnect.response_cache import invalidate_all
+from users.models import User, UserFollowRel
+from .models import Comment, Post
+
+# Denormalized counters: (model, counter field, counted model, foreign key of the counted model to the first one).
+# Views change them with adjust_counter() in the transaction that creates or deletes the counted rows, so reading a
+# count never needs a COUNT(*); reconcile_counters() repairs any drift (e.g. after cascading deletes of users).
+COUNTERS = [
+    (User, 'followers_count', UserFollowRel, 'following'),
+    (User, 'following_count', UserFollowRel, 'follower'),
+    (User, 'posts_count', Post, 'author'),
+    (Post, 'comments_count', Comment, 'post'),
+    (Hashtag, 'use_count', PostHashtagRel, 'hashtag_id'),
+]
+
+
+def adjust_counter(queryset, field, delta):
+    """Adds delta to a counter of the rows of a queryset, with a single UPDATE that never goes below 0."""
+    if delta:
+        queryset.update(**{field: Greatest(F(field) + delta, Value(0))})
+
+
+def adjust_follow_counters(follower_id, following_id, delta):
+    """Adds delta to the following count of the follower and to the followers count of the followed user."""
+    # Rows are updated in id order, so that two users following each other at once can't deadlock
+    updates = sorted([(follower_id, 'following_count'), (following_id, 'followers_count')])
+    for user_id, field in updates:
+        adjust_counter(User.objects.filter(id=user_id), field, delta)
+
+
+def actual_count(counted_model, foreign_key):
+    # Subquery counting the rows of counted_model pointing to the outer row
+    counts = counted_model.objects.filter(**{foreign_key: OuterRef('pk')}).order_by().values(foreign_key).annotate(total=Count('*')).values('total')
+    return Coalesce(Subquery(counts), 0)
+
+
+def reconcile_counters(batch_size=1000, dry_run=False):
+    """
+    Sets every counter of COUNTERS to the actual number of rows, one UPDATE per batch of batch_size ids (so locks are
+    held briefly), touching only the rows that drifted.
+    Returns a dict 'app_label.Model.field' -> number of rows that were (or, with dry_run, would be) repaired.
+    """
+    repaired = {}
+    for model, field, counted_model, foreign_key in COUNTERS:
+        actual = actual_count(counted_model, foreign_key)
+        max_pk = model.objects.aggregate(max_pk=Max('pk'))['max_pk'] or 0
+        total = 0
+        for start in range(0, max_pk + 1, batch_size):
+            drifted = model.objects.filter(pk__gte=start, pk__lt=start + batch_size).exclude(**{field: actual})
+            total += drifted.count() if dry_run else drifted.update(**{field: actual})
+        repaired[f'{model._meta.label}.{field}'] = total
+    if not dry_run and any(repaired.values()):
+        invalidate_all()  # The cached responses show the drifted counters
+    return repaired
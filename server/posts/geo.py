@@ -0,0 +1,151 @@
+import json
+import math
+import re
+
+from django.db.models import F, FloatField, Q
+from django.db.models.functions import ASin, Cos, Least, Power, Radians, Sin, Sqrt
+
+# Post locations are stored as latitude/longitude columns plus their geohash, a string naming the cell of a
+# hierarchical grid that contains the point: every prefix of a geohash is a larger cell containing it. A B-tree
+# (varchar_pattern_ops) index on the geohash turns "posts in this area" into a few prefix range scans, one per cell
+# covering the area, refined with the exact coordinates.
+
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+GEOHASH_PRECISION = 9  # Cells of about 5m x 5m
+MAX_COVER_CELLS = 16  # Cells scanned for an area: more cells are more precise but cost more index scans
+EARTH_RADIUS_KM = 6371.0088
+
+NUMBER = r'\s*(-?\d+(?:\.\d+)?)\s*'
+PAIR_RE = re.compile(rf'^{NUMBER},{NUMBER}$')
+
+
+def encode_geohash(latitude, longitude, precision=GEOHASH_PRECISION):
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars = []
+    bits = 0
+    value = 0
+    even = True  # Bits alternate between longitude (first) and latitude
+    while len(chars) < precision:
+        interval, coordinate = (lon_range, longitude) if even else (lat_range, latitude)
+        middle = (interval[0] + interval[1]) / 2
+        value <<= 1
+        if coordinate >= middle:
+            value |= 1
+            interval[0] = middle
+        else:
+            interval[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(GEOHASH_ALPHABET[value])
+            bits = value = 0
+    return ''.join(chars)
+
+
+def cell_size(precision):
+    """Height and width in degrees of the geohash cells of a precision."""
+    lat_bits = 5 * precision // 2
+    lon_bits = 5 * precision - lat_bits
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lon_bits
+
+
+def parse_geolocation(text):
+    """
+    Parses the free-form geolocation of a post.
+    - '[lng, lat]' as sent by the client (GeoJSON order), or {"lat": ..., "lng": ...}
+    - 'lat, lng', as written by people (and '(lat, lng)')
+    Returns a tuple (latitude, longitude), or None if the text isn't a valid location.
+    """
+    if not text:
+        return None
+    text = text.strip()
+    try:
+        value = json.loads(text)
+    except ValueError:
+        value = None
+    if isinstance(value, list) and len(value) == 2:
+        longitude, latitude = value
+    elif isinstance(value, dict):
+        latitude = value.get('lat', value.get('latitude'))
+        longitude = value.get('lng', value.get('lon', value.get('longitude')))
+    else:
+        match = PAIR_RE.match(text[1:-1] if text.startswith('(') and text.endswith(')') else text)
+        if not match:
+            return None
+        latitude, longitude = match.groups()
+    if isinstance(latitude, bool) or isinstance(longitude, bool):
+        return None
+    try:
+        latitude, longitude = float(latitude), float(longitude)
+    except (TypeError, ValueError):
+        return None
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180) or math.isnan(latitude) or math.isnan(longitude):
+        return None
+    return latitude, longitude
+
+
+def parse_bbox(text):
+    """
+    Parses a bounding box given as 'minLng,minLat,maxLng,maxLat' (GeoJSON order).
+    Returns a tuple (min_lat, min_lng, max_lat, max_lng). Raises ValueError if it is invalid.
+    """
+    min_lng, min_lat, max_lng, max_lat = (float(value) for value in text.split(','))
+    if not (-90 <= min_lat <= max_lat <= 90 and -180 <= min_lng <= max_lng <= 180):
+        raise ValueError('Invalid bbox.')
+    return min_lat, min_lng, max_lat, max_lng
+
+
+def radius_bbox(latitude, longitude, radius_km):
+    """Bounding box (min_lat, min_lon, max_lat, max_lon) of a circle, clamped to valid coordinates."""
+    lat_delta = math.degrees(radius_km / EARTH_RADIUS_KM)
+    cos_lat = math.cos(math.radians(latitude))
+    lon_delta = math.degrees(radius_km / EARTH_RADIUS_KM / cos_lat) if cos_lat > 1e-9 else 180.0
+    return (max(latitude - lat_delta, -90.0), max(longitude - lon_delta, -180.0),
+            min(latitude + lat_delta, 90.0), min(longitude + lon_delta, 180.0))
+
+
+def cover_cells(min_lat, min_lon, max_lat, max_lon, max_cells=MAX_COVER_CELLS):
+    """
+    Geohash cells covering a bounding box: the most precise level needing at most max_cells cells.
+    Returns None when the box is so large that scanning everything is as good.
+    """
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        height, width = cell_size(precision)
+        rows = math.floor((max_lat + 90) / height) - math.floor((min_lat + 90) / height) + 1
+        columns = math.floor((max_lon + 180) / width) - math.floor((min_lon + 180) / width) + 1
+        if rows * columns > max_cells:
+            continue
+        cells = set()
+        for row in range(rows):
+            latitude = min(min_lat + row * height, max_lat)
+            for column in range(columns):
+                cells.add(encode_geohash(latitude, min(min_lon + column * width, max_lon), precision))
+            cells.add(encode_geohash(latitude, max_lon, precision))
+        for column in range(columns):
+            cells.add(encode_geohash(max_lat, min(min_lon + column * width, max_lon), precision))
+        cells.add(encode_geohash(max_lat, max_lon, precision))
+        return sorted(cells)
+    return None
+
+
+def bbox_filter(min_lat, min_lon, max_lat, max_lon):
+    """Filter on the posts located in a bounding box: the geohash prefixes select the index ranges to scan."""
+    condition = Q(latitude__gte=min_lat, latitude__lte=max_lat, longitude__gte=min_lon, longitude__lte=max_lon)
+    cells = cover_cells(min_lat, min_lon, max_lat, max_lon)
+    if cells is not None:
+        prefixes = Q()
+        for cell in cells:
+            prefixes |= Q(geohash__startswith=cell)
+        condition &= prefixes
+    return condition
+
+
+def distance_km(latitude, longitude):
+    """Haversine distance in km between the post's location and a point, as a query expression."""
+    lat1, lon1 = math.radians(latitude), math.radians(longitude)
+    lat2, lon2 = Radians(F('latitude')), Radians(F('longitude'))
+    half_chord = (
+        Power(Sin((lat2 - lat1) / 2), 2)
+        + math.cos(lat1) * Cos(lat2) * Power(Sin((lon2 - lon1) / 2), 2)
+    )
+    return 2 * EARTH_RADIUS_KM * ASin(Least(Sqrt(half_chord), 1.0, output_field=FloatField()))
@@ -0,0 +1,85 @@
+from collections import defaultdict
+
+from hashtags.models import PostHashtagRel
+from images.pipeline import variant_urls
+from terrierconnect.metrics import timed_serialization
+from .models import Post
+from .serializers import PostSerializer
+
+
+# Helper function to load the hashtags of many posts at once
+def get_hashtags_by_post(post_ids):
+    """
+    Returns a dict mapping each post id to the list of its hashtag texts.
+    - Runs a single query joining PostHashtagRel with Hashtag, whatever the number of posts.
+    """
+    hashtags_by_post = defaultdict(list)
+    if not post_ids:
+        return hashtags_by_post
+
+    for post_id, hashtag_text in _hashtags_query(post_ids):
+        hashtags_by_post[post_id].append(hashtag_text)
+    return hashtags_by_post
+
+
+async def aget_hashtags_by_post(post_ids):
+    """Same as get_hashtags_by_post, with the async ORM."""
+    hashtags_by_post = defaultdict(list)
+    if not post_ids:
+        return hashtags_by_post
+
+    async for post_id, hashtag_text in _hashtags_query(post_ids):
+        hashtags_by_post[post_id].append(hashtag_text)
+    return hashtags_by_post
+
+
+def _hashtags_query(post_ids):
+    return PostHashtagRel.objects.filter(post_id__in=post_ids).order_by('id').values_list('post_id', 'hashtag_id__hashtag_text')
+
+
+# Helper function to serialize a page of posts with their authors and hashtags
+def hydrate_posts(posts):
+    """
+    Serializes a page of posts in a fixed number of queries.
+    - Expects the posts to be loaded with select_related('author') so author fields don't trigger extra queries.
+    - Hashtags of the whole page are fetched with one query (see get_hashtags_by_post).
+    Returns a list of post dicts, each with 'display_name', 'avatar_url', 'avatar_variants' and 'hashtags' keys added.
+    """
+    posts = list(posts)
+    return _serialize_posts(posts, get_hashtags_by_post([post.id for post in posts]))
+
+
+async def ahydrate_posts(posts):
+    """Same as hydrate_posts, for async views: the hashtags are loaded with the async ORM."""
+    posts = list(posts)
+    return _serialize_posts(posts, await aget_hashtags_by_post([post.id for post in posts]))
+
+
+def _serialize_posts(posts, hashtags_by_post):
+    # No query here: the authors are already loaded and the hashtags are given
+    posts_data = []
+    with timed_serialization():
+        for post, post_data in zip(posts, PostSerializer(posts, many=True).data):
+            post_data['display_name'] = post.author.display_name
+            post_data['avatar_url'] = post.author.avatar_url.url if post.author.avatar_url else None
+            post_data['avatar_variants'] = variant_urls(post.author.avatar_variants)
+            post_data['hashtags'] = hashtags_by_post.get(post.id, [])
+            posts_data.append(post_data)
+    return posts_data
+
+
+def load_posts(post_ids):
+    """Loads posts (with their authors) by id in one query, keeping the order of post_ids and skipping deleted posts."""
+    posts = Post.objects.select_related('author').in_bulk(post_ids)
+    return [posts[post_id] for post_id in post_ids if post_id in posts]
+
+
+async def aload_posts(post_ids):
+    """Same as load_posts, with the async ORM."""
+    posts = await Post.objects.select_related('author').ain_bulk(post_ids)
+    return [posts[post_id] for post_id in post_ids if post_id in posts]
+
+
+def hydrate_post(post):
+    """Serializes a single post with its author and hashtags (see hydrate_posts)."""
+    return hydrate_posts([post])[0]
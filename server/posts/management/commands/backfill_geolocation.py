@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+
+from posts.geo import encode_geohash, parse_geolocation
+from posts.models import Post
+from terrierconnect.response_cache import invalidate_all
+
+
+class Command(BaseCommand):
+    help = 'Parses the geolocation text of existing posts into their latitude, longitude and geohash, in batches of primary keys.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of posts read and updated per batch.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        posts = Post.objects.filter(geolocation__isnull=False, latitude__isnull=True).exclude(geolocation='')
+
+        updated = 0
+        invalid = []
+        last_id = 0
+        while True:
+            # Walk the primary key so every batch is a short index range scan and a short transaction
+            batch = list(posts.filter(id__gt=last_id).order_by('id').only('id', 'geolocation')[:batch_size])
+            if not batch:
+                break
+            located = []
+            for post in batch:
+                location = parse_geolocation(post.geolocation)
+                if location is None:
+                    invalid.append(post.id)
+                    continue
+                post.latitude, post.longitude = location
+                post.geohash = encode_geohash(*location)
+                located.append(post)
+            # bulk_update skips save(), so neither update_time nor the counters are touched
+            updated += Post.objects.bulk_update(located, ['latitude', 'longitude', 'geohash'])
+            last_id = batch[-1].id
+
+        if updated:
+            invalidate_all()  # The cached responses show the coordinates
+        if invalid:
+            self.stdout.write(self.style.WARNING(f'Could not parse the geolocation of {len(invalid)} post(s): {invalid[:20]}'))
+        self.stdout.write(self.style.SUCCESS(f'Located {updated} post(s).'))
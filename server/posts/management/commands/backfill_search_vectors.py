@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from posts.models import Post
+from posts.search import post_search_vector
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the full-text search vector of existing posts, in batches of primary keys.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of posts updated per statement.')
+        parser.add_argument('--only-missing', action='store_true', help='Only fill in posts without a search vector.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        posts = Post.objects.all()
+        if options['only_missing']:
+            posts = posts.filter(search_vector__isnull=True)
+
+        updated = 0
+        last_id = 0
+        while True:
+            # Walk the primary key so every batch is a short index range scan and a short transaction
+            ids = list(posts.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size])
+            if not ids:
+                break
+            updated += Post.objects.filter(id__in=ids).update(search_vector=post_search_vector())
+            last_id = ids[-1]
+        self.stdout.write(self.style.SUCCESS(f'Updated the search vector of {updated} post(s).'))
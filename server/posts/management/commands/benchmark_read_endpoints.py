@@ -0,0 +1,197 @@
+import http.client
+import json
+import subprocess
+import threading
+import time
+from urllib.parse import quote, urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from hashtags.models import Hashtag
+from posts.models import Comment, Post
+from users.models import User, UserFollowRel
+from users.views import generate_jwt_token
+
+ENDPOINTS = (
+    'list_posts', 'list_posts_following', 'get_post_detail', 'list_comments', 'full_text_search', 'get_user_info_by_id',
+    'get_popular_hashtags', 'hashtags_autocomplete', 'list_posts_by_tag', 'list_posts_nearby',
+    'map_clusters', 'list_comment_previews',
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Measures requests/sec and latency percentiles of the read endpoints on one or more running servers, '
+        'e.g. the WSGI and the ASGI deployment started side by side with the same number of workers pinned to the '
+        'same CPUs (taskset -c 0-1 gunicorn ... -w 2). Prints the results as JSON, and can store them (--output) to '
+        'compare runs across commits (--compare). See docker-compose.bench.yml for a disposable benchmark database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('targets', nargs='+', help='Servers to compare, as name=url (e.g. wsgi=http://127.0.0.1:8000).')
+        parser.add_argument('--user-id', type=int, help='User whose token authenticates the requests (default: the first user).')
+        parser.add_argument('--concurrency', type=int, default=16, help='Number of client threads.')
+        parser.add_argument('--duration', type=float, default=10.0, help='Seconds spent on each endpoint of each server.')
+        parser.add_argument('--warmup', type=float, default=1.0, help='Seconds of unmeasured requests before each run.')
+        parser.add_argument('--endpoint', action='append', choices=ENDPOINTS, help='Endpoint to measure (repeatable, default: all).')
+        parser.add_argument('--output', help='File the results are written to, with the commit and the dataset size.')
+        parser.add_argument('--compare', help='Results file of a previous run, printed side by side with this run.')
+
+    def handle(self, *args, **options):
+        targets = []
+        for target in options['targets']:
+            name, _, url = target.partition('=')
+            if not url:
+                raise CommandError(f'Invalid target "{target}", expected name=url.')
+            targets.append((name, url.rstrip('/')))
+
+        # The busiest objects, so that the endpoints have data to return: the user following the most people, the
+        # post with the most comments, a popular hashtag
+        users = User.objects.order_by('-following_count', 'id')
+        user = users.filter(id=options['user_id']).first() if options['user_id'] else users.first()
+        post = Post.objects.order_by('-comments_count', '-create_time').first()
+        if user is None or post is None:
+            raise CommandError('The database needs at least one user and one post.')
+        token = generate_jwt_token(user)
+        token = token.decode() if isinstance(token, bytes) else token
+
+        paths = get_paths(user, post)
+        endpoints = {endpoint: paths[endpoint] for endpoint in options['endpoint'] or ENDPOINTS}
+
+        results = {}
+        for name, url in targets:
+            results[name] = {}
+            for endpoint, path in endpoints.items():
+                run(url, path, token, options['concurrency'], options['warmup'])
+                results[name][endpoint] = run(url, path, token, options['concurrency'], options['duration'])
+                self.stderr.write(f'{name} {endpoint}: {results[name][endpoint]["requests_per_second"]} req/s')
+
+        report = {
+            'commit': get_commit(),
+            'time': timezone.now().isoformat(),
+            'dataset': {
+                'users': User.objects.count(),
+                'follows': UserFollowRel.objects.count(),
+                'posts': Post.objects.count(),
+                'comments': Comment.objects.count(),
+                'hashtags': Hashtag.objects.count(),
+            },
+            'concurrency': options['concurrency'],
+            'duration': options['duration'],
+            'results': results,
+        }
+        self.stdout.write(json.dumps(report, indent=2))
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(report, file, indent=2)
+        if options['compare']:
+            with open(options['compare']) as file:
+                previous = json.load(file)
+            self.stderr.write(f'Compared with {previous.get("commit")} ({previous.get("time")}):')
+            for line in compare(previous, report):
+                self.stderr.write(line)
+
+
+def get_paths(user, post):
+    """Path of each endpoint in ENDPOINTS, with the ids of the user and post measured."""
+    feed_post_ids = list(Post.objects.order_by('-create_time').values_list('id', flat=True)[:10])  # A feed page
+    hashtag = Hashtag.objects.order_by('-use_count', 'id').values_list('hashtag_text', flat=True).first() or 'post'
+    word = next((word for word in post.title.split() if len(word) > 3), post.title.split()[0] if post.title.split() else 'post')
+    return {
+        'list_posts': '/posts/list_posts/?pageSize=10',
+        'list_posts_following': '/posts/list_posts/?flag=following&pageSize=10',
+        'get_post_detail': f'/posts/get_post_detail/{post.id}/',
+        'list_comments': f'/posts/{post.id}/comments/?pageSize=10',
+        'full_text_search': f'/posts/full_text_search/?query={quote(word)}&pageSize=10',
+        'get_user_info_by_id': f'/users/user/{user.id}/',
+        'get_popular_hashtags': '/hashtags/get_popular_hashtags/',
+        'hashtags_autocomplete': f'/hashtags/hashtags_autocomplete/?prefix={quote(hashtag[:2])}',
+        'list_posts_by_tag': f'/posts/list_posts_by_tag/?tag={quote(hashtag)}&pageSize=10',
+        'list_posts_nearby': '/posts/list_posts_nearby/?lat=42.3505&lng=-71.1054&radius=2&pageSize=10',
+        'map_clusters': '/posts/map_clusters/?bbox=-71.16,42.32,-71.02,42.39&zoom=13',
+        'list_comment_previews': f'/posts/comments/previews/?postIds={",".join(map(str, feed_post_ids))}&limit=2',
+    }
+
+
+def get_commit():
+    # Commit the benchmarked code was built from, marked as dirty when the working tree has changes
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return f'{commit}-dirty' if dirty else commit
+
+
+def compare(previous, current):
+    """Lines comparing the throughput and p50/p99 latencies of the endpoints measured in both runs."""
+    lines = []
+    for target, endpoints in current['results'].items():
+        for endpoint, result in endpoints.items():
+            before = previous.get('results', {}).get(target, {}).get(endpoint)
+            if not before:
+                continue
+            changes = []
+            for metric in ('requests_per_second', 'p50_ms', 'p99_ms'):
+                if before.get(metric) and result.get(metric) is not None:
+                    changes.append(f'{metric} {before[metric]} -> {result[metric]} ({(result[metric] / before[metric] - 1) * 100:+.1f}%)')
+            lines.append(f'{target} {endpoint}: ' + ', '.join(changes))
+    return lines
+
+def run(base_url, path, token, concurrency, duration):
+    """
+    Sends GET requests to base_url + path from `concurrency` threads (one keep-alive connection each) for `duration`
+    seconds. Returns requests/sec, latency percentiles in milliseconds and the number of errors.
+    """
+    url = urlsplit(base_url)
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def worker():
+        connection = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=30)
+        own_latencies = []
+        own_errors = 0
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            try:
+                connection.request('GET', url.path + path, headers={'Authorization': token})
+                response = connection.getresponse()
+                response.read()
+                if response.status != 200:
+                    own_errors += 1
+            except (OSError, http.client.HTTPException):
+                own_errors += 1
+                connection.close()
+                continue
+            own_latencies.append(time.perf_counter() - start)
+        connection.close()
+        with lock:
+            latencies.extend(own_latencies)
+            errors[0] += own_errors
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    latencies.sort()
+
+    def percentile(p):
+        return round(latencies[min(int(len(latencies) * p), len(latencies) - 1)] * 1000, 2) if latencies else None
+
+    return {
+        'requests': len(latencies),
+        'errors': errors[0],
+        'requests_per_second': round(len(latencies) / elapsed, 1),
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 2) if latencies else None,
+        'p50_ms': percentile(0.50),
+        'p90_ms': percentile(0.90),
+        'p95_ms': percentile(0.95),
+        'p99_ms': percentile(0.99),
+    }
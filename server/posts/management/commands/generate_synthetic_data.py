@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from posts.synthetic import SYNTHETIC_DOMAIN, SYNTHETIC_PASSWORD, delete_synthetic_data, generate
+
+
+class Command(BaseCommand):
+    help = (
+        'Generates realistic synthetic data for benchmarks: users, a power-law follow graph, posts with hashtags and '
+        f'deep comment threads. Synthetic users have an @{SYNTHETIC_DOMAIN} email and the password {SYNTHETIC_PASSWORD}.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--posts', type=int, default=10000)
+        parser.add_argument('--hashtags', type=int, default=300)
+        parser.add_argument('--comments', type=int, default=30000)
+        parser.add_argument('--avg-follows', type=int, default=20, help='Average number of users followed.')
+        parser.add_argument('--max-depth', type=int, default=8, help='Maximum depth of the comment threads.')
+        parser.add_argument('--days', type=int, default=30, help='Period the posts are spread over, ending now.')
+        parser.add_argument('--seed', type=int, default=0, help='Seed of the random generator, for reproducible datasets.')
+        parser.add_argument('--batch-size', type=int, default=2000, help='Number of rows per INSERT.')
+        parser.add_argument('--reset', action='store_true', help='Delete the previously generated data first.')
+
+    def handle(self, *args, **options):
+        if options['reset']:
+            self.stdout.write(f'Deleted {delete_synthetic_data()} row(s) of synthetic data.')
+        generate(
+            users=options['users'], posts=options['posts'], hashtags=options['hashtags'], comments=options['comments'],
+            avg_follows=options['avg_follows'], max_depth=options['max_depth'], days=options['days'], seed=options['seed'],
+            batch_size=options['batch_size'], log=self.stdout.write,
+        )
+        self.stdout.write(self.style.SUCCESS('Synthetic data generated.'))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from posts.timelines import rebuild_timeline
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the materialized following-feed timelines from the existing follow relationships and posts.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append', dest='user_ids', help='Only rebuild the timeline of this user id (repeatable).')
+
+    def handle(self, *args, **options):
+        users = User.objects.all().order_by('id')
+        if options['user_ids']:
+            users = users.filter(id__in=options['user_ids'])
+
+        count = 0
+        for user in users.iterator():
+            rebuild_timeline(user)
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {count} timeline(s).'))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from posts.counters import reconcile_counters
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the denormalized counters (followers, following, posts, comments, hashtag uses) and repairs the ones that drifted.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of rows checked by each UPDATE.')
+        parser.add_argument('--dry-run', action='store_true', help='Only report the number of drifted rows.')
+
+    def handle(self, *args, **options):
+        repaired = reconcile_counters(options['batch_size'], options['dry_run'])
+        verb = 'Would repair' if options['dry_run'] else 'Repaired'
+        for counter, count in repaired.items():
+            self.stdout.write(f'{verb} {count} row(s) of {counter}.')
+        self.stdout.write(self.style.SUCCESS(f'{verb} {sum(repaired.values())} counter(s) in total.'))
@@ -0,0 +1,134 @@
+import math
+
+from django.contrib.postgres.aggregates import ArrayAgg
+from django.contrib.postgres.fields import ArrayField
+from django.db.models import Avg, BigIntegerField, Count, F, Func, IntegerField
+from django.db.models.functions import Floor, Greatest, Least, Pi, Radians, Tan
+
+from terrierconnect.db.routing import read_from_primary
+from terrierconnect.response_cache import get_cache, get_versions, is_recent
+from .geo import bbox_filter
+from .models import Post
+
+# Clusters of located posts for the map, computed per web map tile (the z/x/y grid of the map libraries: at zoom z
+# the world is 2^z x 2^z tiles) and cached per tile, so panning only computes the tiles that came into view.
+# - Each tile is split into TILE_GRID x TILE_GRID cells; the posts of a cell form a cluster with their count, their
+#   centroid and the ids of the most recent ones.
+# - Posts are grouped by their cell in the grid of all the cells of the zoom level, computed as tile_of() does, so a
+#   post on the edge of two tiles (or cells) belongs to one of them only: tiles include their west and north edges.
+# - The tiles missing from the cache are computed together, with one grouped query over their bounding box.
+# - Tiles are cached with the version token of their 'tile:z/x/y' resource (see terrierconnect/response_cache.py),
+#   replaced when a post located in the tile is written (see posts/cache_invalidation.py).
+
+MAX_ZOOM = 20
+TILE_GRID = 8  # Cells per tile side: 32px clusters on 256px tiles
+MAX_TILES = 64  # Tiles per request, e.g. a 1920x1080 viewport needs up to 9 x 6
+SAMPLE_POSTS = 3
+MAX_LATITUDE = 85.0511287798  # Latitudes beyond are not shown by web maps
+
+
+def tile_of(latitude, longitude, zoom):
+    """Column and row of the tile containing a point."""
+    n = 2 ** zoom
+    latitude = max(min(latitude, MAX_LATITUDE), -MAX_LATITUDE)
+    x = int((longitude + 180) / 360 * n)
+    y = int((1 - math.asinh(math.tan(math.radians(latitude))) / math.pi) / 2 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def tile_bounds(zoom, x, y):
+    """Bounding box (min_lat, min_lng, max_lat, max_lng) of a tile: its south and east edges belong to the next tiles."""
+    n = 2 ** zoom
+
+    def latitude(row):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * row / n))))
+    return latitude(y + 1), x / n * 360 - 180, latitude(y), (x + 1) / n * 360 - 180
+
+
+def tiles_for_bbox(min_lat, min_lng, max_lat, max_lng, zoom):
+    min_x, max_y = tile_of(min_lat, min_lng, zoom)
+    max_x, min_y = tile_of(max_lat, max_lng, zoom)
+    return [(zoom, x, y) for x in range(min_x, max_x + 1) for y in range(min_y, max_y + 1)]
+
+
+def tile_resources(latitude, longitude):
+    """Resources of the tiles containing a point, at every zoom level."""
+    return [f'tile:{zoom}/{x}/{y}' for zoom in range(MAX_ZOOM + 1) for x, y in [tile_of(latitude, longitude, zoom)]]
+
+
+class Slice(Func):
+    # First elements of an array, e.g. of an ARRAY_AGG
+    template = '(%(expressions)s)[1:%(length)s]'
+
+
+class ASinh(Func):
+    function = 'ASINH'
+
+
+def _cell(expression, cells):
+    return Least(Greatest(Floor(expression), 0), cells - 1, output_field=IntegerField())
+
+
+def compute_tiles(zoom, tiles):
+    """
+    Clusters of tiles of a zoom level, with one grouped query scanning the geohash cells of their bounding box.
+    Returns a dict of tile -> list of clusters.
+    """
+    bounds = [tile_bounds(*tile) for tile in tiles]
+    cells = 2 ** zoom * TILE_GRID  # Per side of the world
+    latitude = Greatest(Least(F('latitude'), MAX_LATITUDE), -MAX_LATITUDE)
+    rows = Post.objects.filter(bbox_filter(
+        min(bound[0] for bound in bounds), min(bound[1] for bound in bounds),
+        max(bound[2] for bound in bounds), max(bound[3] for bound in bounds),
+    )).annotate(
+        # Same formulas as tile_of(), with TILE_GRID times more columns and rows
+        cell_x=_cell((F('longitude') + 180.0) / 360.0 * cells, cells),
+        cell_y=_cell((1.0 - ASinh(Tan(Radians(latitude))) / Pi()) / 2.0 * cells, cells),
+    ).values('cell_x', 'cell_y').annotate(
+        count=Count('id'),
+        centroid_lat=Avg('latitude'),
+        centroid_lng=Avg('longitude'),
+        post_ids=Slice(ArrayAgg('id', ordering=('-create_time', '-id')), length=SAMPLE_POSTS, output_field=ArrayField(BigIntegerField())),
+    ).order_by('cell_y', 'cell_x')
+
+    clusters = {tile: [] for tile in tiles}
+    for row in rows:
+        tile = (zoom, int(row['cell_x']) // TILE_GRID, int(row['cell_y']) // TILE_GRID)
+        if tile in clusters:  # The bounding box may cover tiles that are cached
+            clusters[tile].append({
+                'count': row['count'],
+                'latitude': round(row['centroid_lat'], 6),
+                'longitude': round(row['centroid_lng'], 6),
+                'sample_post_ids': row['post_ids'],
+            })
+    return clusters
+
+
+def get_clusters(min_lat, min_lng, max_lat, max_lng, zoom):
+    """
+    Clusters of the tiles covering a bounding box, from the cache when possible.
+    Raises ValueError when the box needs more than MAX_TILES tiles at this zoom.
+    """
+    tiles = tiles_for_bbox(min_lat, min_lng, max_lat, max_lng, zoom)
+    if len(tiles) > MAX_TILES:
+        raise ValueError(f'The area needs {len(tiles)} tiles at zoom {zoom}, at most {MAX_TILES} are allowed: zoom out.')
+    resources = [f'tile:{zoom}/{x}/{y}' for zoom, x, y in tiles]
+    versions = get_versions(resources)  # Before reading the posts
+    epoch = versions[0][0]
+    keys = {tile: f'map:tile:{resource}:{epoch}:{version[0]}' for tile, resource, version in zip(tiles, resources, versions[1:])}
+
+    cache = get_cache()
+    cached = cache.get_many(keys.values())
+    missing = [tile for tile, key in keys.items() if key not in cached]
+    computed = {}
+    if missing:
+        if is_recent(versions):
+            with read_from_primary():
+                computed = compute_tiles(zoom, missing)
+        else:
+            computed = compute_tiles(zoom, missing)
+        cache.set_many({keys[tile]: tile_clusters for tile, tile_clusters in computed.items()})
+    clusters = []
+    for tile, key in keys.items():
+        clusters += cached[key] if key in cached else computed[tile]
+    return clusters
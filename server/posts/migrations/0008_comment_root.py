@@ -0,0 +1,34 @@
+# Generated by Django 4.2.16 on 2026-10-18 14:16
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_comment_root(apps, schema_editor):
+    # Resolve the top-level comment of every reply by walking up the parent links in memory
+    Comment = apps.get_model('posts', 'Comment')
+    parents = dict(Comment.objects.values_list('id', 'parent_id'))
+
+    def find_root(comment_id):
+        while parents[comment_id] is not None:
+            comment_id = parents[comment_id]
+        return comment_id
+
+    replies = [Comment(id=comment_id, root_id=find_root(comment_id)) for comment_id, parent_id in parents.items() if parent_id is not None]
+    Comment.objects.bulk_update(replies, ['root'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0007_timelineentry_timelineentry_unique_timeline_entry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='root',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='thread', to='posts.comment'),
+        ),
+        migrations.RunPython(backfill_comment_root, migrations.RunPython.noop),
+    ]
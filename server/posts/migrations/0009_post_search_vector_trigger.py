@@ -0,0 +1,46 @@
+# Generated by Django 4.2.16 on 2026-10-18 14:17
+
+import django.contrib.postgres.indexes
+from django.db import migrations
+
+# Keeps posts_post.search_vector up to date inside the database, in the same statement as the INSERT/UPDATE.
+# Must stay in sync with posts.search.post_search_vector() (title weighted 'A', content weighted 'B').
+CREATE_TRIGGER_SQL = """
+CREATE OR REPLACE FUNCTION posts_post_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('english'::regconfig, coalesce(NEW.title, '')), 'A') ||
+        setweight(to_tsvector('english'::regconfig, coalesce(NEW.content, '')), 'B');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER posts_post_search_vector_trigger
+    BEFORE INSERT OR UPDATE OF title, content, search_vector ON posts_post
+    FOR EACH ROW EXECUTE FUNCTION posts_post_search_vector_update();
+"""
+
+DROP_TRIGGER_SQL = """
+DROP TRIGGER IF EXISTS posts_post_search_vector_trigger ON posts_post;
+DROP FUNCTION IF EXISTS posts_post_search_vector_update();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0008_comment_root'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='post',
+            name='posts_post_search__5398d0_idx',
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='posts_post_search_gin_idx'),
+        ),
+        # Existing rows are filled in by `python manage.py backfill_search_vectors`
+        migrations.RunSQL(CREATE_TRIGGER_SQL, DROP_TRIGGER_SQL),
+    ]
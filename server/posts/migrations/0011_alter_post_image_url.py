@@ -0,0 +1,19 @@
+# Generated by Django 4.2.16 on 2026-10-18 14:31
+
+from django.db import migrations, models
+import images.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0010_image_variants'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='post',
+            name='image_url',
+            field=models.ImageField(blank=True, null=True, storage=images.storage.get_blob_storage, upload_to='post_media/'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+from django.db import migrations
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_of(model, foreign_key):
+    counts = model.objects.filter(**{foreign_key: OuterRef('pk')}).order_by().values(foreign_key).annotate(total=Count('id')).values('total')
+    return Coalesce(Subquery(counts), 0)
+
+
+def backfill_counters(apps, schema_editor):
+    # One UPDATE per table setting the new counters to the current number of rows
+    User = apps.get_model('users', 'User')
+    UserFollowRel = apps.get_model('users', 'UserFollowRel')
+    Post = apps.get_model('posts', 'Post')
+    Comment = apps.get_model('posts', 'Comment')
+
+    User.objects.update(
+        followers_count=count_of(UserFollowRel, 'following'),
+        following_count=count_of(UserFollowRel, 'follower'),
+        posts_count=count_of(Post, 'author'),
+    )
+    Post.objects.update(comments_count=count_of(Comment, 'post'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0012_post_comments_count'),
+        ('users', '0006_user_counters'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
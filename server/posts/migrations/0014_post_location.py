@@ -0,0 +1,32 @@
+# Generated by Django 4.2.16 on 2026-10-18 14:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0013_backfill_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='geohash',
+            field=models.CharField(blank=True, max_length=12, null=True),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='latitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='longitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(condition=models.Q(('geohash__isnull', False)), fields=['geohash'], name='posts_post_geohash_idx', opclasses=['varchar_pattern_ops']),
+        ),
+    ]
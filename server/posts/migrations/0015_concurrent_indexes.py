@@ -0,0 +1,26 @@
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY doesn't block writes to the tables, but can't run in a transaction
+    atomic = False
+
+    dependencies = [
+        ('posts', '0014_post_location'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='post',
+            index=models.Index(fields=['-create_time', '-id'], name='posts_post_time_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='post',
+            index=models.Index(fields=['author', '-create_time', '-id'], name='posts_post_author_time_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='comment',
+            index=models.Index(fields=['author', '-create_time', '-id'], name='posts_comment_author_time_idx'),
+        ),
+    ]
@@ -1,26 +1,45 @@
 from django.db import models
 from users.models import User
+from images.storage import get_blob_storage
+from django.contrib.postgres.indexes import GinIndex
 from django.contrib.postgres.search import SearchVectorField
 from django.db.models import Index
+from .geo import encode_geohash, parse_geolocation
 
 class Post(models.Model):
     title = models.CharField(max_length=255)  # New field for title
     content = models.TextField()
-    image_url = models.ImageField(upload_to='post_media/', blank=True, null=True)
+    image_url = models.ImageField(upload_to='post_media/', storage=get_blob_storage, blank=True, null=True)  # Stored once per content, see images/storage.py
+    image_variants = models.JSONField(blank=True, null=True)  # Resized copies of image_url, see images/pipeline.py
     timestamp = models.DateTimeField(auto_now_add=True)
-    geolocation = models.CharField(max_length=255, blank=True, null=True)  # Assuming this is a simple char field
+    geolocation = models.CharField(max_length=255, blank=True, null=True)  # As sent by the client, e.g. '[lng, lat]'
+    latitude = models.FloatField(blank=True, null=True)  # Parsed from geolocation on save (see posts/geo.py)
+    longitude = models.FloatField(blank=True, null=True)
+    geohash = models.CharField(max_length=12, blank=True, null=True)  # Cell of the location, for area queries
     author = models.ForeignKey(User, on_delete=models.CASCADE)
     create_time = models.DateTimeField(auto_now_add=True)
     update_time = models.DateTimeField(auto_now=True)
-    search_vector = SearchVectorField(null=True)  # For full-text search
+    search_vector = SearchVectorField(null=True)  # For full-text search, maintained by a database trigger from title and content
+    comments_count = models.PositiveIntegerField(default=0)  # Comments and replies, only changed by atomic UPDATEs (see posts/counters.py)
 
     def __str__(self):
         return f"Post {self.id} by {self.author.display_name}"
+
+    def save(self, *args, **kwargs):
+        # Keep the typed location in sync with the geolocation text
+        location = parse_geolocation(self.geolocation)
+        self.latitude, self.longitude = location or (None, None)
+        self.geohash = encode_geohash(*location) if location else None
+        super().save(*args, **kwargs)
     
 
     class Meta:
         indexes = [
-            Index(fields=['search_vector']),  # Add an index for efficient search
+            GinIndex(fields=['search_vector'], name='posts_post_search_gin_idx'),  # Add an index for efficient search
+            # Prefix (LIKE 'abc%') scans of the geohash cells covering an area, whatever the database collation
+            Index(fields=['geohash'], name='posts_post_geohash_idx', opclasses=['varchar_pattern_ops'], condition=models.Q(geohash__isnull=False)),
+            Index(fields=['-create_time', '-id'], name='posts_post_time_idx'),  # Latest posts (list_posts)
+            Index(fields=['author', '-create_time', '-id'], name='posts_post_author_time_idx'),  # Posts of the followed authors, newest first
         ]
 
 class Comment(models.Model):
@@ -28,14 +47,40 @@ class Comment(models.Model):
     author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='comments')
     content = models.TextField()
     parent = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='replies')
+    root = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='thread')  # Top-level comment of the thread, null for top-level comments
     create_time = models.DateTimeField(auto_now_add=True)
     update_time = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f"Comment {self.id} by {self.author.display_name}"
 
+    def save(self, *args, **kwargs):
+        # Keep the thread root in sync with the parent, so a whole thread can be loaded with one query
+        self.root_id = (self.parent.root_id or self.parent_id) if self.parent_id else None
+        super().save(*args, **kwargs)
+
     class Meta:
         indexes = [
             Index(fields=['post', 'parent']),  # Index to optimize queries for comments by post and parent
+            Index(fields=['author', '-create_time', '-id'], name='posts_comment_author_time_idx'),  # Comments of an author, newest first
+        ]
+        ordering = ['create_time']  # Order comments by creation time
+
+class TimelineEntry(models.Model):
+    # Materialized "following" feed: one row per (follower, post), written when the post is created (fan-out-on-write)
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='timeline_entries')
+    post = models.ForeignKey('Post', on_delete=models.CASCADE, related_name='timeline_entries')  # Deleting a post removes it from every timeline
+    author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')  # Copied from the post so unfollowing can drop entries by author
+    create_time = models.DateTimeField()  # Copied from the post so the feed is read from this table only
+
+    def __str__(self):
+        return f"Post {self.post_id} in timeline of user {self.owner_id}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['owner', 'post'], name='unique_timeline_entry'),
+        ]
+        indexes = [
+            Index(fields=['owner', '-create_time', '-post'], name='timeline_owner_time_idx'),  # Feed reads, newest first
+            Index(fields=['owner', 'author'], name='timeline_owner_author_idx'),  # Unfollow cleanup
         ]
-        ordering = ['create_time']  # Order comments by creation time
\ No newline at end of file
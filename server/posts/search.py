@@ -0,0 +1,24 @@
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db.models import F
+
+from .models import Post
+
+# Text search configuration used by the search_vector trigger (posts/migrations/0009) and by queries.
+# Both sides must use the same configuration for the GIN index on search_vector to be used.
+SEARCH_CONFIG = 'english'
+
+
+def post_search_vector():
+    """Same expression as the database trigger: title weighted 'A', content weighted 'B'."""
+    return SearchVector('title', weight='A', config=SEARCH_CONFIG) + SearchVector('content', weight='B', config=SEARCH_CONFIG)
+
+
+def search_posts(query, order_by='-create_time'):
+    """
+    Returns the posts matching a full-text query, best match first.
+    - Matches and ranks on the stored search_vector column, so the GIN index is used and nothing is recomputed per row.
+    """
+    search_query = SearchQuery(query, config=SEARCH_CONFIG)
+    return Post.objects.filter(search_vector=search_query).annotate(
+        rank=SearchRank(F('search_vector'), search_query)  # Rank results by relevance
+    ).order_by('-rank', order_by)
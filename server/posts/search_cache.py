@@ -0,0 +1,150 @@
+import hashlib
+import json
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from .models import Post
+from .search import SEARCH_CONFIG
+
+# Cache of full_text_search results: for a (query, ordering, page, page size) it stores the ids of the posts of
+# the page and the pagination totals, so a repeated search skips both the ranking query and the COUNT(*).
+#
+# Invalidation is per query: every cached query is listed in a registry, and when a post is written we check
+# (in one SQL statement) which of those queries matched the post before and/or after the write, and drop
+# their version token so their cached pages can no longer be read. Result keys include the version token and
+# the registry epoch, so an evicted token or registry never brings back stale pages.
+# Entries also expire after the cache TIMEOUT, and the backend's MAX_ENTRIES bounds the size (LRU for LocMem).
+
+REGISTRY_KEY = 'search:queries'
+HITS_KEY = 'search:hits'
+MISSES_KEY = 'search:misses'
+
+
+def get_cache():
+    return caches[settings.SEARCH_CACHE_ALIAS]
+
+
+def normalize_query(query):
+    return ' '.join(query.lower().split())
+
+
+def _digest(value):
+    return hashlib.sha1(json.dumps(value).encode()).hexdigest()
+
+
+def _version_key(query):
+    return f'search:version:{_digest(query)}'
+
+
+def _result_key(query, order_by, page, page_size, epoch, version):
+    return f'search:result:{_digest([query, order_by, str(page), str(page_size), epoch, version])}'
+
+
+def _incr(key):
+    cache = get_cache()
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # The counter was evicted between add() and incr()
+        cache.set(key, 1, timeout=None)
+
+
+def get_cached_results(query, order_by, page, page_size):
+    """
+    Looks up a search page in the cache.
+    Returns a tuple (cached {'ids': [...], 'pagination': {...}} or None on a miss, key to pass to set_cached_results).
+    On a miss the query is registered and its version token created *before* the caller runs the search, so a
+    post written while the search runs invalidates the key and the possibly stale result is never read.
+    """
+    cache = get_cache()
+    version_key = _version_key(query)
+    state = cache.get_many([REGISTRY_KEY, version_key])
+    if REGISTRY_KEY in state and version_key in state:
+        key = _result_key(query, order_by, page, page_size, state[REGISTRY_KEY]['epoch'], state[version_key])
+        cached = cache.get(key)
+        if cached is not None:
+            _incr(HITS_KEY)
+            return cached, key
+
+    _incr(MISSES_KEY)
+    registry = _register_query(query)
+    cache.add(version_key, uuid.uuid4().hex, timeout=None)
+    version = cache.get(version_key)
+    return None, _result_key(query, order_by, page, page_size, registry['epoch'], version)
+
+
+def set_cached_results(key, ids, pagination):
+    get_cache().set(key, {'ids': ids, 'pagination': pagination})
+
+
+def _register_query(query):
+    # The registry maps each cached query to its last use time, trimmed to the most recently used queries
+    cache = get_cache()
+    registry = cache.get(REGISTRY_KEY) or {'epoch': uuid.uuid4().hex, 'queries': {}}
+    queries = registry['queries']
+    queries[query] = time.time()
+    if len(queries) > settings.SEARCH_CACHE_MAX_QUERIES:
+        registry['queries'] = dict(sorted(queries.items(), key=lambda item: item[1])[-settings.SEARCH_CACHE_MAX_QUERIES:])
+    cache.set(REGISTRY_KEY, registry, timeout=None)
+    return registry
+
+
+def _cached_queries():
+    registry = get_cache().get(REGISTRY_KEY)
+    return list(registry['queries']) if registry else []
+
+
+def _matching_queries(post_id, queries):
+    # One statement for all the cached queries, using the same matching as posts.search.search_posts
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT q FROM unnest(%s::text[]) AS q WHERE EXISTS ('
+            'SELECT 1 FROM posts_post WHERE id = %s AND search_vector @@ plainto_tsquery(%s::regconfig, q))',
+            [queries, post_id, SEARCH_CONFIG],
+        )
+        return {row[0] for row in cursor.fetchall()}
+
+
+def invalidate_queries(queries):
+    if queries:
+        get_cache().delete_many([_version_key(query) for query in queries])
+
+
+def get_stats():
+    cache = get_cache()
+    hits = cache.get(HITS_KEY, 0)
+    misses = cache.get(MISSES_KEY, 0)
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hitRatio': hits / (hits + misses) if hits + misses else None,
+        'cachedQueries': len(_cached_queries()),
+    }
+
+
+@receiver(pre_save, sender=Post)
+@receiver(pre_delete, sender=Post)
+def remember_matching_queries(sender, instance, **kwargs):
+    # Queries matching the post before the write lose (or reorder) this post
+    instance._search_matches_before = set()
+    queries = _cached_queries()
+    if queries and instance.pk:
+        instance._search_matches_before = _matching_queries(instance.pk, queries)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def invalidate_matching_queries(sender, instance, signal, **kwargs):
+    affected = getattr(instance, '_search_matches_before', set())
+    queries = _cached_queries()
+    if queries and signal is post_save:
+        # Queries matching the post after the write gain (or reorder) this post
+        affected |= _matching_queries(instance.pk, queries)
+    invalidate_queries(affected)
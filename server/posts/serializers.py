@@ -1,35 +1,54 @@
 # posts/serializers.py
 
 from rest_framework import serializers
+from images.pipeline import variant_urls
 from .models import Post
 from .models import Comment
 
 class PostSerializer(serializers.ModelSerializer):
+    image_variants = serializers.SerializerMethodField()  # Resized image URLs, null until they are generated
+
     class Meta:
         model = Post
-        fields = ['id','title', 'content', 'image_url', 'timestamp', 'geolocation', 'author', 'create_time', 'update_time']
+        fields = ['id','title', 'content', 'image_url', 'image_variants', 'timestamp', 'geolocation', 'author', 'create_time', 'update_time', 'comments_count', 'latitude', 'longitude']
         # It is required to let the overrided create() work
-        read_only_fields = ['author'] # Mark 'author' as read-only to exclude it from user input
+        # Coordinates (latitude, longitude) are parsed from geolocation
+        read_only_fields = ['author', 'comments_count', 'latitude', 'longitude'] # Mark 'author' as read-only to exclude it from user input
         
 
     def create(self, validated_data):
         author = self.context['author']
         return Post.objects.create(author=author, **validated_data)
 
+    def update(self, instance, validated_data):
+        # Only write the fields sent (update_post): comments_count may have changed since the post was read
+        for attr, value in validated_data.items():
+            setattr(instance, attr, value)
+        update_fields = [*validated_data, 'update_time']
+        if 'geolocation' in validated_data:
+            update_fields += ['latitude', 'longitude', 'geohash']  # Parsed from geolocation by Post.save
+        instance.save(update_fields=update_fields)
+        return instance
+
+    def get_image_variants(self, obj):
+        return variant_urls(obj.image_variants)
+
 
 class CommentSerializer(serializers.ModelSerializer):
     replies = serializers.SerializerMethodField()
     display_name = serializers.CharField(source='author.display_name', read_only=True)
     avatar_url = serializers.CharField(source='author.avatar_url', read_only=True)
+    avatar_variants = serializers.SerializerMethodField()
 
     class Meta:
         model = Comment
-        fields = ['id', 'post', 'author', 'content', 'parent', 'create_time', 'replies', 'display_name', 'avatar_url']
+        fields = ['id', 'post', 'author', 'content', 'parent', 'create_time', 'replies', 'display_name', 'avatar_url', 'avatar_variants']
+
+    def get_avatar_variants(self, obj):
+        return variant_urls(obj.author.avatar_variants)
 
     def get_replies(self, obj):
-        # Serialize replies recursively
-        if obj.replies.exists():
-            return CommentSerializer(obj.replies.all(), many=True).data
+        # Replies are filled in by posts.comment_tree.build_comment_tree, which loads whole threads in one query
         return []
     
 class CommentCreateSerializer(serializers.ModelSerializer):
@@ -0,0 +1,197 @@
+import random
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.db import connection, transaction
+from django.utils import timezone
+
+from hashtags.models import Hashtag, PostHashtagRel
+from hashtags.trending import record_hashtag_uses_at
+from terrierconnect.response_cache import invalidate_all
+from users.models import User, UserFollowRel
+from .counters import reconcile_counters
+from .geo import encode_geohash
+from .models import Comment, Post, TimelineEntry
+
+# Synthetic data for benchmarks and load tests (see the generate_synthetic_data command).
+# Popularity follows power laws, like on real social networks: a few users get most of the followers and write most
+# of the posts, a few hashtags are used on most posts, and most posts get few comments while some get long threads.
+# Synthetic users have an email at SYNTHETIC_DOMAIN, so they (and everything they wrote) can be deleted at once.
+
+SYNTHETIC_DOMAIN = 'synthetic.terrierconnect.test'
+SYNTHETIC_PASSWORD = 'Terriers#synthetic'
+
+WORDS = (
+    'terrier boston campus commonwealth avenue charles river dining hall library mugar study group midterm final '
+    'exam lecture seminar lab project deadline hockey agganis arena marsh chapel kenmore fenway red sox bruins '
+    'celtics coffee espresso brunch pizza sushi ramen dorm warren towers myles standish bay state road concert '
+    'theatre museum gallery internship career fair resume interview startup hackathon python django react robot '
+    'research thesis professor ta office hours snow spring break graduation commencement photo sunset skyline '
+    'running marathon gym yoga soccer basketball volunteer club meeting party weekend trip cape cod new england'
+).split()
+
+# Places the located posts are gathered around: (latitude, longitude, spread in degrees, weight)
+PLACES = [
+    (42.3505, -71.1054, 0.004, 5),  # Campus
+    (42.3467, -71.0972, 0.003, 3),  # Fenway
+    (42.3601, -71.0589, 0.01, 2),  # Downtown
+    (42.3736, -71.1097, 0.006, 1),  # Cambridge
+    (41.6688, -70.2962, 0.2, 1),  # Cape Cod
+]
+LOCATED_POSTS = 0.4  # Share of the posts with a location
+
+
+@contextmanager
+def historical_timestamps(*models):
+    # Lets bulk_create store the given create_time instead of auto_now_add overwriting it with now()
+    fields = [field for model in models for field in model._meta.concrete_fields if getattr(field, 'auto_now_add', False)]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+def zipf_weights(n, exponent):
+    return [1 / (rank + 1) ** exponent for rank in range(n)]
+
+
+def sentence(rng, length):
+    return ' '.join(rng.choice(WORDS) for _ in range(length))
+
+
+def delete_synthetic_data():
+    """Deletes the synthetic users, with their posts, comments and follow relationships (CASCADE)."""
+    return User.objects.filter(email__endswith=f'@{SYNTHETIC_DOMAIN}').delete()[0]
+
+
+def generate(users=1000, posts=10000, hashtags=300, comments=30000, avg_follows=20, max_depth=8, days=30, seed=0,
+             batch_size=2000, log=print):
+    """
+    Generates a synthetic social graph in bulk, then brings every derived table up to date (counters, timelines,
+    trending buckets), as if the data had been created through the API.
+    """
+    rng = random.Random(seed)
+    now = timezone.now()
+    start = now - timedelta(days=days)
+
+    # Users, ranked by popularity: the rank drives both their followers and their activity
+    password = make_password(SYNTHETIC_PASSWORD)
+    run = f'{seed}-{int(now.timestamp())}'
+    new_users = User.objects.bulk_create(
+        [User(email=f'user{i}-{run}@{SYNTHETIC_DOMAIN}', display_name=f'{rng.choice(WORDS).title()} {rng.choice(WORDS).title()}',
+              bio=sentence(rng, rng.randint(3, 12)), password=password) for i in range(users)],
+        batch_size=batch_size,
+    )
+    user_ids = [user.id for user in new_users]
+    log(f'{len(user_ids)} users')
+
+    # Power-law follow graph: out-degrees are Pareto distributed, targets are picked by popularity rank
+    popularity = zipf_weights(len(user_ids), 1.1)
+    follows = set()
+    for follower_id in user_ids:
+        degree = min(int(rng.paretovariate(1.5) * avg_follows / 3), len(user_ids) - 1)
+        for following_id in rng.choices(user_ids, popularity, k=degree):
+            if following_id != follower_id:
+                follows.add((follower_id, following_id))
+    UserFollowRel.objects.bulk_create([UserFollowRel(follower_id=a, following_id=b) for a, b in follows], batch_size=batch_size)
+    log(f'{len(follows)} follow relationships')
+
+    # Hashtags, ranked by popularity; existing texts are reused
+    texts = list(dict.fromkeys(f'{rng.choice(WORDS)}{rng.choice(WORDS)}' if i >= len(WORDS) else WORDS[i] for i in range(hashtags * 2)))[:hashtags]
+    Hashtag.objects.bulk_create([Hashtag(hashtag_text=text) for text in texts], batch_size=batch_size, ignore_conflicts=True)
+    hashtag_ids = list(Hashtag.objects.filter(hashtag_text__in=texts).values_list('id', flat=True))
+    rng.shuffle(hashtag_ids)
+    hashtag_weights = zipf_weights(len(hashtag_ids), 1.0)
+    log(f'{len(hashtag_ids)} hashtags')
+
+    # Posts by active users, spread over the period, with 0 to 4 hashtags each
+    activity = zipf_weights(len(user_ids), 0.8)
+    span = (now - start).total_seconds()
+    with historical_timestamps(Post):
+        new_posts = []
+        for author_id in rng.choices(user_ids, activity, k=posts):
+            moment = start + timedelta(seconds=rng.random() * span)
+            post = Post(author_id=author_id, title=sentence(rng, rng.randint(3, 8)).capitalize(),
+                        content=sentence(rng, rng.randint(10, 60)), timestamp=moment, create_time=moment)
+            if rng.random() < LOCATED_POSTS:
+                # bulk_create skips save(), which derives the coordinates from the geolocation text
+                latitude, longitude, spread, _ = rng.choices(PLACES, [place[3] for place in PLACES])[0]
+                post.latitude, post.longitude = round(rng.gauss(latitude, spread), 6), round(rng.gauss(longitude, spread), 6)
+                post.geolocation = f'[{post.longitude}, {post.latitude}]'
+                post.geohash = encode_geohash(post.latitude, post.longitude)
+            new_posts.append(post)
+        new_posts = Post.objects.bulk_create(new_posts, batch_size=batch_size)
+    rels = []
+    uses = []
+    for post in new_posts:
+        for hashtag_id in set(rng.choices(hashtag_ids, hashtag_weights, k=rng.choice((0, 1, 1, 2, 2, 3, 4)))):
+            rels.append(PostHashtagRel(post_id_id=post.id, hashtag_id_id=hashtag_id))
+            uses.append((hashtag_id, post.create_time))
+    PostHashtagRel.objects.bulk_create(rels, batch_size=batch_size)
+    record_hashtag_uses_at(use for use in uses if use[1] >= now - timedelta(days=8))  # Older buckets would be pruned
+    log(f'{len(new_posts)} posts, {len(rels)} hashtag uses')
+
+    # Comment threads: comments go to posts by a power law; each one replies to a recent comment of the same post
+    # (building deep chains) or starts a new thread
+    threads = {}  # post -> list of (parent index in the list or None, depth)
+    post_weights = zipf_weights(len(new_posts), 1.0)
+    for post_index in rng.choices(range(len(new_posts)), post_weights, k=comments):
+        nodes = threads.setdefault(post_index, [])
+        parent = None
+        if nodes and rng.random() < 0.7:
+            parent = len(nodes) - 1 - min(int(rng.expovariate(0.5)), len(nodes) - 1)
+            if nodes[parent][1] + 1 > max_depth:
+                parent = None
+        nodes.append((parent, 0 if parent is None else nodes[parent][1] + 1))
+
+    # Inserted level by level, so that the parents' ids are known
+    comment_ids = {}  # (post index, node index) -> (id, root id)
+    with historical_timestamps(Comment):
+        for depth in range(max_depth + 1):
+            level = [(post_index, index, parent) for post_index, nodes in threads.items()
+                     for index, (parent, node_depth) in enumerate(nodes) if node_depth == depth]
+            if not level:
+                break
+            objects = []
+            for post_index, index, parent in level:
+                post = new_posts[post_index]
+                parent_id, root_id = comment_ids[(post_index, parent)] if parent is not None else (None, None)
+                moment = min(post.create_time + timedelta(minutes=index * 7 + rng.randint(1, 60)), now)
+                objects.append(Comment(post_id=post.id, author_id=rng.choices(user_ids, activity)[0], content=sentence(rng, rng.randint(4, 30)),
+                                       parent_id=parent_id, root_id=(root_id or parent_id) if parent_id else None, create_time=moment))
+            for (post_index, index, _), comment in zip(level, Comment.objects.bulk_create(objects, batch_size=batch_size)):
+                comment_ids[(post_index, index)] = (comment.id, comment.root_id)
+    log(f'{len(comment_ids)} comments in {len(threads)} posts')
+
+    # Derived data: counters, fan-out-on-read flags and materialized timelines
+    reconcile_counters(batch_size=batch_size)
+    User.objects.filter(id__in=user_ids, followers_count__gt=settings.FEED_FANOUT_MAX_FOLLOWERS).update(fanout_on_read=True)
+    timeline_entries = fill_timelines(user_ids, batch_size)
+    log(f'{timeline_entries} timeline entries')
+    invalidate_all()  # Bulk inserts send no signals
+
+
+def fill_timelines(user_ids, batch_size=2000):
+    """Fills the timelines of users with the recent posts of everyone they follow, in one INSERT per batch of users."""
+    entry, post, rel, user = (model._meta.db_table for model in (TimelineEntry, Post, UserFollowRel, User))
+    total = 0
+    for start in range(0, len(user_ids), batch_size):
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f'''
+                INSERT INTO {entry} (owner_id, post_id, author_id, create_time)
+                SELECT f.follower_id, p.id, p.author_id, p.create_time FROM (
+                    SELECT id, author_id, create_time, ROW_NUMBER() OVER (PARTITION BY author_id ORDER BY create_time DESC) AS n
+                    FROM {post}
+                ) p
+                JOIN {rel} f ON f.following_id = p.author_id
+                JOIN {user} u ON u.id = p.author_id AND NOT u.fanout_on_read
+                WHERE f.follower_id = ANY(%s) AND p.n <= %s
+                ON CONFLICT DO NOTHING
+            ''', [user_ids[start:start + batch_size], settings.FEED_BACKFILL_POSTS])
+            total += cursor.rowcount
+    return total
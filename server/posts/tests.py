@@ -1,3 +1,856 @@
-from django.test import TestCase
+import json
+from io import StringIO
+from urllib.parse import urlsplit
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection
+from django.test import AsyncRequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+from rest_framework.test import APIClient
+
+from hashtags.models import Hashtag, PostHashtagRel
+from terrierconnect.response_cache import get_versions, invalidate, invalidate_all, is_recent
+from users.authentication import get_cached_user
+from users.models import User, UserFollowRel
+from users.views import generate_jwt_token
+from users import async_views as user_async_views
+from . import async_views
+from .management.commands.benchmark_read_endpoints import ENDPOINTS, get_paths
+from .geo import cover_cells, encode_geohash, parse_geolocation, radius_bbox
+from .map_clusters import tile_bounds, tile_of, tile_resources
+from .models import Comment, Post, TimelineEntry
+from .synthetic import generate
+
+
+# Helper function to build an Authorization header for a user
+def auth_header(user):
+    token = generate_jwt_token(user)
+    if isinstance(token, bytes):
+        token = token.decode()
+    return {'HTTP_AUTHORIZATION': token}  # The client sends the raw token, without a 'Bearer' prefix
+
+
+class PostHydrationQueryCountTests(TestCase):
+    """
+    Regression tests for the post hydration layer.
+    The number of queries of each endpoint must not grow with the number of posts on the page.
+    """
+
+    def setUp(self):
+        self.client = APIClient()
+        caches['search'].clear()
+        self.user = User.objects.create(email='author@bu.edu', display_name='author', password='x')
+        get_cached_user(self.user.id)  # Authenticated requests then only read the user's credentials (see users/authentication.py)
+        self.hashtag = Hashtag.objects.create(hashtag_text='terriers')
+        self.other_hashtag = Hashtag.objects.create(hashtag_text='boston')
+
+    def create_posts(self, count):
+        for i in range(count):
+            author = User.objects.create(email=f'user{Post.objects.count()}@bu.edu', display_name=f'user{Post.objects.count()}', password='x')
+            post = Post.objects.create(title=f'Post {i}', content=f'terriers post number {i}', author=author)
+            PostHashtagRel.objects.create(post_id=post, hashtag_id=self.hashtag)
+            PostHashtagRel.objects.create(post_id=post, hashtag_id=self.other_hashtag)
+
+    def count_queries(self, url, **extra):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url, **extra)
+        self.assertEqual(response.status_code, 200, response.content)
+        return len(ctx.captured_queries), response
+
+    def assert_constant_queries(self, url, **extra):
+        self.create_posts(2)
+        small, _ = self.count_queries(url, **extra)
+        self.create_posts(8)
+        large, response = self.count_queries(url, **extra)
+        self.assertEqual(small, large, f'{url} issues per-row queries ({small} vs {large})')
+        return response
+
+    def test_list_posts(self):
+        response = self.assert_constant_queries('/posts/list_posts/?pageSize=50')
+        first = response.data['results'][0]
+        self.assertEqual(first['hashtags'], ['terriers', 'boston'])
+        self.assertTrue(first['display_name'].startswith('user'))
+
+    def test_list_posts_by_tag(self):
+        self.assert_constant_queries('/posts/list_posts_by_tag/?tag=terriers&pageSize=50')
+
+    def test_full_text_search(self):
+        self.assert_constant_queries('/posts/full_text_search/?query=terriers&pageSize=50')
+
+    def test_get_posts_by_hashtag_id(self):
+        self.assert_constant_queries(f'/hashtags/get_posts_by_hashtag_id/{self.hashtag.id}/?pageSize=50', **auth_header(self.user))
+
+    def test_get_post_detail(self):
+        self.create_posts(1)
+        post = Post.objects.get()
+        queries, response = self.count_queries(f'/posts/get_post_detail/{post.id}/', **auth_header(self.user))
+        self.assertLessEqual(queries, 3)  # Credentials check, post, comments
+        self.assertEqual(response.data['hashtags'], ['terriers', 'boston'])
+
+
+class CursorPaginationTests(TestCase):
+    """Tests for the keyset (cursor) pagination mode of list_posts."""
+
+    def setUp(self):
+        self.client = APIClient()
+        author = User.objects.create(email='author@bu.edu', display_name='author', password='x')
+        self.posts = [Post.objects.create(title=f'Post {i}', content='content', author=author) for i in range(7)]
+        # Give some posts the same create_time so the id tie-breaker is exercised
+        Post.objects.filter(id__in=[p.id for p in self.posts[2:5]]).update(create_time=self.posts[2].create_time)
+
+    def expected_ids(self):
+        return list(Post.objects.order_by('-create_time', '-id').values_list('id', flat=True))
+
+    def test_walk_forward_and_backward(self):
+        response = self.client.get('/posts/list_posts/?cursor=&pageSize=3')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('totalItems', response.data)
+        self.assertIsNone(response.data['prevCursor'])
+
+        seen, pages = [], []
+        while True:
+            pages.append(response.data)
+            seen += [post['id'] for post in response.data['results']]
+            if not response.data['nextCursor']:
+                break
+            response = self.client.get('/posts/list_posts/', {'cursor': response.data['nextCursor'], 'pageSize': 3})
+        self.assertEqual(seen, self.expected_ids())
+
+        # Going back from the last page returns the previous page unchanged
+        response = self.client.get('/posts/list_posts/', {'cursor': pages[-1]['prevCursor'], 'pageSize': 3})
+        self.assertEqual([post['id'] for post in response.data['results']], [post['id'] for post in pages[-2]['results']])
+
+    def test_include_total_and_invalid_cursor(self):
+        response = self.client.get('/posts/list_posts/?cursor=&includeTotal=true')
+        self.assertEqual(response.data['totalItems'], 7)
+        response = self.client.get('/posts/list_posts/?cursor=not-a-cursor')
+        self.assertEqual(response.status_code, 400)
+
+
+class FollowingFeedTests(TestCase):
+    """Tests for the materialized following feed (fan-out-on-write with a fan-out-on-read fallback)."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.reader = User.objects.create(email='reader@bu.edu', display_name='reader', password='x')
+        self.author = User.objects.create(email='author@bu.edu', display_name='author', password='x')
+        self.other = User.objects.create(email='other@bu.edu', display_name='other', password='x')
+
+    def add_post(self, user, title):
+        response = self.client.post('/posts/add_post/', {'title': title, 'content': 'content'}, format='multipart', **auth_header(user))
+        self.assertEqual(response.status_code, 201, response.content)
+        return response.data['id']
+
+    def follow(self, user, target):
+        response = self.client.post(f'/users/{target.id}/follow/', **auth_header(user))
+        self.assertEqual(response.status_code, 201, response.content)
+
+    def feed_ids(self, **params):
+        response = self.client.get('/posts/list_posts/', {'flag': 'following', **params}, **auth_header(self.reader))
+        self.assertEqual(response.status_code, 200, response.content)
+        return [post['id'] for post in response.data['results']], response.data
+
+    def test_follow_post_and_unfollow(self):
+        old_post = self.add_post(self.author, 'before follow')
+        self.add_post(self.other, 'not followed')
+        self.follow(self.reader, self.author)
+        new_post = self.add_post(self.author, 'after follow')
+
+        ids, data = self.feed_ids()
+        self.assertEqual(ids, [new_post, old_post])
+        self.assertEqual(data['totalItems'], 2)
+
+        self.client.delete(f'/posts/delete_post/{new_post}/', **auth_header(self.author))
+        self.assertEqual(self.feed_ids()[0], [old_post])
+
+        self.client.delete(f'/users/{self.author.id}/unfollow/', **auth_header(self.reader))
+        self.assertEqual(self.feed_ids()[0], [])
+        self.assertFalse(TimelineEntry.objects.filter(owner=self.reader).exists())
+
+    @override_settings(FEED_FANOUT_MAX_FOLLOWERS=1)
+    def test_high_follower_author_is_merged_on_read(self):
+        self.follow(self.reader, self.author)
+        self.follow(self.other, self.author)
+        self.follow(self.reader, self.other)
+        first = self.add_post(self.author, 'pulled on read')
+        second = self.add_post(self.other, 'fanned out')
+        third = self.add_post(self.author, 'pulled on read again')
+
+        self.author.refresh_from_db()
+        self.assertTrue(self.author.fanout_on_read)
+        self.assertFalse(TimelineEntry.objects.filter(author=self.author).exists())
+
+        ids, data = self.feed_ids(cursor='', pageSize=2)
+        self.assertEqual(ids, [third, second])
+        ids, _ = self.feed_ids(cursor=data['nextCursor'], pageSize=2)
+        self.assertEqual(ids, [first])
+        self.assertEqual(self.feed_ids()[0], [third, second, first])
+
+
+class CommentTreeTests(TestCase):
+    """Tests for the single-query comment tree builder behind list_comments."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create(email='author@bu.edu', display_name='author', password='x')
+        self.post = Post.objects.create(title='Post', content='content', author=self.user)
+
+    def comment(self, parent=None):
+        return Comment.objects.create(post=self.post, author=self.user, content='comment', parent=parent)
+
+    def ids(self, nodes):
+        return [(node['id'], self.ids(node['replies'])) for node in nodes]
+
+    def test_nesting_and_constant_queries(self):
+        root = self.comment()
+        reply = self.comment(root)
+        nested = self.comment(reply)
+        other_root = self.comment()
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(f'/posts/{self.post.id}/comments/')
+        self.assertEqual(self.ids(response.data['results']), [(root.id, [(reply.id, [(nested.id, [])])]), (other_root.id, [])])
+        self.assertEqual(nested.root_id, root.id)
+        self.assertEqual(response.data['results'][0]['replies'][0]['display_name'], 'author')
+
+        for _ in range(5):
+            self.comment(self.comment(reply))
+        with CaptureQueriesContext(connection) as ctx_more:
+            self.client.get(f'/posts/{self.post.id}/comments/')
+        self.assertEqual(len(ctx.captured_queries), len(ctx_more.captured_queries))
+
+    def test_truncation_and_load_more(self):
+        root = self.comment()
+        replies = [self.comment(root) for _ in range(3)]
+        self.comment(replies[0])
+
+        response = self.client.get(f'/posts/{self.post.id}/comments/?maxReplies=2&maxDepth=1')
+        node = response.data['results'][0]
+        self.assertEqual(self.ids(node['replies']), [(replies[0].id, []), (replies[1].id, [])])
+        self.assertTrue(node['hasMoreReplies'])
+        self.assertEqual(node['replies'][0]['repliesCursor'], '')
+
+        response = self.client.get(f'/posts/comments/{root.id}/replies/', {'cursor': node['repliesCursor']})
+        self.assertEqual([item['id'] for item in response.data['results']], [replies[2].id])
+
+    def test_cursor_follows_order_by(self):
+        root = self.comment()
+        roots = [root] + [self.comment() for _ in range(2)]
+        replies = [self.comment(root) for _ in range(3)]
+
+        response = self.client.get(f'/posts/{self.post.id}/comments/', {'orderBy': '-create_time', 'cursor': '', 'pageSize': 2})
+        self.assertEqual([item['id'] for item in response.data['results']], [roots[2].id, roots[1].id])
+        response = self.client.get(f'/posts/comments/{root.id}/replies/', {'orderBy': '-create_time', 'cursor': ''})
+        self.assertEqual([item['id'] for item in response.data['results']], [reply.id for reply in reversed(replies)])
+
+        # Orders without a keyset can't be paged with a cursor
+        for path in (f'/posts/{self.post.id}/comments/', f'/posts/comments/{root.id}/replies/', f'/posts/comments/authors/{self.user.id}/'):
+            response = self.client.get(path, {'orderBy': 'content', 'cursor': ''})
+            self.assertEqual(response.status_code, 400, path)
+            self.assertEqual(self.client.get(path, {'orderBy': 'content'}).status_code, 200, path)
+
+
+class SearchVectorTests(TestCase):
+    """Tests for the trigger-maintained search vector used by full_text_search."""
+
+    def setUp(self):
+        self.client = APIClient()
+        caches['search'].clear()
+        self.user = User.objects.create(email='author@bu.edu', display_name='author', password='x')
+
+    def search_ids(self, query):
+        response = self.client.get('/posts/full_text_search/', {'query': query})
+        self.assertEqual(response.status_code, 200, response.content)
+        return [post['id'] for post in response.data['results']]
+
+    def test_title_is_weighted_above_content(self):
+        in_content = Post.objects.create(title='Weekend plans', content='Anyone up for hockey?', author=self.user)
+        in_title = Post.objects.create(title='Hockey tickets', content='Two seats left', author=self.user)
+        self.assertEqual(self.search_ids('hockey'), [in_title.id, in_content.id])
+
+        in_title.title = 'Concert tickets'
+        in_title.save()
+        self.assertEqual(self.search_ids('hockey'), [in_content.id])
+
+    def test_backfill_command(self):
+        post = Post.objects.create(title='Marathon', content='Cheering at mile 20', author=self.user)
+        with connection.cursor() as cursor:
+            # Simulate a row written before the trigger existed
+            cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+            cursor.execute('ALTER TABLE posts_post DISABLE TRIGGER posts_post_search_vector_trigger')
+            cursor.execute('UPDATE posts_post SET search_vector = NULL')
+            cursor.execute('ALTER TABLE posts_post ENABLE TRIGGER posts_post_search_vector_trigger')
+        self.assertEqual(self.search_ids('marathon'), [])
+
+        caches['search'].clear()  # The raw SQL above bypasses the cache invalidation
+        call_command('backfill_search_vectors', '--only-missing', stdout=StringIO())
+        self.assertEqual(self.search_ids('marathon'), [post.id])
+
+
+class SearchCacheTests(TestCase):
+    """Tests for the full_text_search result cache and its invalidation."""
+
+    def setUp(self):
+        self.client = APIClient()
+        caches['search'].clear()
+        self.user = User.objects.create(email='author@bu.edu', display_name='author', password='x')
+        self.post = Post.objects.create(title='Hockey night', content='Terriers vs Eagles', author=self.user)
+
+    def search(self, query):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/posts/full_text_search/', {'query': query})
+        self.assertEqual(response.status_code, 200, response.content)
+        searched = any('@@' in query['sql'] for query in ctx.captured_queries)  # Whether the search ran in Postgres
+        return [post['id'] for post in response.data['results']], searched
+
+    def test_repeated_and_normalized_queries_hit_the_cache(self):
+        self.assertEqual(self.search('hockey'), ([self.post.id], True))
+        self.assertEqual(self.search('  HOCKEY '), ([self.post.id], False))
+        stats = self.client.get('/posts/search_cache_stats/', **auth_header(self.user)).data
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+    def test_writes_invalidate_only_matching_queries(self):
+        self.search('hockey')
+        self.search('concert')
+
+        Post.objects.create(title='Jazz concert', content='Tonight', author=self.user)
+        self.assertFalse(self.search('hockey')[1])
+        concert_ids, searched = self.search('concert')
+        self.assertTrue(searched)
+        self.assertEqual(len(concert_ids), 1)
+
+        # An update matching before but not after, then a delete
+        self.post.title = 'Basketball night'
+        self.post.content = 'Terriers vs Huskies'
+        self.post.save()
+        self.assertEqual(self.search('hockey'), ([], True))
+        self.assertEqual(self.search('basketball'), ([self.post.id], True))
+        self.post.delete()
+        self.assertEqual(self.search('basketball'), ([], True))
+
+
+class AsyncReadViewsTests(TestCase):
+    """The async read views (ASYNC_READ_VIEWS) must answer exactly like the sync ones."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.factory = AsyncRequestFactory()
+        self.reader = User.objects.create(email='reader@bu.edu', display_name='reader', password='x')
+        self.author = User.objects.create(email='author@bu.edu', display_name='author', password='x')
+        self.client.post(f'/users/{self.author.id}/follow/', **auth_header(self.reader))
+        for i in range(3):
+            response = self.client.post('/posts/add_post/', {'title': f'terrier post {i}', 'content': 'content', 'hashtags': '["async"]'}, format='multipart', **auth_header(self.author))
+            self.assertEqual(response.status_code, 201, response.content)
+        self.post = Post.objects.order_by('id').first()
+        self.headers = {'Authorization': auth_header(self.reader)['HTTP_AUTHORIZATION']}
+        comment = Comment.objects.create(post=self.post, author=self.reader, content='top')
+        Comment.objects.create(post=self.post, author=self.author, content='reply', parent=comment)
+
+    async def compare(self, view, path, params, **kwargs):
+        sync_response = await sync_to_async(self.client.get)(path, params, **auth_header(self.reader))
+        async_response = await view(self.factory.get(path, params, headers=self.headers), **kwargs)
+        self.assertEqual(async_response.status_code, sync_response.status_code, async_response.content)
+        self.assertEqual(json.loads(async_response.content), json.loads(sync_response.content))
+        return json.loads(async_response.content)
+
+    async def test_same_responses_as_sync_views(self):
+        await self.compare(async_views.list_posts, '/posts/list_posts/', {'pageSize': 2})
+        await self.compare(async_views.list_posts, '/posts/list_posts/', {'flag': 'following', 'cursor': ''})
+        await self.compare(async_views.list_posts, '/posts/list_posts/', {'page': 9})
+        await self.compare(async_views.get_post_detail, f'/posts/get_post_detail/{self.post.id}/', {}, post_id=self.post.id)
+        await self.compare(async_views.get_post_detail, '/posts/get_post_detail/0/', {}, post_id=0)
+        await self.compare(async_views.list_comments, f'/posts/{self.post.id}/comments/', {'maxDepth': 2}, post_id=self.post.id)
+        data = await self.compare(async_views.full_text_search, '/posts/full_text_search/', {'query': 'terrier'})
+        self.assertEqual(len(data['results']), 3)
+        await self.compare(async_views.full_text_search, '/posts/full_text_search/', {'query': 'terrier'})  # Cached
+        await self.compare(user_async_views.get_user_info_by_id, f'/users/user/{self.author.id}/', {}, user_id=self.author.id)
+
+    async def test_authentication_and_methods(self):
+        request = self.factory.get('/posts/list_posts/', {'flag': 'following'})
+        response = await async_views.list_posts(request)
+        self.assertEqual(response.status_code, 401)
+
+        request = self.factory.post(f'/users/user/{self.author.id}/', headers=self.headers)
+        response = await user_async_views.get_user_info_by_id(request, user_id=self.author.id)
+        self.assertEqual(response.status_code, 405)
+
+
+class DenormalizedCounterTests(TestCase):
+    """Tests for the follower, following, post and comment counters, and their reconciliation."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create(email='author@bu.edu', display_name='author', password='x')
+        self.fan = User.objects.create(email='fan@bu.edu', display_name='fan', password='x')
+
+    def counts(self, user):
+        user.refresh_from_db()
+        return user.followers_count, user.following_count, user.posts_count
+
+    def test_follow_counters(self):
+        self.assertEqual(self.client.post(f'/users/{self.user.id}/follow/', **auth_header(self.fan)).status_code, 201)
+        self.assertEqual(self.client.post(f'/users/{self.user.id}/follow/', **auth_header(self.fan)).status_code, 400)
+        self.assertEqual(self.counts(self.user), (1, 0, 0))
+        self.assertEqual(self.counts(self.fan), (0, 1, 0))
+
+        # The list reads its total from the counter
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(f'/users/{self.user.id}/followers/')
+        self.assertEqual(response.data['totalItems'], 1)
+        self.assertFalse([query for query in ctx.captured_queries if 'COUNT(' in query['sql']])
+
+        # Saving a stale copy of the user (e.g. the cached one of its token) doesn't overwrite its counters
+        response = self.client.put('/users/update_profile/', {'bio': 'new bio'}, format='multipart', **auth_header(self.user))
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(self.counts(self.user), (1, 0, 0))
+
+        self.assertEqual(self.client.delete(f'/users/{self.user.id}/unfollow/', **auth_header(self.fan)).status_code, 204)
+        self.assertEqual(self.client.delete(f'/users/{self.user.id}/unfollow/', **auth_header(self.fan)).status_code, 400)
+        self.assertEqual(self.counts(self.user), (0, 0, 0))
+        self.assertEqual(self.counts(self.fan), (0, 0, 0))
+
+    def test_post_and_comment_counters(self):
+        response = self.client.post('/posts/add_post/', {'title': 'Post', 'content': 'content'}, format='multipart', **auth_header(self.user))
+        post_id = response.data['id']
+        self.assertEqual(self.counts(self.user), (0, 0, 1))
+
+        self.client.post('/posts/comments/create/', {'post': post_id, 'content': 'top'}, format='json', **auth_header(self.fan))
+        comment_id = Comment.objects.get(post_id=post_id).id
+        self.client.post('/posts/comments/create/', {'post': post_id, 'content': 'reply', 'parent': comment_id}, format='json', **auth_header(self.user))
+        self.assertEqual(Post.objects.get(id=post_id).comments_count, 2)
+        self.assertEqual(self.client.get(f'/posts/get_post_detail/{post_id}/', **auth_header(self.fan)).data['comments_count'], 2)
+
+        # Editing the post only writes the fields sent, not a comments_count read before concurrent comments
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.put(f'/posts/update_post/{post_id}/', {'title': 'Edited', 'geolocation': '[-71.1, 42.35]'}, format='multipart', **auth_header(self.user))
+        self.assertEqual(response.status_code, 200, response.content)
+        updates = [query['sql'] for query in ctx.captured_queries if query['sql'].startswith('UPDATE "posts_post"')]
+        self.assertEqual(len(updates), 1)
+        self.assertNotIn('comments_count', updates[0])
+        post = Post.objects.get(id=post_id)
+        self.assertEqual((post.title, post.content, post.latitude, post.comments_count), ('Edited', 'content', 42.35, 2))
+
+        # Deleting a comment also deletes (and uncounts) its replies
+        self.client.delete(f'/posts/comments/delete/{comment_id}/', **auth_header(self.fan))
+        self.assertEqual(Post.objects.get(id=post_id).comments_count, 0)
+
+        self.client.delete(f'/posts/delete_post/{post_id}/', **auth_header(self.user))
+        self.assertEqual(self.counts(self.user), (0, 0, 0))
+
+    def test_reconcile_counters(self):
+        post = Post.objects.create(title='Post', content='content', author=self.user)
+        Comment.objects.create(post=post, author=self.fan, content='comment')
+        UserFollowRel.objects.create(follower=self.fan, following=self.user)
+        User.objects.filter(id=self.user.id).update(followers_count=7, posts_count=0)
+
+        out = StringIO()
+        call_command('reconcile_counters', '--dry-run', stdout=out)
+        self.assertIn('Would repair 4 counter(s)', out.getvalue())
+        self.assertEqual(self.counts(self.user), (7, 0, 0))
+
+        call_command('reconcile_counters', '--batch-size', '1', stdout=StringIO())
+        self.assertEqual(self.counts(self.user), (1, 0, 1))
+        self.assertEqual(self.counts(self.fan), (0, 1, 0))
+        self.assertEqual(Post.objects.get(id=post.id).comments_count, 1)
+
+
+class SyntheticDataTests(TestCase):
+    """Tests for the synthetic data generator of the benchmarks."""
+
+    def test_generate(self):
+        call_command('generate_synthetic_data', users=40, posts=200, hashtags=20, comments=600, max_depth=4, stdout=StringIO())
+        self.assertEqual(User.objects.count(), 40)
+        self.assertEqual(Post.objects.count(), 200)
+        self.assertEqual(Comment.objects.count(), 600)
+        self.assertTrue(UserFollowRel.objects.exists())
+        self.assertTrue(PostHashtagRel.objects.exists())
+
+        # Threads are consistent: replies belong to their parent's post and thread, within the maximum depth
+        comments = {comment.id: comment for comment in Comment.objects.all()}
+        for comment in comments.values():
+            depth, node = 0, comment
+            while node.parent_id:
+                parent = comments[node.parent_id]
+                self.assertEqual(parent.post_id, comment.post_id)
+                depth, node = depth + 1, parent
+            self.assertLessEqual(depth, 4)
+            self.assertEqual(comment.root_id, node.id if comment.parent_id else None)
+        self.assertTrue(any(comment.parent_id for comment in comments.values()))
+
+        # Derived data is up to date: no counter drift, timelines filled
+        repaired = StringIO()
+        call_command('reconcile_counters', dry_run=True, stdout=repaired)
+        self.assertIn('Would repair 0 counter(s) in total.', repaired.getvalue())
+        follow = UserFollowRel.objects.filter(following__posts_count__gt=0).first()
+        self.assertTrue(TimelineEntry.objects.filter(owner_id=follow.follower_id, author_id=follow.following_id).exists())
+
+        # The generated data can be deleted at once
+        call_command('generate_synthetic_data', users=5, posts=5, comments=5, reset=True, stdout=StringIO())
+        self.assertEqual(User.objects.count(), 5)
+
+    def test_benchmark_paths_resolve_to_their_views(self):
+        user = User.objects.create(email='bench@bu.edu', display_name='bench')
+        post = Post.objects.create(title='Benchmark post', content='content', author=user)
+        paths = get_paths(user, post)
+        self.assertEqual(set(paths), set(ENDPOINTS))
+        for endpoint, path in paths.items():
+            # Variants of an endpoint are named <view>_<variant>
+            view = {'list_posts_following': 'list_posts'}.get(endpoint, endpoint)
+            func = resolve(urlsplit(path).path).func
+            self.assertEqual(getattr(func, 'cls', func).__name__, view, path)  # DRF views keep the function in cls
+
+
+class ResponseCacheTests(TestCase):
+    """Tests for the ETags and cached bodies of the read endpoints, and their invalidation by writes."""
+
+    def setUp(self):
+        caches['responses'].clear()
+        self.client = APIClient()
+        self.author = User.objects.create(email='author@bu.edu', display_name='author', password='x')
+        self.reader = User.objects.create(email='reader@bu.edu', display_name='reader', password='x')
+        response = self.client.post('/posts/add_post/', {'title': 'title', 'content': 'content', 'hashtags': '["etag"]'}, format='multipart', **auth_header(self.author))
+        self.post = Post.objects.get(id=response.data['id'])
+
+    def get(self, path, etag=None):
+        headers = {'HTTP_IF_NONE_MATCH': etag} if etag else {}
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(path, **auth_header(self.reader), **headers)
+        # Not counting the check of the reader's password and is_active (see users/authentication.py)
+        queries = [query for query in ctx.captured_queries if not query['sql'].startswith('SELECT "users_user"."password", "users_user"."is_active"')]
+        return response, len(queries)
+
+    def assertRevalidates(self, path, write):
+        response, _ = self.get(path)
+        self.assertEqual(response.status_code, 200, response.content)
+        etag = response['ETag']
+
+        # Unchanged: 304 without any query, then the cached body for clients without the ETag
+        response, queries = self.get(path, etag)
+        self.assertEqual((response.status_code, queries), (304, 0))
+        cached, _ = self.get(path)
+        self.assertEqual(cached['ETag'], etag)
+
+        write()
+        response, _ = self.get(path, etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        return json.loads(response.content)
+
+    def test_post_detail(self):
+        path = f'/posts/get_post_detail/{self.post.id}/'
+        data = self.assertRevalidates(path, lambda: self.client.post('/posts/comments/create/', {'post': self.post.id, 'content': 'new'}, format='json', **auth_header(self.reader)))
+        self.assertEqual(data['comments_count'], 1)
+
+        # The author's profile is shown with the post
+        def rename():
+            self.author.display_name = 'renamed'
+            self.author.save()
+        data = self.assertRevalidates(path, rename)
+        self.assertEqual(data['display_name'], 'renamed')
+
+        # Anonymous requests are rejected, even with a valid ETag
+        etag = self.get(path)[0]['ETag']
+        self.assertEqual(self.client.get(path, HTTP_IF_NONE_MATCH=etag).status_code, 401)
+
+    def test_bodies_are_only_cached_in_a_shared_cache(self):
+        path = f'/posts/get_post_detail/{self.post.id}/'
+        self.get(path)
+        # The default per-process cache: another worker could have changed the post since
+        response, queries = self.get(path)
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(queries, 0)
+
+        with override_settings(RESPONSE_CACHE_LOCAL_BODIES=True):
+            self.get(path)
+            response, queries = self.get(path)
+        self.assertEqual((response.status_code, queries), (200, 0))
+        self.assertEqual(json.loads(response.content)['id'], self.post.id)
+
+    def test_comments(self):
+        path = f'/posts/{self.post.id}/comments/'
+        data = self.assertRevalidates(path, lambda: self.client.post('/posts/comments/create/', {'post': self.post.id, 'content': 'first'}, format='json', **auth_header(self.reader)))
+        self.assertEqual([comment['content'] for comment in data['results']], ['first'])
+
+    def test_user_info_and_followers(self):
+        data = self.assertRevalidates(f'/users/user/{self.author.id}/', lambda: self.client.post(f'/users/{self.author.id}/follow/', **auth_header(self.reader)))
+        self.assertEqual(data['user']['followers_count'], 1)
+
+        # A follower's profile is shown in the list of followers
+        def rename():
+            self.reader.display_name = 'renamed'
+            self.reader.save()
+        data = self.assertRevalidates(f'/users/{self.author.id}/followers/', rename)
+        self.assertEqual(data['results'][0]['display_name'], 'renamed')
+
+    async def test_async_views(self):
+        factory = AsyncRequestFactory()
+        path = f'/users/user/{self.author.id}/'
+        headers = {'Authorization': auth_header(self.reader)['HTTP_AUTHORIZATION']}
+        response = await user_async_views.get_user_info_by_id(factory.get(path, headers=headers), user_id=self.author.id)
+        self.assertEqual(response.status_code, 200)
+        request = factory.get(path, headers={**headers, 'If-None-Match': response['ETag']})
+        self.assertEqual((await user_async_views.get_user_info_by_id(request, user_id=self.author.id)).status_code, 304)
+
+    def test_only_writes_pin_reads_to_the_primary(self):
+        caches['responses'].clear()
+        resource = f'post:{self.post.id}'
+        self.assertFalse(is_recent(get_versions([resource])))  # Created on a cache miss: replicas are fine
+
+        with self.captureOnCommitCallbacks(execute=True):
+            invalidate(resource)
+        versions = get_versions([resource])
+        self.assertTrue(is_recent(versions))
+        with override_settings(DB_READ_YOUR_WRITES_SECONDS=0):
+            self.assertFalse(is_recent(versions))
+
+        caches['responses'].delete(f'response:version:{resource}')  # Expired
+        self.assertFalse(is_recent(get_versions([resource])))
+        invalidate_all()
+        self.assertTrue(is_recent(get_versions([resource])))
+
+
+class GeolocationTests(TestCase):
+    """Tests for the typed post locations, their geohash and the nearby posts endpoint."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.author = User.objects.create(email='author@bu.edu', display_name='author', password='x')
+
+    def add_post(self, title, geolocation):
+        response = self.client.post('/posts/add_post/', {'title': title, 'content': 'content', 'geolocation': geolocation}, format='multipart', **auth_header(self.author))
+        self.assertEqual(response.status_code, 201, response.content)
+        return Post.objects.get(id=response.data['id'])
+
+    def test_parse_and_encode(self):
+        self.assertEqual(parse_geolocation('[-71.1054, 42.3505]'), (42.3505, -71.1054))  # Client format: [lng, lat]
+        self.assertEqual(parse_geolocation('{"lat": 42.3505, "lng": -71.1054}'), (42.3505, -71.1054))
+        self.assertEqual(parse_geolocation(' 42.3505, -71.1054 '), (42.3505, -71.1054))
+        for text in ('', 'Boston', '[1]', '[200, 10]', 'nan, 1', '[true, 1]'):
+            self.assertIsNone(parse_geolocation(text), text)
+        self.assertEqual(encode_geohash(57.64911, 10.40744, 11), 'u4pruydqqvj')
+        self.assertTrue(encode_geohash(42.3505, -71.1054).startswith('drt2'))
+
+    def test_cover_cells(self):
+        cells = cover_cells(*radius_bbox(42.3505, -71.1054, 1))
+        self.assertLessEqual(len(cells), 16)
+        for latitude, longitude in ((42.3505, -71.1054), (42.3415, -71.1054), (42.3505, -71.0933), (42.3594, -71.1175)):
+            self.assertTrue(any(encode_geohash(latitude, longitude).startswith(cell) for cell in cells), (latitude, longitude))
+        self.assertIsNone(cover_cells(-90, -180, 90, 180, max_cells=1))
+
+    def test_nearby(self):
+        campus = self.add_post('campus', '[-71.1054, 42.3505]')
+        fenway = self.add_post('fenway', '[-71.0972, 42.3467]')  # ~0.8 km
+        self.add_post('cape', '[-70.2962, 41.6688]')
+        self.add_post('nowhere', 'somewhere on campus')
+        self.assertEqual((campus.latitude, campus.longitude, campus.geohash), (42.3505, -71.1054, encode_geohash(42.3505, -71.1054)))
+
+        response = self.client.get('/posts/list_posts_nearby/', {'lat': 42.3467, 'lng': -71.0972, 'radius': 2})
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual([post['id'] for post in response.data['results']], [fenway.id, campus.id])
+        self.assertAlmostEqual(response.data['results'][1]['distance_km'], 0.79, delta=0.05)
+
+        response = self.client.get('/posts/list_posts_nearby/', {'lat': 42.3467, 'lng': -71.0972, 'radius': 0.5})
+        self.assertEqual([post['id'] for post in response.data['results']], [fenway.id])
+
+        response = self.client.get('/posts/list_posts_nearby/', {'bbox': '-72,41,-70,43', 'orderBy': '-create_time', 'cursor': ''})
+        self.assertEqual(len(response.data['results']), 3)
+        self.assertEqual(response.data['results'][0]['title'], 'cape')
+
+        # Editing the location moves the post
+        response = self.client.put(f'/posts/update_post/{campus.id}/', {'title': 'campus', 'content': 'content', 'geolocation': '[-70.2962, 41.6688]'}, format='multipart', **auth_header(self.author))
+        self.assertEqual(response.status_code, 200, response.content)
+        response = self.client.get('/posts/list_posts_nearby/', {'lat': 42.3467, 'lng': -71.0972, 'radius': 2})
+        self.assertEqual([post['id'] for post in response.data['results']], [fenway.id])
+
+        for params in ({'lat': 42}, {'lat': 91, 'lng': 0}, {'lat': 42, 'lng': -71, 'radius': 500}, {'bbox': '1,2,3'}, {'lat': 42, 'lng': -71, 'orderBy': 'title'}):
+            self.assertEqual(self.client.get('/posts/list_posts_nearby/', params).status_code, 400, params)
+
+    def test_backfill(self):
+        post = self.add_post('campus', '[-71.1054, 42.3505]')
+        Post.objects.filter(id=post.id).update(latitude=None, longitude=None, geohash=None)
+        Post.objects.filter(id=self.add_post('bad', 'x').id).update(geolocation='(42.1, -71.2')
+        out = StringIO()
+        call_command('backfill_geolocation', stdout=out)
+        self.assertIn('Located 1 post(s).', out.getvalue())
+        self.assertIn('Could not parse the geolocation of 1 post(s)', out.getvalue())
+        post.refresh_from_db()
+        self.assertEqual(post.geohash, encode_geohash(42.3505, -71.1054))
+
+
+class MapClusterTests(TestCase):
+    """Tests for the map clusters, computed and cached per tile."""
+
+    def setUp(self):
+        caches['responses'].clear()
+        self.client = APIClient()
+        self.author = User.objects.create(email='author@bu.edu', display_name='author', password='x')
+        self.posts = [
+            Post.objects.create(author=self.author, title=f'post {i}', content='content', geolocation=geolocation)
+            for i, geolocation in enumerate(['[-71.1054, 42.3505]', '[-71.1053, 42.3505]', '[-71.0589, 42.3601]', 'nowhere'])
+        ]
+
+    def clusters(self, zoom, bbox='-71.2,42.3,-71.0,42.4'):
+        response = self.client.get('/posts/map_clusters/', {'bbox': bbox, 'zoom': zoom})
+        self.assertEqual(response.status_code, 200, response.content)
+        return sorted((cluster['count'], sorted(cluster['sample_post_ids'])) for cluster in response.data['clusters'])
+
+    def test_tiles(self):
+        self.assertEqual(tile_of(42.3505, -71.1054, 0), (0, 0))
+        self.assertEqual(tile_of(42.3505, -71.1054, 13), (2477, 3030))
+        min_lat, min_lng, max_lat, max_lng = tile_bounds(13, 2477, 3030)
+        self.assertTrue(min_lat <= 42.3505 <= max_lat and min_lng <= -71.1054 <= max_lng)
+        self.assertEqual(len(tile_resources(42.3505, -71.1054)), 21)
+
+    def test_clusters(self):
+        campus, campus_too, downtown, _ = self.posts
+        self.assertEqual(self.clusters(2), [(3, sorted([campus.id, campus_too.id, downtown.id]))])
+        self.assertEqual(self.clusters(13), [(1, [downtown.id]), (2, sorted([campus.id, campus_too.id]))])
+
+        # Cached per tile: no query until a located post is written in the tile
+        with CaptureQueriesContext(connection) as ctx:
+            self.clusters(13)
+        self.assertFalse([query for query in ctx.captured_queries if 'posts_post' in query['sql']])
+
+        # Moving a post updates the tiles of both locations
+        campus_too.geolocation = '[-71.0590, 42.3600]'
+        campus_too.save()
+        self.assertEqual(self.clusters(13), [(1, [campus.id]), (2, sorted([campus_too.id, downtown.id]))])
+        downtown.delete()
+        self.assertEqual(self.clusters(13), [(1, [campus.id]), (1, [campus_too.id])])
+
+    def test_missing_tiles_are_computed_together(self):
+        with CaptureQueriesContext(connection) as ctx:
+            clusters = self.clusters(13)  # 6 x 4 tiles
+        self.assertEqual(len([query for query in ctx.captured_queries if 'posts_post' in query['sql']]), 1)
+        self.assertEqual(sum(count for count, _ in clusters), 3)
+
+        # Only the tiles that aren't cached yet
+        caches['responses'].clear()
+        self.clusters(13, bbox='-71.2,42.3,-71.1,42.4')
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(self.clusters(13), clusters)
+        self.assertEqual(len([query for query in ctx.captured_queries if 'posts_post' in query['sql']]), 1)
+
+    def test_post_on_tile_edges_is_counted_once(self):
+        # On the corner of four tiles
+        latitude, longitude = tile_bounds(13, 2477, 3030)[:2]
+        corner = Post.objects.create(author=self.author, title='corner', content='content', geolocation=f'[{longitude!r}, {latitude!r}]')
+        bbox = f'{longitude - 0.01},{latitude - 0.01},{longitude + 0.01},{latitude + 0.01}'
+        campus, campus_too = self.posts[:2]
+        self.assertEqual(self.clusters(13, bbox), [(1, [corner.id]), (2, sorted([campus.id, campus_too.id]))])
+
+    def test_invalid_parameters(self):
+        for params in ({'zoom': 3}, {'bbox': '-71.2,42.3,-71.0,42.4'}, {'bbox': '-71.2,42.3,-71.0,42.4', 'zoom': 21},
+                       {'bbox': '-71.2,42.3,-71.0,42.4', 'zoom': 18}):  # Too many tiles
+            self.assertEqual(self.client.get('/posts/map_clusters/', params).status_code, 400, params)
+
+
+class CommentPreviewTests(TestCase):
+    """Tests for the comment counts and latest comments of a page of posts."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.author = User.objects.create(email='author@bu.edu', display_name='author', password='x')
+        self.posts = [Post.objects.create(author=self.author, title=f'post {i}', content='content') for i in range(3)]
+        self.comments = []
+        for post, count in zip(self.posts, (3, 1, 0)):
+            for i in range(count):
+                response = self.client.post('/posts/comments/create/', {'post': post.id, 'content': f'comment {i} of {post.title}'}, format='json', **auth_header(self.author))
+                self.assertEqual(response.status_code, 201, response.content)
+        self.first = Comment.objects.filter(post=self.posts[0]).order_by('id').last()
+        Comment.objects.create(post=self.posts[0], author=self.author, content='reply', parent=self.first)
+
+    def test_previews(self):
+        post_ids = [self.posts[2].id, self.posts[0].id, 0, self.posts[1].id]
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/posts/comments/previews/', {'postIds': ','.join(map(str, post_ids)), 'limit': 2})
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(len(ctx.captured_queries), 3)
+
+        results = response.data['results']
+        self.assertEqual([result['post_id'] for result in results], [self.posts[2].id, self.posts[0].id, self.posts[1].id])
+        self.assertEqual([result['comments_count'] for result in results], [0, 3, 1])  # The reply isn't created by the view
+        self.assertEqual([comment['content'] for comment in results[1]['latest_comments']], ['comment 2 of post 0', 'comment 1 of post 0'])
+        self.assertTrue(results[1]['latest_comments'][0]['hasMoreReplies'])
+        self.assertNotIn('hasMoreReplies', results[1]['latest_comments'][1])
+        self.assertEqual(len(results[2]['latest_comments']), 1)
+        self.assertEqual(results[0]['latest_comments'], [])
+
+    def test_invalid_parameters(self):
+        for params in ({}, {'postIds': 'a,b'}, {'postIds': ','.join(map(str, range(1, 102)))}, {'postIds': '1', 'limit': 6}):
+            self.assertEqual(self.client.get('/posts/comments/previews/', params).status_code, 400, params)
+
+
+class QueryPlanTests(TestCase):
+    """
+    Query plan regression tests: the queries run by the list endpoints must not scan the large tables sequentially.
+    Runs EXPLAIN on every query captured while calling the endpoints, on a synthetic dataset with fresh statistics.
+    """
+    LARGE_TABLES = {'posts_post', 'posts_comment', 'posts_timelineentry', 'hashtags_posthashtagrel', 'users_userfollowrel'}
+
+    @classmethod
+    def setUpTestData(cls):
+        generate(users=500, posts=15000, hashtags=100, comments=20000, avg_follows=10, seed=1, log=lambda message: None)
+        # The synthetic posts draw from a small vocabulary: a rare word is searched, common ones rightly scan the table
+        Post.objects.create(author=User.objects.first(), title='Lost quokka', content='Has anyone seen a quokka near Mugar?')
+        with connection.cursor() as cursor:
+            # As autovacuum would: merge the rows just inserted into the GIN index, whose pending list makes index
+            # scans look expensive
+            cursor.execute("SELECT gin_clean_pending_list('posts_post_search_gin_idx')")
+            cursor.execute('ANALYZE')
+        cls.user = User.objects.order_by('-following_count').first()
+        cls.author = User.objects.order_by('-posts_count').first()
+        cls.post = Post.objects.order_by('-comments_count').first()
+        cls.comment = Comment.objects.filter(post=cls.post, parent__isnull=True).order_by('id').first()
+        cls.hashtag = Hashtag.objects.order_by('use_count').last()
+
+    def setUp(self):
+        self.client = APIClient()
+        for alias in ('responses', 'search'):
+            caches[alias].clear()
+
+    def sequential_scans(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}')
+            plan = cursor.fetchone()[0][0]['Plan']
+        scans = []
+        nodes = [plan]
+        while nodes:
+            node = nodes.pop()
+            if node['Node Type'] == 'Seq Scan' and node['Relation Name'] in self.LARGE_TABLES:
+                scans.append(node['Relation Name'])
+            nodes.extend(node.get('Plans', []))
+        return scans
+
+    def assertNoSequentialScans(self, path, params=None):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(path, params, **auth_header(self.user))
+        self.assertEqual(response.status_code, 200, response.content)
+        queries = [query['sql'] for query in ctx.captured_queries if query['sql'].lstrip().upper().startswith(('SELECT', 'WITH'))]
+        self.assertTrue(queries, path)
+        for sql in queries:
+            self.assertEqual(self.sequential_scans(sql), [], f'{path}: {sql}')
+
+    def test_posts(self):
+        self.assertNoSequentialScans('/posts/list_posts/', {'cursor': ''})
+        self.assertNoSequentialScans('/posts/list_posts/', {'flag': 'following', 'cursor': ''})
+        self.assertNoSequentialScans('/posts/list_posts_by_tag/', {'tag': self.hashtag.hashtag_text})
+        self.assertNoSequentialScans(f'/hashtags/get_posts_by_hashtag_id/{self.hashtag.id}/')
+        self.assertNoSequentialScans('/posts/full_text_search/', {'query': 'quokka'})
+        self.assertNoSequentialScans('/posts/list_posts_nearby/', {'lat': 42.3505, 'lng': -71.1054, 'radius': 0.5})
+        self.assertNoSequentialScans('/posts/map_clusters/', {'bbox': '-71.11,42.345,-71.10,42.355', 'zoom': 16})
+
+    def test_comments(self):
+        self.assertNoSequentialScans(f'/posts/{self.post.id}/comments/', {'cursor': ''})
+        self.assertNoSequentialScans(f'/posts/comments/{self.comment.id}/replies/', {'cursor': ''})
+        self.assertNoSequentialScans(f'/posts/comments/authors/{self.author.id}/', {'cursor': ''})
+        post_ids = Post.objects.order_by('-create_time').values_list('id', flat=True)[:10]
+        self.assertNoSequentialScans('/posts/comments/previews/', {'postIds': ','.join(map(str, post_ids)), 'limit': 2})
+
+    def test_follows(self):
+        self.assertNoSequentialScans(f'/users/{self.author.id}/followers/', {'cursor': ''})
+        self.assertNoSequentialScans(f'/users/{self.user.id}/following/', {'cursor': ''})
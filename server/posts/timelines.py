@@ -0,0 +1,94 @@
+from django.conf import settings
+from django.db.models import F
+
+from users.authentication import invalidate_cached_user
+from users.models import User, UserFollowRel
+from terrierconnect.pagination import UnionAll
+from .hydration import aload_posts, load_posts
+from .models import Post, TimelineEntry
+
+FANOUT_BATCH_SIZE = 1000
+
+
+# Helper function to copy posts into the timelines of some followers
+def _insert_entries(owner_ids, posts):
+    entries = (TimelineEntry(owner_id=owner_id, post_id=post.id, author_id=post.author_id, create_time=post.create_time)
+               for owner_id in owner_ids for post in posts)
+    TimelineEntry.objects.bulk_create(entries, batch_size=FANOUT_BATCH_SIZE, ignore_conflicts=True)
+
+
+def fan_out_post(post):
+    """
+    Adds a new post to the timeline of every follower of its author (fan-out-on-write).
+    - Authors with more than FEED_FANOUT_MAX_FOLLOWERS followers are flagged fanout_on_read instead,
+      and their posts are merged into the feed when it is read (see get_feed_sources).
+    """
+    author = post.author
+    if not author.fanout_on_read:
+        follower_ids = list(UserFollowRel.objects.filter(following_id=author.id).values_list('follower_id', flat=True))
+        if len(follower_ids) <= settings.FEED_FANOUT_MAX_FOLLOWERS:
+            _insert_entries(follower_ids, [post])
+            return
+        User.objects.filter(id=author.id).update(fanout_on_read=True)
+        invalidate_cached_user(author.id)  # update() doesn't send post_save
+        author.fanout_on_read = True
+
+
+def backfill_timeline(follower, following):
+    """Copies the most recent posts of a newly followed user into the follower's timeline."""
+    if following.fanout_on_read:
+        return
+    posts = Post.objects.filter(author_id=following.id).order_by('-create_time')[:settings.FEED_BACKFILL_POSTS]
+    _insert_entries([follower.id], posts.only('id', 'author_id', 'create_time'))
+
+
+def remove_from_timeline(follower, following):
+    """Removes the posts of an unfollowed user from the follower's timeline."""
+    TimelineEntry.objects.filter(owner_id=follower.id, author_id=following.id).delete()
+
+
+def rebuild_timeline(user):
+    """Rebuilds a user's timeline from scratch from the users they follow (used to backfill existing data)."""
+    TimelineEntry.objects.filter(owner_id=user.id).delete()
+    for rel in UserFollowRel.objects.filter(follower_id=user.id).select_related('following'):
+        backfill_timeline(user, rel.following)
+
+
+def get_feed_sources(user):
+    """
+    Returns the sources of a user's following feed, to be paged by paginate() with keyset ('-create_time', '-post_id').
+    - Materialized timeline entries, read with the (owner, -create_time, -post) index.
+    - Posts of followed fanout_on_read authors, read directly from Post (fan-out-on-read).
+    Each source yields dicts with 'create_time' and 'post_id'.
+    """
+    return _feed_sources(user, list(_fanout_on_read_ids(user)))
+
+
+async def aget_feed_sources(user):
+    """Same as get_feed_sources, with the async ORM."""
+    return _feed_sources(user, [user_id async for user_id in _fanout_on_read_ids(user)])
+
+
+def _fanout_on_read_ids(user):
+    return UserFollowRel.objects.filter(follower_id=user.id, following__fanout_on_read=True).values_list('following_id', flat=True)
+
+
+def _feed_sources(user, fanout_on_read_ids):
+    timeline = TimelineEntry.objects.filter(owner_id=user.id)
+    if not fanout_on_read_ids:
+        return UnionAll([timeline.values('create_time', 'post_id')])
+
+    # Entries written before an author was flagged are skipped here, their posts come from the second source
+    timeline = timeline.exclude(author_id__in=fanout_on_read_ids)
+    pulled_posts = Post.objects.filter(author_id__in=fanout_on_read_ids).annotate(post_id=F('id'))
+    return UnionAll([timeline.values('create_time', 'post_id'), pulled_posts.values('create_time', 'post_id')])
+
+
+def load_feed_posts(rows):
+    """Loads the posts of a page of feed rows (dicts with 'post_id'), keeping the feed order."""
+    return load_posts([row['post_id'] for row in rows])
+
+
+async def aload_feed_posts(rows):
+    """Same as load_feed_posts, with the async ORM."""
+    return await aload_posts([row['post_id'] for row in rows])
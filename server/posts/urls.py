@@ -1,18 +1,26 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import async_views, views
+
+# Read endpoints have async versions for ASGI deployments (see ASYNC_READ_VIEWS in settings.py)
+read_views = async_views if settings.ASYNC_READ_VIEWS else views
 
 urlpatterns = [
     path('add_post/', views.add_post, name='add_post'),
-    path('get_post_detail/<int:post_id>/', views.get_post_detail, name='get_post_detail'),
+    path('get_post_detail/<int:post_id>/', read_views.get_post_detail, name='get_post_detail'),
     path('update_post/<int:post_id>/', views.update_post, name='update_post'),
     path('delete_post/<int:post_id>/', views.delete_post, name='delete_post'),
-    path('list_posts/', views.list_posts, name='list_posts'),
+    path('list_posts/', read_views.list_posts, name='list_posts'),
     path('list_posts_by_tag/', views.list_posts_by_tag, name='list_posts_by_tag'),  
-    path('full_text_search/', views.full_text_search, name='full_text_search'),
+    path('list_posts_nearby/', views.list_posts_nearby, name='list_posts_nearby'),
+    path('map_clusters/', views.map_clusters, name='map_clusters'),
+    path('full_text_search/', read_views.full_text_search, name='full_text_search'),
+    path('search_cache_stats/', views.search_cache_stats, name='search_cache_stats'),
     path('comments/create/', views.create_comment, name='create_comment'),
     path('comments/update/<int:comment_id>/', views.update_comment, name='update_comment'),
     path('comments/delete/<int:comment_id>/', views.delete_comment, name='delete_comment'),
-    path('<int:post_id>/comments/', views.list_comments, name='list_comments'),
+    path('<int:post_id>/comments/', read_views.list_comments, name='list_comments'),
+    path('comments/<int:comment_id>/replies/', views.list_replies, name='list_replies'),
+    path('comments/previews/', views.list_comment_previews, name='list_comment_previews'),
     path('comments/authors/<int:author_id>/', views.list_comments_by_author, name='list_comments_by_author'),
-    path('list_posts/', views.list_posts, name='list_posts'),
 ]
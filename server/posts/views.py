@@ -1,4 +1,5 @@
 from django.conf import settings
+from django.db import transaction
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from rest_framework import status
@@ -6,39 +7,41 @@ from .models import Post
 from .models import Comment
 from users.models import User, UserFollowRel  # Import the User model
 from .serializers import PostSerializer, CommentSerializer, CommentCreateSerializer
-import jwt
-from hashtags.views import add_post_hashtags_rel
-from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
-from django.db.models.signals import post_save
-from django.dispatch import receiver
-from django.contrib.postgres.search import SearchVector
-from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
+from .hydration import hydrate_post, hydrate_posts, load_posts
+from .timelines import fan_out_post, get_feed_sources, load_feed_posts
+from .comment_tree import build_comment_previews, build_comment_tree
+from .counters import adjust_counter
+from images.pipeline import schedule_variants
+from .search import search_posts
+from .geo import bbox_filter, distance_km, parse_bbox, radius_bbox
+from .map_clusters import MAX_ZOOM, get_clusters
+from .search_cache import get_cached_results, set_cached_results, normalize_query, get_stats as get_search_cache_stats
+from hashtags.views import add_post_hashtags_rel, update_post_hashtags_rel
+from hashtags.resolve import normalize_hashtag_text, remove_hashtags_from_post
+from terrierconnect.pagination import paginate, PaginationError
 from hashtags.models import PostHashtagRel
 from hashtags.models import Hashtag
+from users.authentication import authenticate_request
 from users.decorators import jwt_required
+from terrierconnect.db.routing import use_primary
+from terrierconnect.response_cache import cached_response
 import json
 from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework.decorators import parser_classes
 
-# Helper function to decode JWT token
-def decode_jwt_token(token):
-    try:
-        return jwt.decode(token, settings.SECRET_KEY, algorithms=['HS256'])
-    except jwt.ExpiredSignatureError:
-        raise ValueError('Token has expired')
-    except jwt.InvalidTokenError:
-        raise ValueError('Invalid token')
-
-# Helper function to get user information from the request
+# Helper function to get user information (the JWT token payload) from the request
 def get_user_info(request):
-    token = request.headers.get('Authorization', '').split(' ')[-1]
-    return decode_jwt_token(token)
+    return authenticate_request(request)[1]
+
+# Helper function to get the authenticated User from the request, without querying the database
+def get_current_user(request):
+    return authenticate_request(request)[0]
 
 @api_view(['POST'])
 @parser_classes([MultiPartParser, FormParser])  # Allow handling multipart/form-data
 def add_post(request):
     try:
-        user_info = get_user_info(request)  # Decodes JWT token to get user info
+        author = get_current_user(request)  # Authenticated user of the JWT token
     except ValueError as e:
         return Response({'error': str(e)}, status=status.HTTP_401_UNAUTHORIZED)
 
@@ -50,22 +53,25 @@ def add_post(request):
     except json.JSONDecodeError:
         return Response({'error': 'Invalid JSON format for hashtags'}, status=status.HTTP_400_BAD_REQUEST)
 
-    # Retrieve the user instance based on the decoded JWT token ID
-    try:
-        author = User.objects.get(id=user_info['id'])
-    except User.DoesNotExist:
-        return Response({'error': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
-
     serializer = PostSerializer(data=request.data, context={'author': author})
     if serializer.is_valid():
-        # Save the post with the author's instance
-        serializer.save()
+        # Save the post with the author's instance, and count it
+        with transaction.atomic():
+            serializer.save()
+            adjust_counter(User.objects.filter(id=author.id), 'posts_count', 1)
+        # Resize the uploaded image after the response
+        schedule_variants(serializer.instance, 'image_url', 'image_variants')
         # Add post-hashtags relationship
         add_post_hashtags_rel(serializer.instance, hashtags)
+        # Push the post into the followers' timelines
+        fan_out_post(serializer.instance)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+# Pinned to the primary: followers open new posts from their feed right after they are created
+@use_primary
+@cached_response('post:{post_id}', authenticated=True, cache_body=True)
 @api_view(['GET'])
 def get_post_detail(request, post_id):
     try:
@@ -74,47 +80,31 @@ def get_post_detail(request, post_id):
         return Response({'error': str(e)}, status=status.HTTP_401_UNAUTHORIZED)
 
     try:
-        post = Post.objects.get(pk=post_id)
+        post = Post.objects.select_related('author').get(pk=post_id)
     except Post.DoesNotExist:
         return Response({'error': 'Post not found'}, status=status.HTTP_404_NOT_FOUND)
 
-    # Serialize the post
-    post_serializer = PostSerializer(post)
-
-    # Retrieve hashtags related to the post
-    post_hashtag_rels = PostHashtagRel.objects.filter(post_id=post)
-    hashtags = [rel.hashtag_id for rel in post_hashtag_rels]
-    
-    # Serialize the hashtags
-    hashtags_data = [hashtag.hashtag_text for hashtag in hashtags]
-
-    # Combine post details with hashtags
-    response_data = post_serializer.data
-    response_data['hashtags'] = hashtags_data
+    # Serialize the post together with its author and hashtags
+    response_data = hydrate_post(post)
 
     return Response(response_data, status=status.HTTP_200_OK)
 
 @api_view(['PUT'])
 def update_post(request, post_id):
     try:
-        user_info = get_user_info(request)
+        author = get_current_user(request)
     except ValueError as e:
         return Response({'error': str(e)}, status=status.HTTP_401_UNAUTHORIZED)
 
     
-    try:
-        author = User.objects.get(id=user_info['id'])
-    except User.DoesNotExist:
-        return Response({'error': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
-
-    
     try:
         post = Post.objects.get(pk=post_id, author_id=author.id)
     except Post.DoesNotExist:
         return Response({'error': 'Post not found or not authorized'}, status=status.HTTP_404_NOT_FOUND)
 
     
-    data = request.data.copy()
+    # Not copy(): that would deep-copy the uploaded files. JSON bodies (editpost.js) are parsed into a plain dict
+    data = request.data.dict() if hasattr(request.data, 'dict') else dict(request.data)
 
     # Check for an uploaded image
     image = request.FILES.get('image_url')
@@ -135,10 +125,11 @@ def update_post(request, post_id):
     serializer = PostSerializer(post, data=data, partial=True)  # `partial=True` allows partial updates
     if serializer.is_valid():
         serializer.save()
+        if image:
+            schedule_variants(serializer.instance, 'image_url', 'image_variants')  # Resize the new image after the response
 
         
-        PostHashtagRel.objects.filter(post_id=post).delete()  # Remove existing hashtags
-        add_post_hashtags_rel(serializer.instance, hashtags)  # Add new hashtags
+        update_post_hashtags_rel(serializer.instance, hashtags)  # Only apply the hashtags that changed
 
         return Response(serializer.data, status=status.HTTP_200_OK)
     
@@ -156,7 +147,10 @@ def delete_post(request, post_id):  # Changed `pk` to `post_id`
     except Post.DoesNotExist:
         return Response({'error': 'Post not found or not authorized'}, status=status.HTTP_404_NOT_FOUND)
 
-    post.delete()
+    with transaction.atomic():
+        remove_hashtags_from_post(post)  # Keep the hashtag use counts up to date
+        post.delete()  # Also removes the post from every timeline (TimelineEntry cascades)
+        adjust_counter(User.objects.filter(id=post.author_id), 'posts_count', -1)
     return Response({'message': 'Post deleted successfully'}, status=status.HTTP_204_NO_CONTENT)
 
 
@@ -166,116 +160,73 @@ def list_posts(request):
         # Get the flag parameter
         flag = request.query_params.get('flag', 'all')  # Default to 'all'
 
-        # Get pagination parameters
-        page = request.query_params.get('page', 1)  # Default to page 1
-        page_size = request.query_params.get('pageSize', 10)  # Default page size is 10
-
         # Get user info for 'following' flag
-        user_info = None
+        user = None
         if flag == 'following':
             try:
-                user_info = get_user_info(request)
+                user = get_current_user(request)
             except ValueError as e:
                 return Response({'error': str(e)}, status=status.HTTP_401_UNAUTHORIZED)
 
-        # Retrieve posts based on the flag
-        if flag == 'following' and user_info:
-            # Get the current user
-            user = User.objects.get(id=user_info['id'])
-            # Get the list of users the current user follows
-            followed_users = UserFollowRel.objects.filter(follower=user).values_list('following_id', flat=True)
-            # Filter posts by followed users
-            posts = Post.objects.filter(author_id__in=followed_users).order_by('-create_time')
-        else:
-            # Retrieve all posts
-            posts = Post.objects.all().order_by('-create_time')
-
-        # Paginate the posts
-        paginator = Paginator(posts, page_size)
+        # Retrieve and paginate posts based on the flag (pass cursor= to page on (create_time, id) instead of page numbers)
         try:
-            paginated_posts = paginator.page(page)
-        except PageNotAnInteger:
-            return Response({'error': 'Invalid page number.'}, status=status.HTTP_400_BAD_REQUEST)
-        except EmptyPage:
-            return Response({'error': 'Page out of range.'}, status=status.HTTP_404_NOT_FOUND)
-
-        # Serialize the paginated posts
-        posts_data = []
-        for post in paginated_posts:
-            post_serializer = PostSerializer(post)
-
-            # Retrieve hashtags related to the post
-            post_hashtag_rels = PostHashtagRel.objects.filter(post_id=post)
-            hashtags = [rel.hashtag_id.hashtag_text for rel in post_hashtag_rels]
-
-            # Add hashtags to the post data
-            post_data = post_serializer.data
-            post_data['hashtags'] = hashtags
-
-            posts_data.append(post_data)
+            if flag == 'following' and user:
+                # Read the precomputed timeline of the current user
+                feed_rows, pagination = paginate(request, get_feed_sources(user), keyset=('-create_time', '-post_id'))
+                paginated_posts = load_feed_posts(feed_rows)
+            else:
+                # Retrieve all posts
+                posts = Post.objects.all().select_related('author').order_by('-create_time')
+                paginated_posts, pagination = paginate(request, posts, keyset=('-create_time', '-id'))
+        except PaginationError as e:
+            return Response({'error': str(e)}, status=e.status_code)
+
+        # Serialize the paginated posts with their authors and hashtags in a fixed number of queries
+        posts_data = hydrate_posts(paginated_posts)
 
         # Return the response with pagination info
-        return Response({
-            'page': page,
-            'pageSize': page_size,
-            'totalItems': paginator.count,
-            'totalPages': paginator.num_pages,
-            'results': posts_data
-        }, status=status.HTTP_200_OK)
+        return Response({**pagination, 'results': posts_data}, status=status.HTTP_200_OK)
 
     except Exception as e:
         return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-@receiver(post_save, sender=Post)
-def update_search_vector(sender, instance, **kwargs):
-    # Avoid recursion by using a custom attribute
-    if not hasattr(instance, '_updating_search_vector'):
-        instance._updating_search_vector = True  # Set the flag
-        instance.search_vector = SearchVector('content')  # Update the search vector
-        instance.save()
-        del instance._updating_search_vector  # Remove the flag to allow future saves
-
 @api_view(['GET'])
 def full_text_search(request):
-    query = request.query_params.get('query', '')
-    page = request.query_params.get('page', 1)  # Default to page 1
-    page_size = request.query_params.get('pageSize', 10)  # Default to 10 items per page
+    query = normalize_query(request.query_params.get('query', ''))
     order_by = request.query_params.get('orderBy', '-create_time')
 
     if not query:
         return Response({'error': 'No query parameter provided'}, status=400)
+
+    # Serve the ids of the page from the search cache when possible (see posts/search_cache.py)
+    page = request.query_params.get('page', 1)
+    page_size = request.query_params.get('pageSize', 10)
+    cached, cache_key = get_cached_results(query, order_by, page, page_size)
+    if cached is not None:
+        return Response({**cached['pagination'], 'results': hydrate_posts(load_posts(cached['ids']))})
     
-    search_query = SearchQuery(query)
-    search_vector = SearchVector('content')  # Specify the fields to search
-    posts = Post.objects.annotate(
-        rank=SearchRank(search_vector, search_query)  # Rank results by relevance
-    ).filter(search_vector=search_query).order_by('-rank', order_by)  # Order by rank
+    # The search vector is kept up to date by a database trigger, see posts/search.py
+    posts = search_posts(query, order_by).select_related('author')
 
     # Pagination
-    paginator = Paginator(posts, page_size)
     try:
-        paginated_posts = paginator.page(page)
-    except PageNotAnInteger:
-        return Response({'error': 'Invalid page number'}, status=400)
-    except EmptyPage:
-        return Response({'error': 'Page out of range'}, status=400)
-    
-    serializer = PostSerializer(paginated_posts, many=True)
+        paginated_posts, pagination = paginate(request, posts, empty_page_status=status.HTTP_400_BAD_REQUEST)
+    except PaginationError as e:
+        return Response({'error': str(e)}, status=e.status_code)
 
-    return Response({
-        'page': page,
-        'pageSize': page_size,
-        'totalItems': paginator.count,
-        'totalPages': paginator.num_pages,
-        'results': serializer.data
-    })
+    set_cached_results(cache_key, [post.id for post in paginated_posts], pagination)
+    return Response({**pagination, 'results': hydrate_posts(paginated_posts)})
+
+@jwt_required
+@api_view(['GET'])
+def search_cache_stats(request):
+    # Hit/miss counters of the full_text_search cache, to size SEARCH_CACHE_MAX_ENTRIES and SEARCH_CACHE_TIMEOUT
+    return Response(get_search_cache_stats())
 
 @api_view(['GET'])
 def list_posts_by_tag(request):
     # Get the query parameters
-    tag = request.query_params.get('tag', None)
-    page = request.query_params.get('page', 1)  # Default page is 1
-    page_size = request.query_params.get('pageSize', 10)  # Default page size is 10
+    tag = normalize_hashtag_text(request.query_params.get('tag', None))
 
     if not tag:
         return Response({'error': 'Tag parameter is required.'}, status=status.HTTP_400_BAD_REQUEST)
@@ -286,30 +237,92 @@ def list_posts_by_tag(request):
     except Hashtag.DoesNotExist:
         return Response({'error': f'Hashtag "{tag}" not found.'}, status=status.HTTP_404_NOT_FOUND)
 
-    # Retrieve posts related to the hashtag
-    post_relations = PostHashtagRel.objects.filter(hashtag_id=hashtag)
-    posts = [relation.post_id for relation in post_relations]  # Extract posts from relationships
+    # Retrieve posts related to the hashtag in a single query
+    posts = Post.objects.filter(posthashtagrel__hashtag_id=hashtag).select_related('author').order_by('posthashtagrel__id')
 
-    # Paginate the posts
-    paginator = Paginator(posts, page_size)
+    # Paginate the posts: the hashtag's use_count saves a COUNT(*) joining every post of a popular hashtag
     try:
-        paginated_posts = paginator.page(page)
-    except PageNotAnInteger:
-        return Response({'error': 'Invalid page number.'}, status=status.HTTP_400_BAD_REQUEST)
-    except EmptyPage:
-        return Response({'error': 'Page out of range.'}, status=status.HTTP_404_NOT_FOUND)
-
-    # Serialize the paginated posts
-    serializer = PostSerializer(paginated_posts, many=True)
+        paginated_posts, pagination = paginate(request, posts, total=hashtag.use_count)
+    except PaginationError as e:
+        return Response({'error': str(e)}, status=e.status_code)
 
     # Return the response with pagination info
-    return Response({
-        'page': page,
-        'pageSize': page_size,
-        'totalItems': paginator.count,
-        'totalPages': paginator.num_pages,
-        'results': serializer.data
-    }, status=status.HTTP_200_OK)
+    return Response({**pagination, 'results': hydrate_posts(paginated_posts)}, status=status.HTTP_200_OK)
+
+# Helper function to read the area of list_posts_nearby from the query parameters
+def get_nearby_area(request):
+    """
+    Returns a tuple (center (lat, lng) or None, bounding box (min_lat, min_lng, max_lat, max_lng), radius in km or None).
+    Raises ValueError for missing or invalid parameters.
+    """
+    params = request.query_params
+    try:
+        if params.get('bbox'):
+            min_lat, min_lng, max_lat, max_lng = parse_bbox(params['bbox'])
+            return ((min_lat + max_lat) / 2, (min_lng + max_lng) / 2), (min_lat, min_lng, max_lat, max_lng), None
+        lat, lng = float(params['lat']), float(params.get('lng', params.get('lon')))
+        radius = float(params.get('radius', settings.NEARBY_DEFAULT_RADIUS_KM))
+    except (KeyError, TypeError, ValueError):
+        raise ValueError('Provide lat, lng and an optional radius (km), or bbox=minLng,minLat,maxLng,maxLat.')
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        raise ValueError('Invalid coordinates.')
+    if not 0 < radius <= settings.NEARBY_MAX_RADIUS_KM:
+        raise ValueError(f'The radius must be between 0 and {settings.NEARBY_MAX_RADIUS_KM} km.')
+    return (lat, lng), radius_bbox(lat, lng, radius), radius
+
+@api_view(['GET'])
+def list_posts_nearby(request):
+    """
+    Lists the posts located within a radius of a point (lat, lng, radius in km) or in a bounding box (bbox).
+    - orderBy=distance (default): closest first, from the point or the center of the box, with page/pageSize.
+    - orderBy=-create_time: most recent first, also with cursor= (keyset on (create_time, id)).
+    Each post has a distance_km.
+    """
+    try:
+        center, bbox, radius = get_nearby_area(request)
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    order_by = request.query_params.get('orderBy', 'distance')
+    if order_by not in ('distance', '-create_time'):
+        return Response({'error': 'Invalid orderBy.'}, status=status.HTTP_400_BAD_REQUEST)
+
+    # Index scans of the geohash cells covering the box, then exact coordinates (see posts/geo.py)
+    posts = Post.objects.filter(bbox_filter(*bbox)).annotate(distance_km=distance_km(*center)).select_related('author')
+    if radius is not None:
+        posts = posts.filter(distance_km__lte=radius)
+
+    try:
+        if order_by == 'distance':
+            paginated_posts, pagination = paginate(request, posts.order_by('distance_km', 'id'))
+        else:
+            paginated_posts, pagination = paginate(request, posts.order_by('-create_time', '-id'), keyset=('-create_time', '-id'))
+    except PaginationError as e:
+        return Response({'error': str(e)}, status=e.status_code)
+
+    results = hydrate_posts(paginated_posts)
+    for post, post_data in zip(paginated_posts, results):
+        post_data['distance_km'] = round(post.distance_km, 3)
+    return Response({**pagination, 'results': results})
+
+@api_view(['GET'])
+def map_clusters(request):
+    """
+    Returns the clusters of located posts to draw on a map viewport: bbox=minLng,minLat,maxLng,maxLat and the map's zoom.
+    - Each cluster has its count, its centroid and the ids of its most recent posts (see posts/map_clusters.py).
+    """
+    try:
+        bbox = parse_bbox(request.query_params.get('bbox', ''))
+        zoom = int(request.query_params.get('zoom', ''))
+    except ValueError:
+        return Response({'error': 'Provide bbox=minLng,minLat,maxLng,maxLat and zoom.'}, status=status.HTTP_400_BAD_REQUEST)
+    if not 0 <= zoom <= MAX_ZOOM:
+        return Response({'error': f'The zoom must be between 0 and {MAX_ZOOM}.'}, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        clusters = get_clusters(*bbox, zoom)
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    return Response({'zoom': zoom, 'clusters': clusters})
 
 @api_view(['POST'])
 def create_comment(request):
@@ -322,7 +335,9 @@ def create_comment(request):
 
     serializer = CommentCreateSerializer(data=request.data)
     if serializer.is_valid():
-        serializer.save()
+        with transaction.atomic():
+            serializer.save()
+            adjust_counter(Post.objects.filter(id=serializer.instance.post_id), 'comments_count', 1)
         return Response(serializer.data, status=201)
     return Response(serializer.errors, status=400)
 
@@ -357,60 +372,126 @@ def delete_comment(request, comment_id):
     except Comment.DoesNotExist:
         return Response({'error': 'Comment not found or not authorized'}, status=status.HTTP_404_NOT_FOUND)
 
-    comment.delete()
+    with transaction.atomic():
+        # Replies are deleted with the comment (CASCADE): uncount all of them
+        _, deleted = comment.delete()
+        adjust_counter(Post.objects.filter(id=comment.post_id), 'comments_count', -deleted.get(Comment._meta.label, 0))
     return Response({'message': 'Comment deleted successfully'}, status=status.HTTP_204_NO_CONTENT)
 
+# Helper function to read the comment tree limits from the query parameters
+def get_comment_tree_limits(request):
+    limits = []
+    for name in ('maxDepth', 'maxReplies'):
+        value = request.GET.get(name)  # GET: also works with the plain requests of async views
+        if value is None:
+            limits.append(None)
+            continue
+        try:
+            value = int(value)
+        except ValueError:
+            raise ValueError(f'Invalid {name}.')
+        if value < 0:
+            raise ValueError(f'Invalid {name}.')
+        limits.append(value)
+    return limits
+
+# Keysets of the comment orderings that cursor= can page, by orderBy
+COMMENT_KEYSETS = {
+    'create_time': ('create_time', 'id'),
+    '-create_time': ('-create_time', '-id'),
+}
+
+# Helper function to read the keyset of a comment list from orderBy
+def get_comment_keyset(request, order_by):
+    """
+    Returns the keyset paging the comments in the order of orderBy, or None for the orders only pages can serve.
+    Raises PaginationError when cursor= is combined with such an order, instead of silently ignoring orderBy.
+    """
+    keyset = COMMENT_KEYSETS.get(order_by)
+    if keyset is None and 'cursor' in request.GET:  # GET: also works with the plain requests of async views
+        raise PaginationError(f'cursor can only be used with orderBy {" or ".join(COMMENT_KEYSETS)}.')
+    return keyset
+
+@cached_response('comments:{post_id}', cache_body=True)
 @api_view(['GET'])
 def list_comments(request, post_id):
-    page = request.query_params.get('page', 1)  # Default to page 1
-    page_size = request.query_params.get('pageSize', 10)  # Default to 10 items per page
     order_by = request.query_params.get('orderBy', 'create_time')
+    try:
+        max_depth, max_replies = get_comment_tree_limits(request)
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
     
     # Fetch top-level comments for the specified post
-    comments = Comment.objects.filter(post_id=post_id, parent__isnull=True).select_related('author', 'post').prefetch_related('replies').order_by(order_by)
+    comments = Comment.objects.filter(post_id=post_id, parent__isnull=True).select_related('author').order_by(order_by)
     
-    # Pagination
-    paginator = Paginator(comments, page_size)
+    # Pagination (pass cursor= to page on (create_time, id), in the direction given by orderBy)
     try:
-        paginated_posts = paginator.page(page)
-    except PageNotAnInteger:
-        return Response({'error': 'Invalid page number'}, status=400)
-    except EmptyPage:
-        return Response({'error': 'Page out of range'}, status=400)
-    
-    serializer = CommentSerializer(comments, many=True)
+        keyset = get_comment_keyset(request, order_by)
+        paginated_comments, pagination = paginate(request, comments, keyset=keyset, empty_page_status=status.HTTP_400_BAD_REQUEST)
+    except PaginationError as e:
+        return Response({'error': str(e)}, status=e.status_code)
 
-    return Response({
-        'page': page,
-        'pageSize': page_size,
-        'totalItems': paginator.count,
-        'totalPages': paginator.num_pages,
-        'results': serializer.data
-    })
+    # Serialize the page of threads, loading all their replies with one query
+    results = build_comment_tree(paginated_comments, max_depth, max_replies)
+
+    return Response({**pagination, 'results': results})
+
+@api_view(['GET'])
+def list_replies(request, comment_id):
+    """
+    Lists the replies of a comment, with their own nested replies.
+    - Used to load more replies of a comment truncated by maxDepth/maxReplies: pass its repliesCursor as cursor=.
+    """
+    try:
+        max_depth, max_replies = get_comment_tree_limits(request)
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    order_by = request.query_params.get('orderBy', 'create_time')
+    try:
+        keyset = get_comment_keyset(request, order_by)
+    except PaginationError as e:
+        return Response({'error': str(e)}, status=e.status_code)
+    replies = Comment.objects.filter(parent_id=comment_id).select_related('author').order_by(*(keyset or (order_by,)))
+
+    try:
+        paginated_replies, pagination = paginate(request, replies, keyset=keyset, empty_page_status=status.HTTP_400_BAD_REQUEST)
+    except PaginationError as e:
+        return Response({'error': str(e)}, status=e.status_code)
+
+    return Response({**pagination, 'results': build_comment_tree(paginated_replies, max_depth, max_replies)})
+
+@api_view(['GET'])
+def list_comment_previews(request):
+    """
+    Returns the number of comments and the latest top-level comments of a page of posts, for the feed cards.
+    - postIds: comma-separated ids (at most COMMENT_PREVIEWS_MAX_POSTS), results come in the same order.
+    - limit: number of latest comments per post (default 1, at most COMMENT_PREVIEWS_MAX_LIMIT).
+    """
+    try:
+        post_ids = list(dict.fromkeys(int(post_id) for post_id in request.query_params.get('postIds', '').split(',') if post_id.strip()))
+        limit = int(request.query_params.get('limit', 1))
+    except ValueError:
+        return Response({'error': 'postIds must be comma-separated post ids and limit a number.'}, status=status.HTTP_400_BAD_REQUEST)
+    if not 0 < len(post_ids) <= settings.COMMENT_PREVIEWS_MAX_POSTS:
+        return Response({'error': f'Provide between 1 and {settings.COMMENT_PREVIEWS_MAX_POSTS} postIds.'}, status=status.HTTP_400_BAD_REQUEST)
+    if not 0 <= limit <= settings.COMMENT_PREVIEWS_MAX_LIMIT:
+        return Response({'error': f'The limit must be between 0 and {settings.COMMENT_PREVIEWS_MAX_LIMIT}.'}, status=status.HTTP_400_BAD_REQUEST)
+
+    previews = build_comment_previews(post_ids, limit)
+    return Response({'results': [previews[post_id] for post_id in post_ids if post_id in previews]})
 
 @api_view(['GET'])
 def list_comments_by_author(request, author_id):
-    page = request.query_params.get('page', 1)  # Default to page 1
-    page_size = request.query_params.get('pageSize', 10)  # Default to 10 items per page
     order_by = request.query_params.get('orderBy', '-create_time')
-    comments = Comment.objects.filter(author_id=author_id).order_by(order_by)
+    comments = Comment.objects.filter(author_id=author_id).select_related('author').order_by(order_by)
 
-    # Pagination
-    paginator = Paginator(comments, page_size)
+    # Pagination (pass cursor= to page on (create_time, id), in the direction given by orderBy)
     try:
-        paginated_posts = paginator.page(page)
-    except PageNotAnInteger:
-        return Response({'error': 'Invalid page number'}, status=400)
-    except EmptyPage:
-        return Response({'error': 'Page out of range'}, status=400)
-
-    serializer = CommentSerializer(comments, many=True)
-
-    return Response({
-        'page': page,
-        'pageSize': page_size,
-        'totalItems': paginator.count,
-        'totalPages': paginator.num_pages,
-        'results': serializer.data
-    })
+        keyset = get_comment_keyset(request, order_by)
+        paginated_comments, pagination = paginate(request, comments, keyset=keyset, empty_page_status=status.HTTP_400_BAD_REQUEST)
+    except PaginationError as e:
+        return Response({'error': str(e)}, status=e.status_code)
+
+    return Response({**pagination, 'results': build_comment_tree(paginated_comments)})
 
@@ -0,0 +1,51 @@
+from django.db.backends.postgresql import base, creation
+from django.db import DEFAULT_DB_ALIAS
+from django.db.backends.base.base import NO_DB_ALIAS
+
+from terrierconnect.metrics import record_query
+from .pool import close_pool, get_pool
+
+# PostgreSQL backend whose connections come from a per-process pool (see pool.py), configured by the 'POOL' entry
+# of the database settings: closing the connection of a request (at its end, with CONN_MAX_AGE = 0) releases it to
+# the pool instead of closing it, so requests don't pay for a new TCP connection and authentication.
+# Without a 'POOL' entry (or with a MAX_SIZE of 0), it behaves exactly like django.db.backends.postgresql.
+
+
+class DatabaseCreation(creation.DatabaseCreation):
+    def _destroy_test_db(self, test_database_name, verbosity):
+        # Pooled connections to the test database would prevent dropping it
+        close_pool(self.connection.alias)
+        super()._destroy_test_db(test_database_name, verbosity)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    creation_class = DatabaseCreation
+
+    def __init__(self, settings_dict, alias=DEFAULT_DB_ALIAS):
+        super().__init__(settings_dict, alias)
+        options = settings_dict.get('POOL') or {}
+        # Maintenance connections (creating and dropping the test database) are never pooled
+        self.pool_options = {name.lower(): value for name, value in options.items()} if alias != NO_DB_ALIAS else {}
+        # Queries are counted for the request metrics on every connection, whichever thread uses it
+        self.execute_wrappers.append(record_query)
+
+    @property
+    def pool(self):
+        return get_pool(self.alias, self.get_connection_params(), self.pool_options) if self.pool_options.get('max_size') else None
+
+    def get_new_connection(self, conn_params):
+        pool = self.pool
+        if pool is None:
+            return super().get_new_connection(conn_params)
+        return pool.acquire(lambda: super(DatabaseWrapper, self).get_new_connection(conn_params))
+
+    def _close(self):
+        pool = self.pool
+        if pool is None:
+            return super()._close()
+        with self.wrap_database_errors:
+            if self.in_atomic_block:
+                # Closed inside a transaction, the connection object stays referenced by this wrapper: never reuse it
+                pool.discard(self.connection)
+            else:
+                pool.release(self.connection)
@@ -0,0 +1,196 @@
+import threading
+import time
+from collections import deque
+
+import psycopg2
+from psycopg2 import extensions
+
+
+class PoolTimeout(psycopg2.OperationalError):
+    """No connection was released in time. Raised as django.db.OperationalError by the database wrapper."""
+
+
+class ConnectionPool:
+    """
+    Bounded, thread-safe pool of open database connections, shared by the threads of one process.
+    - acquire() hands out the most recently released idle connection, opens a new one while fewer than max_size are
+      open, or else waits up to `timeout` seconds for a release.
+    - Idle connections are checked before being handed out: closed ones, and the ones older than max_lifetime or idle
+      for more than max_idle seconds, are discarded; the ones idle for more than check_after seconds are pinged.
+    - release() rolls back whatever transaction the connection was left in, and puts it back in autocommit mode.
+    """
+
+    def __init__(self, max_size=10, timeout=5.0, max_idle=300.0, max_lifetime=3600.0, check_after=30.0):
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.max_lifetime = max_lifetime
+        self.check_after = check_after
+        self._available = threading.Condition()
+        self._idle = deque()  # (connection, release time), the most recently released last
+        self._created_at = {}  # connection -> creation time, for all open connections
+        self._size = 0  # Open connections, idle or in use, plus the ones being opened
+        self._closed = False
+        self.counters = {'acquired': 0, 'created': 0, 'discarded': 0, 'waits': 0, 'wait_seconds': 0.0, 'timeouts': 0, 'failed_checks': 0}
+
+    def acquire(self, connect):
+        """
+        Returns an open connection, calling connect() to open a new one if needed.
+        Raises:
+        - PoolTimeout if max_size connections stay in use for `timeout` seconds.
+        """
+        while True:
+            connection, released_at = self._take()
+            if connection is None:
+                break
+            if self._is_usable(connection, released_at):
+                return connection
+            self.discard(connection)
+
+        try:
+            connection = connect()
+        except Exception:
+            with self._available:
+                self._size -= 1
+                self._available.notify()
+            raise
+        with self._available:
+            self._created_at[connection] = time.monotonic()
+            self.counters['created'] += 1
+        return connection
+
+    def _take(self):
+        # Reserves an idle connection, or a slot for a new one (returned as None)
+        started = time.monotonic()
+        waited = False
+        with self._available:
+            while not self._idle and self._size >= self.max_size:
+                if not waited:
+                    waited = True
+                    self.counters['waits'] += 1
+                remaining = started + self.timeout - time.monotonic()
+                if remaining <= 0:
+                    self.counters['timeouts'] += 1
+                    raise PoolTimeout(f'No database connection available after {self.timeout}s ({self.max_size} in use)')
+                self._available.wait(remaining)
+            if waited:
+                self.counters['wait_seconds'] += time.monotonic() - started
+            self.counters['acquired'] += 1
+            if self._idle:
+                return self._idle.pop()
+            self._size += 1
+            return None, None
+
+    def _is_usable(self, connection, released_at):
+        now = time.monotonic()
+        if connection.closed or now - released_at > self.max_idle or now - self._created_at[connection] > self.max_lifetime:
+            return False
+        if now - released_at > self.check_after:
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT 1')
+            except psycopg2.Error:
+                self.counters['failed_checks'] += 1
+                return False
+        return True
+
+    def release(self, connection):
+        """Puts a connection back in the pool, or closes it if it is broken, too old, or the pool was closed."""
+        try:
+            if not connection.closed:
+                if connection.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                    connection.rollback()
+                connection.autocommit = True
+        except psycopg2.Error:
+            pass
+
+        now = time.monotonic()
+        expired = []
+        with self._available:
+            if self._closed or connection.closed or now - self._created_at.get(connection, now) > self.max_lifetime \
+                    or connection.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                expired.append(connection)
+            else:
+                self._idle.append((connection, now))
+            # The least recently released connections come first: close the ones that have been idle for too long
+            while self._idle and now - self._idle[0][1] > self.max_idle:
+                expired.append(self._idle.popleft()[0])
+            self._forget(expired)
+        self._close_connections(expired)
+
+    def discard(self, connection):
+        """Closes a connection taken from the pool instead of releasing it."""
+        with self._available:
+            self._forget([connection])
+        self._close_connections([connection])
+
+    def _forget(self, connections):
+        # Called with the lock held
+        for connection in connections:
+            self._created_at.pop(connection, None)
+        self._size -= len(connections)
+        self.counters['discarded'] += len(connections)
+        self._available.notify(len(connections) or 1)
+
+    def _close_connections(self, connections):
+        for connection in connections:
+            try:
+                connection.close()
+            except psycopg2.Error:
+                pass
+
+    def close(self):
+        """Closes the idle connections; the ones in use are closed when they are released."""
+        with self._available:
+            self._closed = True
+            idle = [connection for connection, _ in self._idle]
+            self._idle.clear()
+            self._forget(idle)
+        self._close_connections(idle)
+
+    def stats(self):
+        with self._available:
+            return {
+                'max_size': self.max_size,
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._size - len(self._idle),
+                **self.counters,
+            }
+
+
+_pools = {}  # Database alias -> (connection parameters, ConnectionPool)
+_pools_lock = threading.Lock()
+
+
+def get_pool(alias, conn_params, options):
+    """
+    Returns the pool of a database alias, creating it on first use.
+    The pool is replaced (and the old one closed) when the connection parameters change, e.g. when the test runner
+    switches the alias to the test database.
+    """
+    key = sorted((name, str(value)) for name, value in conn_params.items())
+    with _pools_lock:
+        params, pool = _pools.get(alias, (None, None))
+        if params == key:
+            return pool
+        old_pool = pool
+        pool = ConnectionPool(**options)
+        _pools[alias] = (key, pool)
+    if old_pool is not None:
+        old_pool.close()
+    return pool
+
+
+def close_pool(alias):
+    with _pools_lock:
+        _, pool = _pools.pop(alias, (None, None))
+    if pool is not None:
+        pool.close()
+
+
+def get_stats():
+    """Returns the stats of the pools of this process, by database alias."""
+    with _pools_lock:
+        pools = {alias: pool for alias, (_, pool) in _pools.items()}
+    return {alias: pool.stats() for alias, pool in pools.items()}
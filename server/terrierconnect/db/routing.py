@@ -0,0 +1,123 @@
+import contextvars
+import random
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS
+
+from users.authentication import get_token_user_id
+
+# Reads of safe requests (GET, HEAD, OPTIONS) go to one of the replicas of DB_REPLICAS, everything else to the primary.
+# - ReplicaRoutingMiddleware picks the replica of a request (a single one, so its reads are consistent with each
+#   other), unless the view is pinned with @use_primary or the user wrote recently (read-your-writes).
+# - The first write of a request switches its later reads to the primary.
+# - Outside of requests (management commands, background threads) everything goes to the primary.
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+class RoutingState:
+    def __init__(self, replica=None):
+        self.replica = replica  # Alias the reads go to, None for the primary
+        self.wrote = False
+
+
+_state = contextvars.ContextVar('db_routing_state', default=None)
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        return state.replica if state is not None and state.replica else DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.replica = None
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True  # Replicas hold the same data as the primary
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+def use_primary(view):
+    """Pins a view to the primary database, e.g. one that must see rows written an instant ago by someone else."""
+    view.use_primary = True
+    return view
+
+
+@contextmanager
+def read_from_primary():
+    """Sends the reads of a block of code to the primary database."""
+    token = _state.set(RoutingState())
+    try:
+        yield
+    finally:
+        _state.reset(token)
+
+
+def _sticky_key(user_id):
+    return f'db:primary:{user_id}'
+
+
+def stick_to_primary(user_id):
+    """Sends the reads of a user to the primary for DB_READ_YOUR_WRITES_SECONDS, until the replicas caught up."""
+    caches[settings.DB_ROUTING_CACHE_ALIAS].set(_sticky_key(user_id), True, settings.DB_READ_YOUR_WRITES_SECONDS)
+
+
+def is_sticky(user_id):
+    return user_id is not None and caches[settings.DB_ROUTING_CACHE_ALIAS].get(_sticky_key(user_id)) is not None
+
+
+class ReplicaRoutingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        state, token = self.start(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            _state.reset(token)
+        self.finish(request, state)
+        return response
+
+    async def __acall__(self, request):
+        state, token = self.start(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _state.reset(token)
+        self.finish(request, state)
+        return response
+
+    def start(self, request):
+        request.token_user_id = get_token_user_id(request) if settings.DB_REPLICAS else None
+        replica = None
+        if settings.DB_REPLICAS and request.method in SAFE_METHODS and not is_sticky(request.token_user_id):
+            replica = random.choice(settings.DB_REPLICAS)
+        state = RoutingState(replica)
+        return state, _state.set(state)
+
+    def finish(self, request, state):
+        if request.token_user_id is not None and settings.DB_REPLICAS and (state.wrote or request.method not in SAFE_METHODS):
+            stick_to_primary(request.token_user_id)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        state = _state.get()
+        if state is not None and getattr(view_func, 'use_primary', False):
+            state.replica = None
@@ -0,0 +1,244 @@
+import bisect
+import contextvars
+import logging
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from importlib import import_module
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from .db.pool import get_stats as get_db_pool_stats
+
+logger = logging.getLogger(__name__)
+
+# Per-request instrumentation, exposed in the Prometheus text format by the /metrics view (terrierconnect/views.py).
+# - MetricsMiddleware records, for each URL name of METRICS_URLCONFS (other routes are grouped as 'other'), the
+#   request duration, the number of queries and the time spent in the database (through record_query, installed on
+#   every connection by terrierconnect/db/base.py), the time spent serializing and the response size.
+# - Serialization time covers the rendering of DRF responses (timed by the middleware), and the code that views run
+#   within timed_serialization(), such as the serialization of post pages (see posts/hydration.py).
+# - Queries of the same shape (the SQL with literals and IN lists collapsed) repeated N_PLUS_ONE_THRESHOLD times or
+#   more in one request are logged as a likely N+1 and counted.
+# Metrics live in the memory of each process: with several workers, each scrape sees the worker that answers it.
+
+SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+class Histogram:
+    """Cumulative histogram with one series per label value, as exposed by Prometheus."""
+
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self._series = {}  # label value -> [count per bucket (+Inf last), sum]
+        self._lock = threading.Lock()
+
+    def observe(self, label, value):
+        with self._lock:
+            series = self._series.setdefault(label, [[0] * (len(self.buckets) + 1), 0])
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+
+    def render(self, label_name):
+        with self._lock:
+            series = sorted(self._series.items())
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        for label, (counts, total) in series:
+            cumulative = 0
+            for bound, count in zip([*self.buckets, '+Inf'], counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{label_name}="{label}",le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{label_name}="{label}"}} {total}')
+            lines.append(f'{self.name}_count{{{label_name}="{label}"}} {cumulative}')
+        return lines
+
+
+class LabeledCounter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self._values = Counter()
+        self._lock = threading.Lock()
+
+    def inc(self, labels, amount=1):
+        with self._lock:
+            self._values[labels] += amount
+
+    def render(self, label_names):
+        with self._lock:
+            values = sorted(self._values.items())
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        for labels, value in values:
+            label_text = ','.join(f'{name}="{label}"' for name, label in zip(label_names, labels))
+            lines.append(f'{self.name}{{{label_text}}} {value}')
+        return lines
+
+
+REQUEST_SECONDS = Histogram('terrierconnect_request_duration_seconds', 'Time spent handling the request.', SECONDS_BUCKETS)
+QUERIES = Histogram('terrierconnect_request_queries', 'Number of SQL queries run by the request.', QUERY_BUCKETS)
+DB_SECONDS = Histogram('terrierconnect_request_db_seconds', 'Time spent in SQL queries.', SECONDS_BUCKETS)
+SERIALIZER_SECONDS = Histogram('terrierconnect_request_serializer_seconds', 'Time spent serializing and rendering the response.', SECONDS_BUCKETS)
+RESPONSE_BYTES = Histogram('terrierconnect_response_size_bytes', 'Size of the response body.', SIZE_BUCKETS)
+HISTOGRAMS = [REQUEST_SECONDS, QUERIES, DB_SECONDS, SERIALIZER_SECONDS, RESPONSE_BYTES]
+REQUESTS = LabeledCounter('terrierconnect_requests_total', 'Requests handled, by response status.')
+N_PLUS_ONE = LabeledCounter('terrierconnect_n_plus_one_total', 'Requests that repeated a query shape N_PLUS_ONE_THRESHOLD times or more.')
+
+
+class RequestRecord:
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.serializer_seconds = 0.0
+        self.serializing = False  # Nested timed_serialization() blocks are timed as part of the outermost one
+        self.shapes = Counter()
+
+
+_record = contextvars.ContextVar('metrics_request_record', default=None)
+
+LITERAL_RE = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+IN_LIST_RE = re.compile(r'\((?:\s*(?:%s|\?)\s*,)+\s*(?:%s|\?)\s*\)')
+
+
+def query_shape(sql):
+    """SQL with its literals replaced by '?' and IN lists collapsed, so queries differing only by values match."""
+    return IN_LIST_RE.sub('(...)', LITERAL_RE.sub('?', sql))
+
+
+def record_query(execute, sql, params, many, context):
+    """
+    Execute wrapper counting and timing the query for the current request, if any.
+    Installed on each connection by terrierconnect/db/base.py rather than by the middleware: under ASGI, the ORM runs in
+    sync_to_async threads, on other connections than the event loop's, but with the request's context.
+    """
+    record = _record.get()
+    if record is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        record.queries += 1
+        record.db_seconds += time.perf_counter() - started
+        record.shapes[query_shape(sql)] += 1
+
+
+@contextmanager
+def timed_serialization():
+    """Adds the time spent in the block to the serialization time of the current request, if any."""
+    record = _record.get()
+    if record is None or record.serializing:
+        yield
+        return
+    record.serializing = True
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record.serializing = False
+        record.serializer_seconds += time.perf_counter() - started
+
+
+_url_names = None
+
+
+def get_url_name(request):
+    """URL name of the request's route if it belongs to METRICS_URLCONFS, else 'other' (bounds the label values)."""
+    global _url_names
+    if _url_names is None:
+        _url_names = {pattern.name for urlconf in settings.METRICS_URLCONFS for pattern in import_module(urlconf).urlpatterns if pattern.name}
+    match = getattr(request, 'resolver_match', None)
+    return match.url_name if match is not None and match.url_name in _url_names else 'other'
+
+
+def response_size(response):
+    if response.streaming:
+        return int(response.get('Content-Length', 0))
+    return len(response.content)
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        record = RequestRecord()
+        token = _record.set(record)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _record.reset(token)
+        self.finish(request, response, record, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        record = RequestRecord()
+        token = _record.set(record)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _record.reset(token)
+        self.finish(request, response, record, time.perf_counter() - started)
+        return response
+
+    def process_template_response(self, request, response):
+        # Runs last, just before the handler renders the response (DRF's Response): render it here to time it. The
+        # handler doesn't render it again.
+        with timed_serialization():
+            return response.render()
+
+    def finish(self, request, response, record, seconds):
+        name = get_url_name(request)
+        REQUEST_SECONDS.observe(name, seconds)
+        QUERIES.observe(name, record.queries)
+        DB_SECONDS.observe(name, record.db_seconds)
+        SERIALIZER_SECONDS.observe(name, record.serializer_seconds)
+        RESPONSE_BYTES.observe(name, response_size(response))
+        REQUESTS.inc((name, request.method, str(response.status_code)))
+
+        repeated = [(count, shape) for shape, count in record.shapes.items() if count >= settings.N_PLUS_ONE_THRESHOLD]
+        if repeated:
+            N_PLUS_ONE.inc((name,))
+            for count, shape in sorted(repeated, reverse=True):
+                logger.warning('Possible N+1 in %s (%s %s): query run %d times: %s', name, request.method, request.path, count, shape[:500])
+
+        if settings.METRICS_SERVER_TIMING:
+            # Visible in the browser's developer tools
+            response['Server-Timing'] = (
+                f'db;dur={record.db_seconds * 1000:.1f};desc="{record.queries} queries", '
+                f'serialize;dur={record.serializer_seconds * 1000:.1f}, total;dur={seconds * 1000:.1f}'
+            )
+
+
+def render_metrics():
+    """All metrics of this process in the Prometheus text exposition format."""
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines += histogram.render('view')
+    lines += REQUESTS.render(('view', 'method', 'status'))
+    lines += N_PLUS_ONE.render(('view',))
+
+    pool_stats = get_db_pool_stats()
+    for stat in ('size', 'in_use', 'idle', 'max_size'):
+        lines += [f'# TYPE terrierconnect_db_pool_{stat} gauge']
+        lines += [f'terrierconnect_db_pool_{stat}{{database="{alias}"}} {stats[stat]}' for alias, stats in sorted(pool_stats.items())]
+    for stat in ('acquired', 'waits', 'timeouts', 'failed_checks'):
+        lines += [f'# TYPE terrierconnect_db_pool_{stat}_total counter']
+        lines += [f'terrierconnect_db_pool_{stat}_total{{database="{alias}"}} {stats[stat]}' for alias, stats in sorted(pool_stats.items())]
+    return '\n'.join(lines) + '\n'
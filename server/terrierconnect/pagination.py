@@ -0,0 +1,214 @@
+import base64
+import json
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
+from django.db.models import Q
+from rest_framework import status
+
+
+# Raised by paginate() when the pagination parameters are invalid; views turn it into an error response
+class PaginationError(ValueError):
+    def __init__(self, message, status_code=status.HTTP_400_BAD_REQUEST):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+# Helper function to read a positive integer query parameter
+def _positive_int(value, message):
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise PaginationError(message)
+    if value < 1:
+        raise PaginationError(message)
+    return value
+
+
+# Helper functions to build and read opaque cursors
+def encode_cursor(values, direction):
+    # isoformat() keeps the microseconds that DjangoJSONEncoder would truncate, so ties are not skipped
+    values = [value.isoformat() if hasattr(value, 'isoformat') else value for value in values]
+    payload = json.dumps({'v': values, 'd': direction})
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def decode_cursor(cursor, model, keyset):
+    """
+    Decodes a cursor built by encode_cursor.
+    Returns the keyset values (converted back to python types) and the direction ('next' or 'prev').
+    Raises PaginationError if the cursor is malformed.
+    """
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        values, direction = payload['v'], payload['d']
+        if direction not in ('next', 'prev') or len(values) != len(keyset):
+            raise ValueError
+        fields = [model._meta.get_field(name.lstrip('-')) for name in keyset]
+        return [field.to_python(value) for field, value in zip(fields, values)], direction
+    except (ValueError, KeyError, TypeError, ValidationError, FieldDoesNotExist):
+        raise PaginationError('Invalid cursor.')
+
+
+# Helper function to build the keyset filter "rows strictly after the cursor"
+def _keyset_filter(keyset, values, reverse):
+    """
+    For keyset (a, b) ordered ascending, rows after (va, vb) are: a > va OR (a = va AND b > vb).
+    Descending fields ('-a') flip the comparison, and so does paging backwards (reverse=True).
+    """
+    condition = Q()
+    for i, name in enumerate(keyset):
+        descending = name.startswith('-') != reverse
+        field = name.lstrip('-')
+        step = Q(**{f'{field}__lt' if descending else f'{field}__gt': values[i]})
+        for prev_name, prev_value in zip(keyset[:i], values[:i]):
+            step &= Q(**{prev_name.lstrip('-'): prev_value})
+        condition |= step
+    return condition
+
+
+def _keyset_values(obj, keyset):
+    if isinstance(obj, dict):
+        return [obj[name.lstrip('-')] for name in keyset]
+    return [getattr(obj, name.lstrip('-')) for name in keyset]
+
+
+def _reverse_ordering(keyset):
+    return [name[1:] if name.startswith('-') else f'-{name}' for name in keyset]
+
+
+# A list of querysets selecting the same columns, paged by paginate() as a single UNION ALL
+class UnionAll(list):
+    pass
+
+
+# Helper functions to treat UnionAll sources like a single queryset
+def _filter_sources(items, condition):
+    if isinstance(items, UnionAll):
+        return _union(UnionAll(queryset.filter(condition) for queryset in items))
+    return items.filter(condition)
+
+
+def _union(items):
+    if isinstance(items, UnionAll):
+        return items[0].union(*items[1:], all=True) if len(items) > 1 else items[0]
+    return items
+
+
+def _query_params(request):
+    # DRF requests have query_params, plain Django requests (async views) only GET
+    return getattr(request, 'query_params', request.GET)
+
+
+def paginate(request, items, keyset=None, empty_page_status=status.HTTP_404_NOT_FOUND, total=None):
+    """
+    Shared pagination for the list endpoints.
+    - Offset mode (default): reads 'page' and 'pageSize' and returns page, pageSize, totalItems and totalPages.
+    - Cursor mode: enabled when the request has a 'cursor' parameter (empty for the first page) and the
+      endpoint passes a keyset, e.g. ('-create_time', '-id'). Rows are fetched with a WHERE on the keyset
+      instead of OFFSET, and no COUNT(*) is run unless the client sends includeTotal=true.
+    - items may also be a UnionAll of querysets selecting the same columns (e.g. with values()); they are
+      paged as one UNION ALL, with the keyset condition pushed down into every part.
+    - total: the number of items when the caller already knows it (e.g. a denormalized counter), saving the COUNT(*).
+    Returns a tuple (objects of the page, dict of pagination info to merge into the response).
+    Raises PaginationError for invalid parameters.
+    """
+    params = _query_params(request)
+    raw_page_size = params.get('pageSize', 10)
+    page_size = _positive_int(raw_page_size, 'Invalid page size.')
+
+    if keyset and 'cursor' in params:
+        page_queryset, direction = _cursor_queryset(params, items, keyset)
+        rows, pagination = _cursor_page(list(page_queryset[:page_size + 1]), params, keyset, page_size, direction)
+        if params.get('includeTotal', '').lower() == 'true':
+            pagination['totalItems'] = _union(items).count() if total is None else total
+        return rows, pagination
+
+    page = params.get('page', 1)
+    if isinstance(items, UnionAll):
+        items = _union(items).order_by(*keyset)
+    paginator = Paginator(items, page_size)
+    if total is not None:
+        paginator.count = total  # count is a cached_property: this replaces the COUNT(*)
+    paginated_items = _get_page(paginator, page, empty_page_status)
+
+    return list(paginated_items), _offset_pagination(paginator, page, raw_page_size)
+
+
+async def apaginate(request, items, keyset=None, empty_page_status=status.HTTP_404_NOT_FOUND, total=None):
+    """Same as paginate(), for async views: the COUNT(*) and the page are fetched with the async ORM."""
+    params = _query_params(request)
+    raw_page_size = params.get('pageSize', 10)
+    page_size = _positive_int(raw_page_size, 'Invalid page size.')
+
+    if keyset and 'cursor' in params:
+        page_queryset, direction = _cursor_queryset(params, items, keyset)
+        rows = [row async for row in page_queryset[:page_size + 1]]
+        rows, pagination = _cursor_page(rows, params, keyset, page_size, direction)
+        if params.get('includeTotal', '').lower() == 'true':
+            pagination['totalItems'] = await _union(items).acount() if total is None else total
+        return rows, pagination
+
+    page = params.get('page', 1)
+    if isinstance(items, UnionAll):
+        items = _union(items).order_by(*keyset)
+    # Let a Paginator validate the page number against the count, then fetch the rows of its slice
+    paginator = Paginator(range(await items.acount() if total is None else total), page_size)
+    bounds = _get_page(paginator, page, empty_page_status).object_list
+    rows = [row async for row in items[bounds.start:bounds.stop]]
+
+    return rows, _offset_pagination(paginator, page, raw_page_size)
+
+
+def _get_page(paginator, page, empty_page_status):
+    try:
+        return paginator.page(page)
+    except PageNotAnInteger:
+        raise PaginationError('Invalid page number.')
+    except EmptyPage:
+        raise PaginationError('Page out of range.', empty_page_status)
+
+
+def _offset_pagination(paginator, page, raw_page_size):
+    return {
+        'page': page,
+        'pageSize': raw_page_size,
+        'totalItems': paginator.count,
+        'totalPages': paginator.num_pages,
+    }
+
+
+def _cursor_queryset(params, items, keyset):
+    # Returns the queryset of the rows after (or before) the cursor, and the paging direction
+    cursor = params.get('cursor')
+    if not cursor:
+        return _union(items).order_by(*keyset), 'next'
+    model = items[0].model if isinstance(items, UnionAll) else items.model
+    values, direction = decode_cursor(cursor, model, keyset)
+    reverse = direction == 'prev'
+    page_queryset = _filter_sources(items, _keyset_filter(keyset, values, reverse))
+    return page_queryset.order_by(*(_reverse_ordering(keyset) if reverse else keyset)), direction
+
+
+def _cursor_page(rows, params, keyset, page_size, direction):
+    # rows were fetched with one extra row, to know whether there is another page in this direction
+    cursor = params.get('cursor')
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if direction == 'prev':
+        rows.reverse()
+
+    next_cursor = prev_cursor = None
+    if rows:
+        # Paging forward, there is a next page only if we fetched the extra row; paging backward, always
+        if (direction == 'next' and has_more) or direction == 'prev':
+            next_cursor = encode_cursor(_keyset_values(rows[-1], keyset), 'next')
+        # And the other way round for the previous page (the first page has no previous page)
+        if (direction == 'prev' and has_more) or (direction == 'next' and cursor):
+            prev_cursor = encode_cursor(_keyset_values(rows[0], keyset), 'prev')
+
+    return rows, {
+        'pageSize': page_size,
+        'nextCursor': next_cursor,
+        'prevCursor': prev_cursor,
+    }
@@ -0,0 +1,174 @@
+import functools
+import hashlib
+import json
+import time
+import uuid
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
+
+from users.authentication import aauthenticate_request, authenticate_request
+from .db.routing import read_from_primary
+
+# Conditional GETs and cached bodies for read endpoints, keyed by version tokens of the resources they show.
+# - Each resource ('post:12', 'comments:12', 'user:3', ...) has a version token in the RESPONSE_CACHE_ALIAS cache,
+#   replaced by invalidate() whenever it is written (see posts/cache_invalidation.py for the signal receivers).
+# - The ETag of a response is derived from the tokens of its resources and the URL, so If-None-Match is answered
+#   with a 304 from the cache alone, before the view runs any query or serializer.
+# - With cache_body, the rendered 200 responses are stored too, under their ETag, and served as-is. Only with a cache
+#   shared by all the workers: a per-process cache would keep serving a body written before another worker's write.
+# Tokens remember when their resource was written (0 for the tokens created on a cache miss): for
+# DB_READ_YOUR_WRITES_SECONDS after a write the view reads from the primary, so a lagging replica never gets its old
+# data cached (or sent to the client) under the new token.
+# Tokens expire with the cache TIMEOUT, which bounds how long a per-process cache serves stale responses in the
+# other workers: with several workers, use a shared cache (RESPONSE_CACHE_BACKEND/LOCATION).
+
+EPOCH_KEY = 'response:epoch'
+SAFE_METHODS = ('GET', 'HEAD')
+
+
+def get_cache():
+    return caches[settings.RESPONSE_CACHE_ALIAS]
+
+
+def caches_bodies():
+    """Whether cache_body is honoured: not with a per-process cache, unless RESPONSE_CACHE_LOCAL_BODIES is set."""
+    return settings.RESPONSE_CACHE_LOCAL_BODIES or not isinstance(get_cache(), LocMemCache)
+
+
+def _version_key(resource):
+    return f'response:version:{resource}'
+
+
+def get_versions(resources):
+    """Returns the version tokens (token, write time) of the epoch and of the resources, creating the missing ones."""
+    cache = get_cache()
+    keys = [EPOCH_KEY] + [_version_key(resource) for resource in resources]
+    versions = cache.get_many(keys)
+    missing = [key for key in keys if key not in versions]
+    if missing:
+        for key in missing:
+            cache.add(key, (uuid.uuid4().hex, 0))  # Not a write: the replicas are as good as the primary
+        versions.update(cache.get_many(missing))
+    return [versions.get(key) or (uuid.uuid4().hex, 0) for key in keys]
+
+
+def is_recent(versions):
+    """Whether one of the resources was written within DB_READ_YOUR_WRITES_SECONDS, i.e. replicas may lag behind it."""
+    return any(time.time() - created < settings.DB_READ_YOUR_WRITES_SECONDS for _, created in versions)
+
+
+def _renew(keys):
+    # New tokens, recording the time of the write
+    written = time.time()
+    get_cache().set_many({key: (uuid.uuid4().hex, written) for key in keys})
+
+
+def invalidate(*resources):
+    """
+    Replaces the version tokens of written resources, right away and again when the transaction commits: a response
+    cached from the old rows in between must not outlive the transaction.
+    """
+    keys = [_version_key(resource) for resource in resources]
+    if keys:
+        _renew(keys)
+        transaction.on_commit(lambda: _renew(keys))
+
+
+def invalidate_all():
+    """Drops every cached response, e.g. after rows were changed in bulk, without signals."""
+    _renew([EPOCH_KEY])
+
+
+def _etag(request, versions):
+    digest = hashlib.sha1(json.dumps([
+        [token for token, _ in versions], request.get_full_path(), request.headers.get('Accept', ''),
+    ]).encode()).hexdigest()
+    return f'W/"{digest}"'
+
+
+def _body_key(etag):
+    return f'response:body:{etag}'
+
+
+def _finish(response, etag, authenticated):
+    response['ETag'] = etag
+    # Clients revalidate every time; responses to authenticated requests are for the client's cache only
+    response['Cache-Control'] = 'private, no-cache' if authenticated else 'no-cache'
+    patch_vary_headers(response, ('Accept', 'Authorization'))
+    return response
+
+
+def cached_response(*resources, authenticated=False, cache_body=False):
+    """
+    Adds ETags to the 200 responses of a GET view, and answers If-None-Match with 304 when the resources didn't change.
+    - resources are format strings of the view's URL kwargs, e.g. 'post:{post_id}'.
+    - With authenticated, the request's token is checked first; on failure the view runs and returns its own error.
+    - With cache_body, the rendered response is stored in the cache and served to the other clients (see
+      caches_bodies).
+    Works with sync and async views.
+    """
+    def decorator(view):
+        def lookup(request, kwargs):
+            versions = get_versions([resource.format(**kwargs) for resource in resources])  # Before reading the data
+            etag = _etag(request, versions)
+            if etag in parse_etags(request.headers.get('If-None-Match', '')):
+                return etag, versions, _finish(HttpResponseNotModified(), etag, authenticated)
+            if cache_body and caches_bodies():
+                cached = get_cache().get(_body_key(etag))
+                if cached is not None:
+                    content, content_type = cached
+                    return etag, versions, _finish(HttpResponse(content, content_type=content_type), etag, authenticated)
+            return etag, versions, None
+
+        def store(response, etag):
+            if response.status_code != 200:
+                return response
+            if hasattr(response, 'render'):
+                response.render()  # DRF responses are rendered lazily
+            if cache_body and caches_bodies():
+                get_cache().set(_body_key(etag), (response.content, response['Content-Type']))
+            return _finish(response, etag, authenticated)
+
+        if iscoroutinefunction(view):
+            @functools.wraps(view)
+            async def wrapper(request, *args, **kwargs):
+                if request.method not in SAFE_METHODS:
+                    return await view(request, *args, **kwargs)
+                if authenticated:
+                    try:
+                        await aauthenticate_request(request)
+                    except ValueError:
+                        return await view(request, *args, **kwargs)
+                etag, versions, response = lookup(request, kwargs)
+                if response is not None:
+                    return response
+                if is_recent(versions):
+                    with read_from_primary():
+                        return store(await view(request, *args, **kwargs), etag)
+                return store(await view(request, *args, **kwargs), etag)
+        else:
+            @functools.wraps(view)
+            def wrapper(request, *args, **kwargs):
+                if request.method not in SAFE_METHODS:
+                    return view(request, *args, **kwargs)
+                if authenticated:
+                    try:
+                        authenticate_request(request)
+                    except ValueError:
+                        return view(request, *args, **kwargs)
+                etag, versions, response = lookup(request, kwargs)
+                if response is not None:
+                    return response
+                if is_recent(versions):
+                    with read_from_primary():
+                        return store(view(request, *args, **kwargs), etag)
+                return store(view(request, *args, **kwargs), etag)
+        return wrapper
+    return decorator
@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 
 from pathlib import Path
 import os
+import tempfile
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -61,6 +62,7 @@ INSTALLED_APPS = [
     "hashtags.apps.HashtagsConfig",
     "users.apps.UsersConfig", 
     "posts.apps.PostsConfig",
+    "images.apps.ImagesConfig",
     "rest_framework",
     "rest_framework_simplejwt",
     "corsheaders",
@@ -74,9 +76,11 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "terrierconnect.metrics.MetricsMiddleware",  # First, so that it times the whole request
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "corsheaders.middleware.CorsMiddleware",
+    "terrierconnect.db.routing.ReplicaRoutingMiddleware",
     "django.middleware.common.CommonMiddleware",
     # "django.middleware.csrf.CsrfViewMiddleware", # We don't need this middleware because we are using JWT token for authentication
     "django.contrib.auth.middleware.AuthenticationMiddleware",
@@ -108,18 +112,70 @@ WSGI_APPLICATION = "terrierconnect.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
+# Connections come from a bounded pool per process (see terrierconnect/db/pool.py): the connection of a request is
+# released to the pool when the request ends, and the pool checks idle connections before handing them out again.
+# - DB_POOL_MAX_SIZE: connections per process (gunicorn worker); at least the number of threads of a worker.
+#   0 disables the pool: connections are then kept for DB_CONN_MAX_AGE seconds by each thread instead.
+# - DB_POOL_TIMEOUT: seconds a request waits for a connection when all are in use, before failing.
+# - DB_POOL_MAX_IDLE / DB_POOL_MAX_LIFETIME: idle connections, and connections older than that, are closed.
+# - DB_POOL_CHECK_AFTER: connections idle for longer are pinged (SELECT 1) before being reused.
+# Behind PgBouncer in transaction mode (DB_HOST/DB_PORT pointing at PgBouncer):
+# - set DB_DISABLE_SERVER_SIDE_CURSORS=1: QuerySet.iterator() would otherwise declare cursors that outlive the
+#   transaction PgBouncer assigned the server connection for;
+# - set the time zone of the database role to UTC (ALTER ROLE ... SET timezone TO 'UTC'), so Django doesn't have to
+#   change it with a session-level SET on each new connection;
+# - the pool is still useful, it keeps the connections to PgBouncer open.
+DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', 10))
+
 DATABASES = {
     "default": {
-        'ENGINE': 'django.db.backends.postgresql',
+        'ENGINE': 'terrierconnect.db',
         'NAME': os.getenv('DB_NAME'),
         'USER': os.getenv('DB_USER'),
         'PASSWORD': os.getenv('DB_PASSWORD'),
         'HOST': os.getenv('DB_HOST'),
         'PORT': os.getenv('DB_PORT'),
+        'CONN_MAX_AGE': 0 if DB_POOL_MAX_SIZE else int(os.getenv('DB_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': True,
+        'DISABLE_SERVER_SIDE_CURSORS': os.getenv('DB_DISABLE_SERVER_SIDE_CURSORS', '0') == '1',
+        'POOL': {
+            'MAX_SIZE': DB_POOL_MAX_SIZE,
+            'TIMEOUT': float(os.getenv('DB_POOL_TIMEOUT', 5)),
+            'MAX_IDLE': float(os.getenv('DB_POOL_MAX_IDLE', 300)),
+            'MAX_LIFETIME': float(os.getenv('DB_POOL_MAX_LIFETIME', 3600)),
+            'CHECK_AFTER': float(os.getenv('DB_POOL_CHECK_AFTER', 30)),
+        },
     }
 }
 
 
+# Read replicas (see terrierconnect/db/routing.py): DB_REPLICA_HOSTS lists host[:port] of streaming replicas of the
+# default database, with the same name and credentials. Reads of GET requests are spread over them, except for users
+# who wrote in the last DB_READ_YOUR_WRITES_SECONDS (longer than the usual replication lag), who read from the primary.
+for index, replica_host in enumerate(filter(None, os.getenv('DB_REPLICA_HOSTS', '').split(',')), start=1):
+    replica_host, _, replica_port = replica_host.strip().partition(':')
+    DATABASES[f'replica{index}'] = {
+        **DATABASES['default'],
+        'HOST': replica_host,
+        'PORT': replica_port or DATABASES['default']['PORT'],
+        'TEST': {'MIRROR': 'default'},
+    }
+DB_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+DATABASE_ROUTERS = ['terrierconnect.db.routing.PrimaryReplicaRouter']
+DB_READ_YOUR_WRITES_SECONDS = int(os.getenv('DB_READ_YOUR_WRITES_SECONDS', 5))
+DB_ROUTING_CACHE_ALIAS = 'routing'
+
+
+# Request metrics (see terrierconnect/metrics.py), served by /metrics in the Prometheus text format.
+# - METRICS_TOKEN: /metrics requires the header 'Authorization: Bearer <token>', and isn't served when it is empty.
+# - N_PLUS_ONE_THRESHOLD: number of runs of the same query shape in one request that is reported as an N+1.
+# - METRICS_SERVER_TIMING: add a Server-Timing header (DB and serializer time) to every response.
+METRICS_URLCONFS = ['posts.urls', 'users.urls', 'hashtags.urls']
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+N_PLUS_ONE_THRESHOLD = int(os.getenv('N_PLUS_ONE_THRESHOLD', 5))
+METRICS_SERVER_TIMING = os.getenv('METRICS_SERVER_TIMING', '1' if DEBUG else '0') == '1'
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -140,10 +196,112 @@ AUTH_PASSWORD_VALIDATORS = [
 
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": (
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
+        "users.authentication.JWTAuthentication",
     ),
 }
 
+# Caches
+# The 'search' cache holds full_text_search result ids (see posts/search_cache.py). LocMem is per process and
+# evicts least recently used entries beyond MAX_ENTRIES; point SEARCH_CACHE_BACKEND/SEARCH_CACHE_LOCATION to
+# e.g. django.core.cache.backends.filebased.FileBasedCache and a directory to share it on disk between workers.
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    # Users authenticated by JWT (see users/authentication.py). Saving a user drops it from this cache; revocations
+    # don't depend on it, as the password and is_active are read from the database on every request. With several
+    # workers, a shared cache (AUTH_CACHE_BACKEND/AUTH_CACHE_LOCATION) also keeps their other fields in sync.
+    "auth": {
+        "BACKEND": os.getenv('AUTH_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        "LOCATION": os.getenv('AUTH_CACHE_LOCATION', 'auth-users'),
+    },
+    # Users who wrote recently, whose reads stay on the primary database (see terrierconnect/db/routing.py). Must be
+    # shared by all the workers for read-your-writes to hold across them: on disk by default, which covers the workers
+    # of one host; point DB_ROUTING_CACHE_BACKEND/LOCATION to e.g. Redis with several hosts.
+    "routing": {
+        "BACKEND": os.getenv('DB_ROUTING_CACHE_BACKEND', 'django.core.cache.backends.filebased.FileBasedCache'),
+        "LOCATION": os.getenv('DB_ROUTING_CACHE_LOCATION', os.path.join(tempfile.gettempdir(), 'terrierconnect-db-routing')),
+    },
+    "search": {
+        "BACKEND": os.getenv('SEARCH_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        "LOCATION": os.getenv('SEARCH_CACHE_LOCATION', 'search-results'),
+        "TIMEOUT": int(os.getenv('SEARCH_CACHE_TIMEOUT', 300)),
+        "OPTIONS": {
+            "MAX_ENTRIES": int(os.getenv('SEARCH_CACHE_MAX_ENTRIES', 5000)),
+        },
+    },
+    # Version tokens and bodies of the cached responses (see terrierconnect/response_cache.py). Writes only reach
+    # the other workers through a shared cache (RESPONSE_CACHE_BACKEND/LOCATION); with the per-process default,
+    # their ETags may be answered with a stale 304 for up to RESPONSE_CACHE_TIMEOUT seconds, and bodies aren't
+    # cached unless RESPONSE_CACHE_LOCAL_BODIES is set (single-process deployments).
+    "responses": {
+        "BACKEND": os.getenv('RESPONSE_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        "LOCATION": os.getenv('RESPONSE_CACHE_LOCATION', 'responses'),
+        "TIMEOUT": int(os.getenv('RESPONSE_CACHE_TIMEOUT', 60)),
+        "OPTIONS": {
+            "MAX_ENTRIES": int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', 10000)),
+        },
+    },
+}
+RESPONSE_CACHE_ALIAS = 'responses'
+RESPONSE_CACHE_LOCAL_BODIES = os.getenv('RESPONSE_CACHE_LOCAL_BODIES', '0') == '1'
+SEARCH_CACHE_ALIAS = 'search'
+# Number of distinct queries tracked for invalidation; older ones are only expired by SEARCH_CACHE_TIMEOUT.
+SEARCH_CACHE_MAX_QUERIES = int(os.getenv('SEARCH_CACHE_MAX_QUERIES', 500))
+
+AUTH_CACHE_ALIAS = 'auth'
+# How long an authenticated user is served from the cache, and how many verified tokens each process remembers.
+AUTH_USER_CACHE_SECONDS = int(os.getenv('AUTH_USER_CACHE_SECONDS', 30))
+AUTH_TOKEN_CACHE_SIZE = int(os.getenv('AUTH_TOKEN_CACHE_SIZE', 10000))
+
+# Uploads: stream every uploaded file to a temporary file on disk instead of buffering small ones in memory
+FILE_UPLOAD_HANDLERS = ["django.core.files.uploadhandler.TemporaryFileUploadHandler"]
+
+# Content-addressed storage of uploaded images (see images/storage.py): directory of the blobs under MEDIA_ROOT
+BLOB_STORAGE_DIR = os.getenv('BLOB_STORAGE_DIR', 'blobs')
+
+# Media serving (see images/views.py)
+# How long browsers may cache media files that are not content-addressed (blobs are cached for a year).
+MEDIA_CACHE_SECONDS = int(os.getenv('MEDIA_CACHE_SECONDS', 86400))
+# Set to an internal nginx location (e.g. '/protected-media/') to let nginx send the files, with:
+#   location /protected-media/ { internal; alias /srv/media/; }
+# where /srv/media is MEDIA_ROOT mounted in the nginx container.
+MEDIA_X_ACCEL_REDIRECT_PREFIX = os.getenv('MEDIA_X_ACCEL_REDIRECT_PREFIX', '')
+
+# Image variants (see images/pipeline.py): where they are stored, and how many threads generate them.
+# Set IMAGE_VARIANTS_ASYNC=0 to generate them synchronously when the request's transaction commits.
+IMAGE_VARIANTS_DIR = os.getenv('IMAGE_VARIANTS_DIR', 'variants')
+IMAGE_VARIANTS_WORKERS = int(os.getenv('IMAGE_VARIANTS_WORKERS', 2))
+IMAGE_VARIANTS_ASYNC = os.getenv('IMAGE_VARIANTS_ASYNC', '1') == '1'
+
+# Trending hashtags (see hashtags/trending.py): how long a computed top-K is served from the cache.
+HASHTAG_TRENDING_CACHE_SECONDS = int(os.getenv('HASHTAG_TRENDING_CACHE_SECONDS', 60))
+
+# Following feed (see posts/timelines.py)
+# Authors with more followers than this are not fanned out on write; their posts are merged into the feed on read.
+FEED_FANOUT_MAX_FOLLOWERS = int(os.getenv('FEED_FANOUT_MAX_FOLLOWERS', 1000))
+# Number of recent posts copied into a timeline when following someone.
+FEED_BACKFILL_POSTS = int(os.getenv('FEED_BACKFILL_POSTS', 200))
+
+# Radius of posts/list_posts_nearby/ when none is given, and the largest one accepted, in km.
+NEARBY_DEFAULT_RADIUS_KM = float(os.getenv('NEARBY_DEFAULT_RADIUS_KM', 1))
+NEARBY_MAX_RADIUS_KM = float(os.getenv('NEARBY_MAX_RADIUS_KM', 50))
+
+# posts/comments/previews/: most posts per request (a feed page), and most latest comments per post.
+COMMENT_PREVIEWS_MAX_POSTS = int(os.getenv('COMMENT_PREVIEWS_MAX_POSTS', 100))
+COMMENT_PREVIEWS_MAX_LIMIT = int(os.getenv('COMMENT_PREVIEWS_MAX_LIMIT', 5))
+
+# users/follow_status/: most users per request. users/suggestions/: most suggestions per request, and most followed
+# users whose follows are read (an even sample of them beyond), see users/follow_graph.py.
+FOLLOW_STATUS_MAX_USERS = int(os.getenv('FOLLOW_STATUS_MAX_USERS', 100))
+FOLLOW_SUGGESTIONS_MAX_LIMIT = int(os.getenv('FOLLOW_SUGGESTIONS_MAX_LIMIT', 50))
+FOLLOW_SUGGESTIONS_MAX_SOURCES = int(os.getenv('FOLLOW_SUGGESTIONS_MAX_SOURCES', 500))
+
+# Read endpoints served by async views (posts/async_views.py, users/async_views.py) instead of the DRF ones.
+# Only useful when running under ASGI (gunicorn terrierconnect.asgi:application -k uvicorn.workers.UvicornWorker);
+# under WSGI every async view runs in its own event loop, which is slower than the sync views.
+ASYNC_READ_VIEWS = os.getenv('ASYNC_READ_VIEWS', '0') == '1'
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/5.1/topics/i18n/
@@ -0,0 +1,294 @@
+import threading
+import time
+from unittest import mock
+
+import psycopg2
+from asgiref.sync import async_to_sync, sync_to_async
+from django.db import connection, connections
+from django.core.cache import caches
+from django.db import router
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from psycopg2 import extensions
+from rest_framework.renderers import JSONRenderer
+from rest_framework.serializers import BaseSerializer
+from rest_framework.test import APIClient
+
+from posts.models import Post
+from posts.tests import auth_header
+from users.models import User
+from .db.base import DatabaseWrapper
+from .db.pool import ConnectionPool, PoolTimeout, close_pool
+from .db.routing import ReplicaRoutingMiddleware, read_from_primary, use_primary
+from .metrics import MetricsMiddleware, query_shape
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = 0
+        self.autocommit = True
+        self.in_transaction = False
+        self.broken = False
+
+    def get_transaction_status(self):
+        return extensions.TRANSACTION_STATUS_INTRANS if self.in_transaction else extensions.TRANSACTION_STATUS_IDLE
+
+    def rollback(self):
+        self.in_transaction = False
+
+    def cursor(self):
+        if self.broken:
+            raise psycopg2.OperationalError('server closed the connection unexpectedly')
+        return FakeCursor()
+
+    def close(self):
+        self.closed = 1
+
+
+class FakeCursor:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def execute(self, sql):
+        pass
+
+
+class ConnectionPoolTests(SimpleTestCase):
+    """Tests for the bounded connection pool, with fake connections."""
+
+    def test_connections_are_reused_and_bounded(self):
+        pool = ConnectionPool(max_size=2, timeout=0.05)
+        first = pool.acquire(FakeConnection)
+        second = pool.acquire(FakeConnection)
+        with self.assertRaises(PoolTimeout):
+            pool.acquire(FakeConnection)
+
+        pool.release(first)
+        self.assertIs(pool.acquire(FakeConnection), first)
+        stats = pool.stats()
+        self.assertEqual((stats['size'], stats['in_use'], stats['created']), (2, 2, 2))
+        self.assertEqual((stats['waits'], stats['timeouts']), (1, 1))
+
+    def test_waiting_for_a_release(self):
+        pool = ConnectionPool(max_size=1, timeout=5)
+        first = pool.acquire(FakeConnection)
+        threading.Timer(0.05, pool.release, [first]).start()
+        self.assertIs(pool.acquire(FakeConnection), first)
+        self.assertEqual(pool.stats()['waits'], 1)
+        self.assertGreater(pool.stats()['wait_seconds'], 0)
+
+    def test_release_rolls_back(self):
+        pool = ConnectionPool(max_size=1)
+        first = pool.acquire(FakeConnection)
+        first.in_transaction = True
+        first.autocommit = False
+        pool.release(first)
+        self.assertFalse(first.in_transaction)
+        self.assertTrue(first.autocommit)
+
+    def test_unusable_connections_are_replaced(self):
+        pool = ConnectionPool(max_size=1, check_after=0)
+        first = pool.acquire(FakeConnection)
+        pool.release(first)
+        first.closed = 1
+        second = pool.acquire(FakeConnection)
+        self.assertIsNot(second, first)
+
+        # Connections idle for more than check_after are pinged
+        pool.release(second)
+        time.sleep(0.01)
+        second.broken = True
+        third = pool.acquire(FakeConnection)
+        self.assertIsNot(third, second)
+        self.assertTrue(second.closed)
+        self.assertEqual(pool.stats()['failed_checks'], 1)
+        self.assertEqual(pool.stats()['size'], 1)
+
+
+class PooledDatabaseWrapperTests(TestCase):
+    """Tests for the pooled PostgreSQL backend, on a second connection to the test database."""
+
+    def make_wrapper(self, **settings):
+        return DatabaseWrapper({**connection.settings_dict, **settings}, alias='pool_tests')
+
+    def tearDown(self):
+        close_pool('pool_tests')
+
+    def test_connection_is_released_to_the_pool(self):
+        wrapper = self.make_wrapper()
+        wrapper.ensure_connection()
+        raw_connection = wrapper.connection
+        wrapper.close()
+        self.assertFalse(raw_connection.closed)
+
+        wrapper = self.make_wrapper()
+        with wrapper.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        self.assertIs(wrapper.connection, raw_connection)
+        stats = wrapper.pool.stats()
+        self.assertEqual((stats['created'], stats['acquired'], stats['in_use']), (1, 2, 1))
+        wrapper.close()
+
+    def test_server_side_cursors_can_be_disabled(self):
+        # Named (server-side) cursors don't survive the end of a transaction behind PgBouncer in transaction mode
+        author = User.objects.create(email='cursor@bu.edu', display_name='cursor', password='x')
+        Post.objects.bulk_create([Post(title=f'post {i}', content='content', author=author) for i in range(5)])
+
+        with mock.patch.object(connection, 'chunked_cursor', wraps=connection.chunked_cursor) as chunked_cursor:
+            self.assertEqual(len(list(Post.objects.iterator(chunk_size=2))), 5)
+            self.assertTrue(chunked_cursor.called)
+
+            chunked_cursor.reset_mock()
+            with mock.patch.dict(connection.settings_dict, DISABLE_SERVER_SIDE_CURSORS=True):
+                self.assertEqual(len(list(Post.objects.iterator(chunk_size=2))), 5)
+            self.assertFalse(chunked_cursor.called)
+
+    def test_stats_endpoint(self):
+        user = User.objects.create(email='stats@bu.edu', display_name='stats', password='x')
+        wrapper = self.make_wrapper()
+        wrapper.ensure_connection()
+        response = APIClient().get('/db_pool_stats/', **auth_header(user))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['pool_tests']['in_use'], 1)
+        wrapper.close()
+
+
+@override_settings(DB_REPLICAS=['replica1'])
+class ReplicaRoutingTests(TestCase):
+    """Tests for the primary/replica routing of requests (the aliases are only compared, no query is sent)."""
+
+    def setUp(self):
+        caches['routing'].clear()
+        self.factory = RequestFactory()
+        self.user = User.objects.create(email='writer@bu.edu', display_name='writer', password='x')
+        self.other = User.objects.create(email='reader@bu.edu', display_name='reader', password='x')
+
+    def route(self, method, user=None, view=None, write=False):
+        # Runs a request through the middleware, and returns the database its reads would go to
+        result = {}
+
+        def get_response(request):
+            middleware.process_view(request, view or (lambda request: None), (), {})
+            if write:
+                router.db_for_write(Post)
+            result['db'] = router.db_for_read(Post)
+            return HttpResponse()
+
+        middleware = ReplicaRoutingMiddleware(get_response)
+        headers = auth_header(user) if user else {}
+        middleware(getattr(self.factory, method)('/posts/', **headers))
+        return result['db']
+
+    def test_reads_of_safe_requests_go_to_replicas(self):
+        self.assertEqual(self.route('get'), 'replica1')
+        self.assertEqual(self.route('get', self.user), 'replica1')
+        self.assertEqual(self.route('post', self.user), 'default')
+        self.assertEqual(router.db_for_read(Post), 'default')  # Outside of requests
+
+    def test_read_your_writes(self):
+        self.route('post', self.user)
+        self.assertEqual(self.route('get', self.user), 'default')
+        self.assertEqual(self.route('get', self.other), 'replica1')
+
+        # A GET request that writes also sends its own later reads, and the next requests of its user, to the primary
+        self.assertEqual(self.route('get', self.other, write=True), 'default')
+        self.assertEqual(self.route('get', self.other), 'default')
+
+    def test_pinned_views_and_blocks(self):
+        self.assertEqual(self.route('get', view=use_primary(lambda request: None)), 'default')
+
+        def get_response(request):
+            with read_from_primary():
+                primary = router.db_for_read(Post)
+            return HttpResponse(f'{primary} {router.db_for_read(Post)}')
+
+        response = ReplicaRoutingMiddleware(get_response)(self.factory.get('/posts/'))
+        self.assertEqual(response.content, b'default replica1')
+
+
+class MetricsTests(TestCase):
+    """Tests for the request instrumentation middleware and the /metrics endpoint."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create(email='metrics@bu.edu', display_name='metrics', password='x')
+        Post.objects.bulk_create([Post(title=f'post {i}', content='content', author=self.user) for i in range(3)])
+
+    def metric(self, text, line_start):
+        # Value of the first line of the exposition that starts with line_start
+        return float(next(line for line in text.splitlines() if line.startswith(line_start)).rsplit(' ', 1)[1])
+
+    def get_metrics(self):
+        with override_settings(METRICS_TOKEN='secret'):
+            return self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret')
+
+    def test_metrics_per_url_name(self):
+        count = 'terrierconnect_request_queries_count{view="list_posts"}'
+        before = self.get_metrics().content.decode()
+        before_count = self.metric(before, count) if count in before else 0
+
+        with override_settings(METRICS_SERVER_TIMING=True):
+            response = self.client.get('/posts/list_posts/')
+        self.assertIn('serialize;dur=', response['Server-Timing'])
+
+        response = self.get_metrics()
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        text = response.content.decode()
+        self.assertEqual(self.metric(text, count), before_count + 1)
+        for name in ('request_duration_seconds', 'request_db_seconds', 'request_serializer_seconds', 'response_size_bytes'):
+            self.assertIn(f'terrierconnect_{name}_bucket{{view="list_posts",le="+Inf"}}', text)
+        self.assertIn('terrierconnect_requests_total{view="list_posts",method="GET",status="200"}', text)
+        self.assertGreater(self.metric(text, 'terrierconnect_request_serializer_seconds_sum{view="list_posts"}'), 0)
+        # Timed without patching DRF
+        self.assertEqual(BaseSerializer.data.fget.__module__, 'rest_framework.serializers')
+        self.assertEqual(JSONRenderer.render.__module__, 'rest_framework.renderers')
+
+    def test_rendering_is_timed(self):
+        render = JSONRenderer.render
+
+        def slow_render(renderer, *args, **kwargs):
+            time.sleep(0.05)
+            return render(renderer, *args, **kwargs)
+
+        with mock.patch.object(JSONRenderer, 'render', slow_render), override_settings(METRICS_SERVER_TIMING=True):
+            response = self.client.get('/db_pool_stats/', **auth_header(self.user))
+        self.assertEqual(response.status_code, 200)
+        self.assertGreaterEqual(float(response['Server-Timing'].split('serialize;dur=')[1].split(',')[0]), 50)
+
+    def test_metrics_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 404)  # Not served without a token
+        with override_settings(METRICS_TOKEN='secret'):
+            self.assertEqual(self.client.get('/metrics').status_code, 401)
+            self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret').status_code, 200)
+
+    def test_n_plus_one_detection(self):
+        self.assertEqual(query_shape('SELECT * FROM t WHERE id IN (%s, %s, %s) AND x = 42'), query_shape('SELECT * FROM t WHERE id IN (%s, %s) AND x = 7'))
+
+        def get_response(request):
+            for post in Post.objects.all():
+                User.objects.get(id=post.author_id)  # One query per post
+            return HttpResponse()
+
+        with override_settings(N_PLUS_ONE_THRESHOLD=3), self.assertLogs('terrierconnect.metrics', 'WARNING') as logs:
+            MetricsMiddleware(get_response)(RequestFactory().get('/posts/'))
+        self.assertIn('query run 3 times', logs.output[0])
+
+    def test_async_requests_count_queries(self):
+        def run_queries():
+            # Runs in another thread than the event loop, on that thread's connection, as the ORM does under ASGI
+            try:
+                User.objects.count()
+                User.objects.filter(id=0).exists()
+            finally:
+                connections.close_all()
+
+        async def get_response(request):
+            await sync_to_async(run_queries, thread_sensitive=False)()
+            return HttpResponse()
+
+        with override_settings(METRICS_SERVER_TIMING=True):
+            response = async_to_sync(MetricsMiddleware(get_response))(RequestFactory().get('/posts/'))
+        self.assertIn('desc="2 queries"', response['Server-Timing'])
@@ -15,18 +15,23 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 
+import re
+
 from django.contrib import admin
-from django.urls import include, path
+from django.urls import include, path, re_path
 from django.conf import settings
-from django.conf.urls.static import static
+
+from images.views import serve_media
+from .views import db_pool_stats, metrics
 
 # Include the URLs from the apps' urls.py files
 urlpatterns = [
     path("admin/", admin.site.urls),
     path('hashtags/', include('hashtags.urls')),
     path('users/', include('users.urls')),
-    path('posts/', include('posts.urls'))
+    path('posts/', include('posts.urls')),
+    path('db_pool_stats/', db_pool_stats, name='db_pool_stats'),
+    path('metrics', metrics, name='metrics'),
+    # Uploaded media, also in production (see images/views.py, which can hand files off to nginx)
+    re_path(rf'^{re.escape(settings.MEDIA_URL.lstrip("/"))}(?P<path>.*)$', serve_media),
 ]
-
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.http import Http404, HttpResponse
+from django.utils.crypto import constant_time_compare
+from django.views.decorators.http import require_safe
+from rest_framework.decorators import api_view
+from rest_framework.response import Response
+
+from users.decorators import jwt_required
+from .db.pool import get_stats as get_db_pool_stats
+from .metrics import render_metrics
+
+
+@jwt_required
+@api_view(['GET'])
+def db_pool_stats(request):
+    # Connection pool counters of the worker that answers (in use, waits, timeouts...), to size DB_POOL_MAX_SIZE
+    return Response(get_db_pool_stats())
+
+
+@require_safe
+def metrics(request):
+    # Scraped by Prometheus with a static bearer token: not served unless METRICS_TOKEN is set
+    if not settings.METRICS_TOKEN:
+        raise Http404
+    if not constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {settings.METRICS_TOKEN}'):
+        return HttpResponse(status=401)
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,36 @@
+from django.http import JsonResponse
+from rest_framework import status
+
+from images.pipeline import variant_urls
+from terrierconnect.response_cache import cached_response
+from .authentication import aauthenticate_request
+from .decorators import async_get_view
+from .models import User
+
+# Async version of get_user_info_by_id (see users/views.py), routed instead of it when ASYNC_READ_VIEWS is on.
+
+
+@cached_response('user:{user_id}', authenticated=True, cache_body=True)
+@async_get_view
+async def get_user_info_by_id(request, user_id):
+    try:
+        await aauthenticate_request(request)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=status.HTTP_401_UNAUTHORIZED)
+
+    try:
+        user = await User.objects.aget(id=user_id)
+    except User.DoesNotExist:
+        return JsonResponse({'error': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
+
+    return JsonResponse({'user': {
+        'id': user.id,
+        'email': user.email,
+        'display_name': user.display_name,
+        'bio': user.bio,
+        'avatar_url': user.avatar_url.url if user.avatar_url else None,
+        'avatar_variants': variant_urls(user.avatar_variants),
+        'followers_count': user.followers_count,
+        'following_count': user.following_count,
+        'posts_count': user.posts_count,
+    }})
@@ -0,0 +1,235 @@
+import threading
+import time
+from collections import OrderedDict
+
+import jwt
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.crypto import constant_time_compare, salted_hmac
+from rest_framework.authentication import BaseAuthentication
+
+from images.pipeline import variants_ready
+
+from .models import User
+
+# Every protected request is authenticated once, by authenticate_request(): the result is stored on the request, so
+# jwt_required, get_user_info and the DRF authentication class below all share it.
+# - Tokens whose signature was already verified are kept in a bounded LRU (per process), so jwt.decode only runs
+#   for tokens seen for the first time. Their expiration is still checked on every request.
+# - Users are kept in the 'auth' cache for AUTH_USER_CACHE_SECONDS, and dropped from it whenever they are saved or
+#   deleted, so request.user is available without loading the whole row.
+# - Tokens carry an 'auth_hash' claim derived from the password hash, checked on every request against the password
+#   and is_active read from the database (one lookup by primary key of these two columns): the cached copy may be
+#   stale, as the cache may be per process and update() sends no post_save. Changing the password or deactivating
+#   the user revokes their tokens at once, on every worker.
+
+
+class VerifiedTokenCache:
+    """Thread-safe LRU mapping tokens whose signature has been verified to their decoded payload."""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._tokens = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token):
+        with self._lock:
+            payload = self._tokens.get(token)
+            if payload is not None:
+                self._tokens.move_to_end(token)
+            return payload
+
+    def set(self, token, payload):
+        with self._lock:
+            self._tokens[token] = payload
+            self._tokens.move_to_end(token)
+            while len(self._tokens) > self.max_size:
+                self._tokens.popitem(last=False)
+
+    def discard(self, token):
+        with self._lock:
+            self._tokens.pop(token, None)
+
+    def clear(self):
+        with self._lock:
+            self._tokens.clear()
+
+
+verified_tokens = VerifiedTokenCache(settings.AUTH_TOKEN_CACHE_SIZE)
+
+
+def get_auth_hash(user):
+    """Hash of the user's password hash, embedded in their tokens so a password change revokes them."""
+    return salted_hmac('users.authentication.auth_hash', user.password, algorithm='sha256').hexdigest()
+
+
+def decode_token(token):
+    """
+    Decodes a JWT token, verifying its signature only the first time it is seen.
+    Raises:
+    - ValueError if token is expired or invalid.
+    """
+    payload = verified_tokens.get(token)
+    if payload is None:
+        try:
+            payload = jwt.decode(token, settings.SECRET_KEY, algorithms=['HS256'])
+        except jwt.ExpiredSignatureError:
+            raise ValueError('Token has expired')
+        except jwt.InvalidTokenError:
+            raise ValueError('Invalid token')
+        verified_tokens.set(token, payload)
+    elif 'exp' in payload and payload['exp'] < time.time():
+        verified_tokens.discard(token)
+        raise ValueError('Token has expired')
+    return payload
+
+
+def get_cache():
+    return caches[settings.AUTH_CACHE_ALIAS]
+
+
+def _user_key(user_id):
+    return f'auth:user:{user_id}'
+
+
+def _credentials_query(user_id):
+    return User.objects.filter(id=user_id).values_list('password', 'is_active')
+
+
+def _is_current(user, credentials):
+    # Whether a cached user still has the password and is_active stored in the database
+    return credentials == (user.password, user.is_active)
+
+
+def get_cached_user(user_id):
+    """
+    Returns the user with this id from the cache, loading it on a miss. Returns None if there is no such user.
+    - A cached user whose password or is_active changed in the database is loaded again.
+    """
+    key = _user_key(user_id)
+    user = get_cache().get(key)
+    if user is not None and _is_current(user, _credentials_query(user_id).first()):
+        return user
+    user = User.objects.filter(id=user_id).first()
+    if user is None:
+        get_cache().delete(key)
+    else:
+        get_cache().set(key, user, settings.AUTH_USER_CACHE_SECONDS)
+    return user
+
+
+async def aget_cached_user(user_id):
+    """Same as get_cached_user, with the async ORM."""
+    key = _user_key(user_id)
+    user = get_cache().get(key)
+    if user is not None and _is_current(user, await _credentials_query(user_id).afirst()):
+        return user
+    user = await User.objects.filter(id=user_id).afirst()
+    if user is None:
+        get_cache().delete(key)
+    else:
+        get_cache().set(key, user, settings.AUTH_USER_CACHE_SECONDS)
+    return user
+
+
+def invalidate_cached_user(user_id):
+    get_cache().delete(_user_key(user_id))
+
+
+def _authenticate(token):
+    payload = decode_token(token)
+    return _check_user(get_cached_user(payload.get('id')), payload)
+
+
+async def _aauthenticate(token):
+    payload = decode_token(token)
+    return _check_user(await aget_cached_user(payload.get('id')), payload)
+
+
+def _check_user(user, payload):
+    if user is None:
+        raise ValueError('User not found')
+    if not user.is_active or not constant_time_compare(payload.get('auth_hash', ''), get_auth_hash(user)):
+        raise ValueError('Token has been revoked')
+    return user, payload
+
+
+def get_request_token(request):
+    # Raw token of the Authorization header, with or without a 'Bearer' prefix
+    return request.headers.get('Authorization', '').split(' ')[-1]
+
+
+def get_token_user_id(request):
+    """Returns the user id of the token of a request, without loading the user, or None if the token isn't valid."""
+    try:
+        return decode_token(get_request_token(request)).get('id')
+    except ValueError:
+        return None
+
+
+def authenticate_request(request):
+    """
+    Authenticates the JWT token of the Authorization header (raw, or after a 'Bearer' prefix).
+    - Runs once per request: the outcome is stored on the underlying HttpRequest.
+    Returns a tuple (User, token payload).
+    Raises:
+    - ValueError if the token is missing, expired, invalid or revoked, or if the user doesn't exist anymore.
+    """
+    request = getattr(request, '_request', request)  # DRF's Request wraps the HttpRequest
+    result = getattr(request, '_jwt_auth', None)
+    if result is None:
+        token = get_request_token(request)
+        try:
+            result = _authenticate(token)
+        except ValueError as e:
+            result = e
+        request._jwt_auth = result
+    if isinstance(result, ValueError):
+        raise result
+    return result
+
+
+async def aauthenticate_request(request):
+    """Same as authenticate_request, for async views (the user is loaded with the async ORM)."""
+    result = getattr(request, '_jwt_auth', None)
+    if result is None:
+        token = get_request_token(request)
+        try:
+            result = await _aauthenticate(token)
+        except ValueError as e:
+            result = e
+        request._jwt_auth = result
+    if isinstance(result, ValueError):
+        raise result
+    return result
+
+
+class JWTAuthentication(BaseAuthentication):
+    """
+    DRF authentication class setting request.user and request.auth from the JWT token.
+    Requests without a valid token are left anonymous: views that require one use jwt_required or get_user_info,
+    which return the error message.
+    """
+
+    def authenticate(self, request):
+        if not request.headers.get('Authorization'):
+            return None
+        try:
+            return authenticate_request(request)
+        except ValueError:
+            return None
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user(sender, instance, **kwargs):
+    # Password changes and deactivations must be seen by the next request
+    invalidate_cached_user(instance.pk)
+
+
+@receiver(variants_ready, sender=User)
+def invalidate_user_avatar(sender, pk, **kwargs):
+    # The avatar variants are stored with update(), which doesn't send post_save
+    invalidate_cached_user(pk)
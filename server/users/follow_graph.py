@@ -0,0 +1,114 @@
+import heapq
+import math
+from array import array
+from bisect import bisect_left
+from collections import Counter
+
+from django.conf import settings
+
+from terrierconnect.db.routing import read_from_primary
+from terrierconnect.response_cache import get_cache, get_versions, is_recent
+from .models import UserFollowRel
+
+# Adjacency lists of the follow graph: for each user, the sorted ids of the users it follows ('following') and of its
+# followers ('followers'), packed as arrays of 64-bit integers in the RESPONSE_CACHE_ALIAS cache.
+# - Lists are cached with the version token of their 'following:<id>' / 'followers:<id>' resource (see
+#   terrierconnect/response_cache.py), replaced on every follow and unfollow (see posts/cache_invalidation.py).
+# - The lists missing from the cache are loaded together, with one query on UserFollowRel.
+# - Membership checks for a page of users read the lists once, then answer each user with a set lookup or a binary
+#   search in a sorted list, instead of one query per user.
+
+ID_TYPECODE = 'q'
+
+DIRECTIONS = {
+    # direction: (column of the user, column of its neighbours)
+    'following': ('follower_id', 'following_id'),
+    'followers': ('following_id', 'follower_id'),
+}
+
+
+def _load_lists(direction, user_ids):
+    column, neighbour_column = DIRECTIONS[direction]
+    lists = {user_id: array(ID_TYPECODE) for user_id in user_ids}
+    rows = UserFollowRel.objects.filter(**{f'{column}__in': user_ids}).order_by(column, neighbour_column).values_list(column, neighbour_column)
+    for user_id, neighbour_id in rows.iterator():
+        lists[user_id].append(neighbour_id)
+    return lists
+
+
+def get_lists(direction, user_ids):
+    """Adjacency lists ('following' or 'followers') of users, as a dict of user id -> sorted array of ids."""
+    user_ids = list(dict.fromkeys(user_ids))
+    if not user_ids:
+        return {}
+    resources = [f'{direction}:{user_id}' for user_id in user_ids]
+    versions = get_versions(resources)  # Before reading the follows
+    epoch = versions[0][0]
+    keys = {user_id: f'follow_graph:{resource}:{epoch}:{version[0]}' for user_id, resource, version in zip(user_ids, resources, versions[1:])}
+
+    cache = get_cache()
+    cached = cache.get_many(keys.values())
+    lists = {}
+    for user_id, key in keys.items():
+        if key in cached:
+            lists[user_id] = array(ID_TYPECODE)
+            lists[user_id].frombytes(cached[key])
+    missing = [user_id for user_id in user_ids if user_id not in lists]
+    if missing:
+        if is_recent(versions):
+            with read_from_primary():
+                loaded = _load_lists(direction, missing)
+        else:
+            loaded = _load_lists(direction, missing)
+        cache.set_many({keys[user_id]: ids.tobytes() for user_id, ids in loaded.items()})
+        lists.update(loaded)
+    return lists
+
+
+def get_list(direction, user_id):
+    return get_lists(direction, [user_id])[user_id]
+
+
+def contains(sorted_ids, user_id):
+    index = bisect_left(sorted_ids, user_id)
+    return index < len(sorted_ids) and sorted_ids[index] == user_id
+
+
+def follow_status(user_id, other_ids):
+    """
+    Whether a user follows each of other_ids, and is followed by them.
+    Returns a dict of other id -> {'following': bool, 'followed_by': bool}.
+    """
+    following = set(get_list('following', user_id))
+    # The other users' 'following' lists rather than the user's followers, which may be millions for popular authors
+    their_following = get_lists('following', other_ids)
+    return {
+        other_id: {'following': other_id in following, 'followed_by': contains(their_following[other_id], user_id)}
+        for other_id in their_following
+    }
+
+
+def mutual_follows(user_id):
+    """Sorted ids of the users who follow a user and are followed back."""
+    # As in follow_status, the followed users' 'following' lists rather than the user's followers
+    their_following = get_lists('following', get_list('following', user_id))
+    return sorted(other_id for other_id, ids in their_following.items() if contains(ids, user_id))
+
+
+def follow_suggestions(user_id, limit):
+    """
+    Friends of friends: the users followed by the most users that a user follows, and that it doesn't follow yet.
+    Returns a list of (user id, number of followed users following it), most followed first.
+    """
+    following = get_list('following', user_id)
+    sources = following
+    if len(sources) > settings.FOLLOW_SUGGESTIONS_MAX_SOURCES:
+        # An even sample of the followed users bounds the lists read for users following thousands of others
+        sources = sources[::math.ceil(len(sources) / settings.FOLLOW_SUGGESTIONS_MAX_SOURCES)]
+    overlap = Counter()
+    for ids in get_lists('following', sources).values():
+        overlap.update(ids)
+    excluded = set(following)
+    excluded.add(user_id)
+    candidates = ((candidate_id, count) for candidate_id, count in overlap.items() if candidate_id not in excluded)
+    return heapq.nsmallest(limit, candidates, key=lambda candidate: (-candidate[1], candidate[0]))
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.16 on 2026-10-18 14:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_alter_user_avatar_url'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='fanout_on_read',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,34 @@
+from django.db import migrations
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_of(model, foreign_key):
+    counts = model.objects.filter(**{foreign_key: OuterRef('pk')}).order_by().values(foreign_key).annotate(total=Count('id')).values('total')
+    return Coalesce(Subquery(counts), 0)
+
+
+def delete_duplicate_follows(apps, schema_editor):
+    # Before (follower, following) becomes unique: keep the oldest of the duplicated relationships
+    User = apps.get_model('users', 'User')
+    UserFollowRel = apps.get_model('users', 'UserFollowRel')
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            'DELETE FROM users_userfollowrel AS duplicate USING users_userfollowrel AS kept '
+            'WHERE duplicate.follower_id = kept.follower_id AND duplicate.following_id = kept.following_id AND duplicate.id > kept.id'
+        )
+        deleted = cursor.rowcount
+    if deleted:
+        # The duplicates were counted
+        User.objects.update(followers_count=count_of(UserFollowRel, 'following'), following_count=count_of(UserFollowRel, 'follower'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0006_user_counters'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_duplicate_follows, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # The unique index is built without locking out writes (CREATE INDEX CONCURRENTLY can't run in a transaction),
+    # then turned into the constraint, which only takes a brief lock
+    atomic = False
+
+    dependencies = [
+        ('users', '0007_delete_duplicate_follows'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(
+                    'CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS unique_follow ON users_userfollowrel (follower_id, following_id)',
+                    'DROP INDEX CONCURRENTLY IF EXISTS unique_follow',
+                ),
+                migrations.RunSQL(
+                    'ALTER TABLE users_userfollowrel ADD CONSTRAINT unique_follow UNIQUE USING INDEX unique_follow',
+                    'ALTER TABLE users_userfollowrel DROP CONSTRAINT unique_follow',
+                ),
+            ],
+            state_operations=[
+                migrations.AddConstraint(
+                    model_name='userfollowrel',
+                    constraint=models.UniqueConstraint(fields=('follower', 'following'), name='unique_follow'),
+                ),
+            ],
+        ),
+    ]
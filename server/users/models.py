@@ -2,15 +2,28 @@ from django.db import models
 from django.contrib.auth.hashers import make_password
 from django.utils import timezone
 
+from images.storage import get_blob_storage
+
 class User(models.Model):
     email = models.EmailField(unique=True)
     display_name = models.CharField(max_length=100, blank=True, null=True)
     bio = models.TextField(blank=True, null=True)
-    avatar_url = models.ImageField(upload_to='user_avatars/', blank=True, null=True)
+    avatar_url = models.ImageField(upload_to='user_avatars/', storage=get_blob_storage, blank=True, null=True)  # Stored once per content, see images/storage.py
+    avatar_variants = models.JSONField(blank=True, null=True)  # Resized copies of avatar_url, see images/pipeline.py
     is_active = models.BooleanField(default=True)
     is_staff = models.BooleanField(default=False)
     is_superuser = models.BooleanField(default=False)
+    fanout_on_read = models.BooleanField(default=False)  # Set for authors with too many followers to fan their posts out on write
     password = models.CharField(max_length=128)  # Stores hashed password
+    # Denormalized counters, only changed by atomic UPDATEs (see posts/counters.py): save stale copies (such as the
+    # cached user of a token) with update_fields
+    followers_count = models.PositiveIntegerField(default=0)
+    following_count = models.PositiveIntegerField(default=0)
+    posts_count = models.PositiveIntegerField(default=0)
+
+    # Users loaded from a JWT token are authenticated (see users/authentication.py)
+    is_authenticated = True
+    is_anonymous = False
 
     def set_password(self, raw_password):
         self.password = make_password(raw_password)
@@ -30,3 +43,8 @@ class UserFollowRel(models.Model):
 
     def __str__(self):
         return f"{self.follower.display_name} follows {self.following.display_name}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['follower', 'following'], name='unique_follow'),  # Also serves "does A follow B"
+        ]
@@ -1,3 +1,215 @@
+from unittest import mock
+
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from posts.models import Comment, Post
+from posts.tests import auth_header
+from users import authentication, follow_graph
+from users.follow_graph import follow_status, get_list
+from users.models import User, UserFollowRel
+
+
+class JWTAuthenticationTests(TestCase):
+    """Tests for the shared JWT authentication: verified token LRU, user cache and revocation."""
+
+    def setUp(self):
+        self.client = APIClient()
+        caches['auth'].clear()
+        authentication.verified_tokens.clear()
+        self.user = User.objects.create(email='author@bu.edu', display_name='author')
+        self.user.set_password('Terriers#2024')
+
+    def test_token_is_decoded_once(self):
+        post = Post.objects.create(title='Post', content='content', author=self.user)
+        comment = Comment.objects.create(post=post, author=self.user, content='comment')
+        headers = auth_header(self.user)
+
+        # update_comment is protected by both jwt_required and get_user_info
+        with mock.patch('users.authentication.jwt.decode', wraps=authentication.jwt.decode) as decode:
+            response = self.client.put(f'/posts/comments/update/{comment.id}/', {'post': post.id, 'author': self.user.id, 'content': 'edited'}, format='json', **headers)
+            self.assertEqual(response.status_code, 200, response.content)
+            self.assertEqual(decode.call_count, 1)
+
+            # The signature of a known token isn't verified again, and the user comes from the cache: only its
+            # password and is_active are read
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.get('/users/protected_route', **headers)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(decode.call_count, 1)
+            user_queries = [query['sql'] for query in ctx.captured_queries if 'users_user' in query['sql']]
+            self.assertEqual(len(user_queries), 1)
+            self.assertIn('SELECT "users_user"."password", "users_user"."is_active" FROM', user_queries[0])
+
+    def test_bearer_prefix_is_accepted(self):
+        token = auth_header(self.user)['HTTP_AUTHORIZATION']
+        response = self.client.get('/users/protected_route', HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['user_data']['id'], self.user.id)
+
+    def test_password_change_revokes_tokens(self):
+        headers = auth_header(self.user)
+        self.assertEqual(self.client.get('/users/protected_route', **headers).status_code, 200)
+
+        response = self.client.put('/users/change_password/', {
+            'oldPassword': 'Terriers#2024', 'newPassword': 'Rhett-the-dog#99', 'confirmPassword': 'Rhett-the-dog#99',
+        }, format='json', **headers)
+        self.assertEqual(response.status_code, 200, response.content)
+        new_token = response.data['token']
+
+        response = self.client.get('/users/protected_route', **headers)
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.data['error'], 'Token has been revoked')
+
+        # The token sent back with the response is valid
+        if isinstance(new_token, bytes):
+            new_token = new_token.decode()
+        self.assertEqual(self.client.get('/users/protected_route', HTTP_AUTHORIZATION=new_token).status_code, 200)
+
+    def test_deactivation_revokes_tokens(self):
+        headers = auth_header(self.user)
+        self.assertEqual(self.client.get('/users/protected_route', **headers).status_code, 200)
+
+        self.user.is_active = False
+        self.user.save()
+        response = self.client.get('/users/protected_route', **headers)
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.data['error'], 'Token has been revoked')
+
+    def test_revocations_reach_other_cache_instances(self):
+        headers = auth_header(self.user)
+        worker_a, worker_b = LocMemCache('auth-worker-a', {}), LocMemCache('auth-worker-b', {})
+        with mock.patch('users.authentication.get_cache', return_value=worker_a):
+            self.assertEqual(self.client.get('/users/protected_route', **headers).status_code, 200)  # Cached by a
+
+        # The password is changed on worker b: only its own cache drops the user
+        with mock.patch('users.authentication.get_cache', return_value=worker_b):
+            response = self.client.put('/users/change_password/', {
+                'oldPassword': 'Terriers#2024', 'newPassword': 'Rhett-the-dog#99', 'confirmPassword': 'Rhett-the-dog#99',
+            }, format='json', **headers)
+            self.assertEqual(response.status_code, 200, response.content)
+            new_token = response.data['token']
+            new_headers = {'HTTP_AUTHORIZATION': new_token.decode() if isinstance(new_token, bytes) else new_token}
+        with mock.patch('users.authentication.get_cache', return_value=worker_a):
+            response = self.client.get('/users/protected_route', **headers)
+            self.assertEqual(response.status_code, 401)
+            self.assertEqual(response.data['error'], 'Token has been revoked')
+            self.assertEqual(self.client.get('/users/protected_route', **new_headers).status_code, 200)
+
+            # update() sends no post_save
+            User.objects.filter(id=self.user.id).update(is_active=False)
+            self.assertEqual(self.client.get('/users/protected_route', **new_headers).status_code, 401)
+
+    def test_writes_dont_restore_stale_cached_fields(self):
+        headers = auth_header(self.user)
+        self.assertEqual(self.client.get('/users/protected_route', **headers).status_code, 200)  # Caches the user
+
+        # Changed by another worker: this worker's cached copy still has the old bio
+        User.objects.filter(id=self.user.id).update(bio='edited elsewhere')
+        response = self.client.put('/users/update_profile/', {'display_name': 'renamed'}, **headers)
+        self.assertEqual(response.status_code, 200, response.content)
+        self.user.refresh_from_db()
+        self.assertEqual((self.user.display_name, self.user.bio), ('renamed', 'edited elsewhere'))
+
+        User.objects.filter(id=self.user.id).update(bio='edited again')
+        response = self.client.put('/users/change_password/', {
+            'oldPassword': 'Terriers#2024', 'newPassword': 'Rhett-the-dog#99', 'confirmPassword': 'Rhett-the-dog#99',
+        }, format='json', **auth_header(self.user))
+        self.assertEqual(response.status_code, 200, response.content)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.bio, 'edited again')
+        self.assertTrue(self.user.check_password('Rhett-the-dog#99'))
+
+
+class FollowGraphTests(TestCase):
+    """Tests for the follow graph cache: follow status of a page of users, mutual follows and suggestions."""
+
+    def setUp(self):
+        self.client = APIClient()
+        caches['responses'].clear()
+        self.users = [User.objects.create(email=f'user{i}@bu.edu', display_name=f'user{i}') for i in range(6)]
+
+    def follow(self, follower, following):
+        response = self.client.post(f'/users/{following.id}/follow/', **auth_header(follower))
+        self.assertEqual(response.status_code, 201, response.content)
+
+    def test_lists_are_cached_and_kept_up_to_date(self):
+        a, b, c = self.users[:3]
+        UserFollowRel.objects.bulk_create([UserFollowRel(follower=a, following=c), UserFollowRel(follower=a, following=b)])
+        self.assertEqual(list(get_list('following', a.id)), [b.id, c.id])
+        with self.assertNumQueries(0):
+            self.assertEqual(list(get_list('following', a.id)), [b.id, c.id])
+
+        # Unfollowing and following through the API drop the cached lists of both users
+        self.client.delete(f'/users/{b.id}/unfollow/', **auth_header(a))
+        self.follow(b, a)
+        self.assertEqual(list(get_list('following', a.id)), [c.id])
+        self.assertEqual(list(get_list('followers', a.id)), [b.id])
+
+    def test_follow_status(self):
+        a, b, c, d = self.users[:4]
+        self.follow(a, b)
+        self.follow(a, c)
+        self.follow(c, a)
+        self.follow(d, a)
+        follow_status(a.id, [b.id])  # Caches a's following list
+
+        # One query loads the missing lists of the whole page
+        with self.assertNumQueries(1):
+            statuses = follow_status(a.id, [b.id, c.id, d.id])
+        self.assertEqual(statuses, {
+            b.id: {'following': True, 'followed_by': False},
+            c.id: {'following': True, 'followed_by': True},
+            d.id: {'following': False, 'followed_by': True},
+        })
+
+        response = self.client.get('/users/follow_status/', {'userIds': f'{d.id},{b.id},{d.id}'}, **auth_header(a))
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.data['results'], [
+            {'id': d.id, 'following': False, 'followed_by': True},
+            {'id': b.id, 'following': True, 'followed_by': False},
+        ])
+        self.assertEqual(self.client.get('/users/follow_status/', {'userIds': 'x'}, **auth_header(a)).status_code, 400)
+        self.assertEqual(self.client.get('/users/follow_status/', {'userIds': b.id}).status_code, 401)
+
+    def test_mutual_follows(self):
+        a, b, c, d = self.users[:4]
+        for follower, following in [(a, b), (b, a), (a, c), (d, a), (c, a), (c, d)]:
+            self.follow(follower, following)
+        self.follow(a, d)
+        self.follow(self.users[4], a)  # Not followed back
+
+        # Only 'following' lists are read: the followers of a popular author would be millions of ids
+        with mock.patch('users.follow_graph._load_lists', wraps=follow_graph._load_lists) as load_lists:
+            response = self.client.get(f'/users/{a.id}/mutual_follows/')
+        self.assertEqual({call.args[0] for call in load_lists.call_args_list}, {'following'})
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual([user['id'] for user in response.data['results']], [b.id, c.id, d.id])
+        self.assertEqual(response.data['totalItems'], 3)
+
+        self.client.delete(f'/users/{a.id}/unfollow/', **auth_header(c))
+        response = self.client.get(f'/users/{a.id}/mutual_follows/')
+        self.assertEqual([user['id'] for user in response.data['results']], [b.id, d.id])
+        self.assertEqual(self.client.get('/users/0/mutual_follows/').status_code, 404)
+
+    def test_suggestions_are_ranked_by_overlap(self):
+        a, b, c, d, e, f = self.users
+        for follower, following in [(a, b), (a, c), (b, d), (b, e), (b, a), (c, d), (c, b), (c, f), (e, f), (d, f)]:
+            self.follow(follower, following)
+
+        response = self.client.get('/users/suggestions/', **auth_header(a))
+        self.assertEqual(response.status_code, 200, response.content)
+        # d is followed by b and c; e and f by one of them; a itself and b (already followed) are left out
+        self.assertEqual([(user['id'], user['followed_by_count']) for user in response.data['results']], [(d.id, 2), (e.id, 1), (f.id, 1)])
+
+        response = self.client.get('/users/suggestions/', {'limit': 1}, **auth_header(a))
+        self.assertEqual([user['id'] for user in response.data['results']], [d.id])
 
-# Create your tests here.
+        self.follow(a, d)
+        response = self.client.get('/users/suggestions/', **auth_header(a))
+        self.assertEqual([(user['id'], user['followed_by_count']) for user in response.data['results']], [(f.id, 2), (e.id, 1)])
+        self.assertEqual(self.client.get('/users/suggestions/', {'limit': 0}, **auth_header(a)).status_code, 400)
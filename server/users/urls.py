@@ -1,16 +1,23 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import async_views, views
+
+# See ASYNC_READ_VIEWS in settings.py
+read_views = async_views if settings.ASYNC_READ_VIEWS else views
 
 # Define user-related API endpoints
 urlpatterns = [
     path("register", views.register_user, name="register"),
     path("login", views.login_user, name="login"),
     path("protected_route", views.protected_route, name="protected_route"),
-    path('user/<int:user_id>/', views.get_user_info_by_id, name='get_user_info_by_id'),
+    path('user/<int:user_id>/', read_views.get_user_info_by_id, name='get_user_info_by_id'),
     path('<int:user_id>/follow/', views.follow_user, name='follow_user'),
     path('<int:user_id>/unfollow/', views.unfollow_user, name='unfollow_user'),
     path('<int:user_id>/followers/', views.list_followers, name='list_followers'),
     path('<int:user_id>/following/', views.list_following, name='list_following'),  # Added for listing following users
+    path('<int:user_id>/mutual_follows/', views.list_mutual_follows, name='list_mutual_follows'),
+    path('follow_status/', views.get_follow_status, name='get_follow_status'),
+    path('suggestions/', views.list_follow_suggestions, name='list_follow_suggestions'),
     path('update_profile/', views.update_profile, name='update_profile'),
     path('change_password/', views.change_password, name='change_password'),
 ]
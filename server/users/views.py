@@ -2,9 +2,8 @@ from django.conf import settings
 from django.contrib.auth.hashers import check_password, make_password
 from django.contrib.auth.password_validation import validate_password
 from django.core.exceptions import ValidationError
-from django.core.files.storage import default_storage
-from django.core.paginator import Paginator, PageNotAnInteger, EmptyPage
 from django.core.validators import validate_email
+from django.db import transaction
 
 from rest_framework import status
 from rest_framework.decorators import api_view, parser_classes, permission_classes
@@ -13,7 +12,15 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 
 from .models import User, UserFollowRel
-from posts.views import get_user_info
+from posts.views import get_current_user
+from .authentication import authenticate_request, get_auth_hash
+from .follow_graph import follow_status, follow_suggestions, mutual_follows
+from posts.timelines import backfill_timeline, remove_from_timeline
+from posts.counters import adjust_follow_counters
+from images.pipeline import is_image, schedule_variants, variant_urls
+from images.storage import blob_storage
+from terrierconnect.pagination import paginate, PaginationError
+from terrierconnect.response_cache import cached_response
 
 import jwt
 import datetime
@@ -39,32 +46,19 @@ def generate_jwt_token(user):
     - id: User's ID
     - email: User's email
     - display_name: User's display name
+    - auth_hash: Derived from the password hash, so changing the password revokes the token
     - exp: Token expiration set to 8 hours from creation time
     """
     payload = {
         'id': user.id,
         'email': user.email,
         'display_name': user.display_name,
+        'auth_hash': get_auth_hash(user),
         'exp': datetime.datetime.utcnow() + datetime.timedelta(hours=8)  # Token expires in 8 hours
     }
     return jwt.encode(payload, settings.SECRET_KEY, algorithm='HS256')
 
 
-# Helper function to decode and validate JWT token
-def decode_jwt_token(token):
-    """
-    Decodes a JWT token and handles potential errors.
-    Raises:
-    - ValueError if token is expired or invalid.
-    """
-    try:
-        return jwt.decode(token, settings.SECRET_KEY, algorithms=['HS256'])
-    except jwt.ExpiredSignatureError:
-        raise ValueError('Token has expired')
-    except jwt.InvalidTokenError:
-        raise ValueError('Invalid token')
-
-
 # Register API
 from django.core.exceptions import ValidationError
 from django.core.validators import validate_email
@@ -117,7 +111,9 @@ def register_user(request):
     # Save the uploaded avatar if provided
     avatar_url = 'user_avatars/default_avatar.png'
     if avatar:
-        avatar_path = default_storage.save(f'user_avatars/{avatar.name}', avatar)
+        if not is_image(avatar):
+            return Response({'error': 'Avatar must be an image.'}, status=status.HTTP_400_BAD_REQUEST)
+        avatar_path = blob_storage.save(f'user_avatars/{avatar.name}', avatar)  # Stored once per content
         avatar_url = avatar_path
 
     # Create and save the user
@@ -127,6 +123,8 @@ def register_user(request):
         password=make_password(password),
         avatar_url=avatar_url
     )
+    if avatar:
+        schedule_variants(user, 'avatar_url', 'avatar_variants')  # Resize the avatar after the response
 
     # Respond with success
     return Response({
@@ -167,6 +165,10 @@ def login_user(request):
     if not check_password(password, user.password):
         return Response({'error': 'Invalid credentials.'}, status=status.HTTP_401_UNAUTHORIZED)
 
+    # Deactivated users can't log in (their tokens are rejected anyway, see users/authentication.py)
+    if not user.is_active:
+        return Response({'error': 'Account is deactivated.'}, status=status.HTTP_401_UNAUTHORIZED)
+
     # Generate JWT token for the authenticated user
     token = generate_jwt_token(user)
     return Response({
@@ -175,7 +177,8 @@ def login_user(request):
             'id': user.id, 
             'email': user.email, 
             'display_name': user.display_name,
-            'avatar_url': user.avatar_url.url if user.avatar_url else None
+            'avatar_url': user.avatar_url.url if user.avatar_url else None,
+            'avatar_variants': variant_urls(user.avatar_variants)
             }
     })
 
@@ -189,14 +192,14 @@ def protected_route(request):
     - Decodes and validates the token.
     - Returns access granted message if token is valid, else returns an error.
     """
-    token = request.headers.get('Authorization', '').split(' ')[-1]
     try:
-        user_data = decode_jwt_token(token)
+        _, user_data = authenticate_request(request)
         return Response({'message': 'Access granted', 'user_data': user_data})
     except ValueError as e:
         return Response({'error': str(e)}, status=status.HTTP_401_UNAUTHORIZED)
 
 # Get User Info by ID API
+@cached_response('user:{user_id}', authenticated=True, cache_body=True)
 @api_view(['GET'])
 def get_user_info_by_id(request, user_id):
     """
@@ -205,9 +208,8 @@ def get_user_info_by_id(request, user_id):
     - Fetches user details for the given user_id, excluding sensitive fields.
     """
     # Check if JWT token is provided and valid
-    token = request.headers.get('Authorization', '').split(' ')[-1]
     try:
-        decode_jwt_token(token)  # Only validating if the token is valid, no data needed here
+        authenticate_request(request)  # Only validating if the token is valid, no data needed here
     except ValueError as e:
         return Response({'error': str(e)}, status=status.HTTP_401_UNAUTHORIZED)
 
@@ -219,7 +221,11 @@ def get_user_info_by_id(request, user_id):
             'email': user.email,
             'display_name': user.display_name,
             'bio': user.bio,  # Include other non-sensitive fields if available
-            'avatar_url': user.avatar_url.url if user.avatar_url else None
+            'avatar_url': user.avatar_url.url if user.avatar_url else None,
+            'avatar_variants': variant_urls(user.avatar_variants),
+            'followers_count': user.followers_count,
+            'following_count': user.following_count,
+            'posts_count': user.posts_count,
         }
         return Response({'user': user_info})
     except User.DoesNotExist:
@@ -232,11 +238,10 @@ def follow_user(request, user_id):
     - Authenticated user can follow a user by user_id.
     """
     try:
-        user_info = get_user_info(request)  # Authenticate the request
+        follower = get_current_user(request)  # Authenticate the request
     except ValueError as e:
         return Response({'error': str(e)}, status=status.HTTP_401_UNAUTHORIZED)
 
-    follower = User.objects.get(id=user_info['id'])
     try:
         following = User.objects.get(id=user_id)
     except User.DoesNotExist:
@@ -245,12 +250,19 @@ def follow_user(request, user_id):
     if follower == following:
         return Response({'error': 'Users cannot follow themselves.'}, status=status.HTTP_400_BAD_REQUEST)
 
-    # Check if the relationship already exists
-    if UserFollowRel.objects.filter(follower=follower, following=following).exists():
-        return Response({'error': 'Already following this user.'}, status=status.HTTP_400_BAD_REQUEST)
+    with transaction.atomic():
+        # Lock the follower's row, so that concurrent requests can't both pass the check below and count twice
+        User.objects.select_for_update().filter(id=follower.id).exists()
+
+        # Check if the relationship already exists
+        if UserFollowRel.objects.filter(follower=follower, following=following).exists():
+            return Response({'error': 'Already following this user.'}, status=status.HTTP_400_BAD_REQUEST)
 
-    # Create the follow relationship
-    UserFollowRel.objects.create(follower=follower, following=following)
+        # Create the follow relationship, and count it
+        UserFollowRel.objects.create(follower=follower, following=following)
+        adjust_follow_counters(follower.id, following.id, 1)
+    # Copy the recent posts of the followed user into the follower's timeline
+    backfill_timeline(follower, following)
     return Response({'message': f'{follower.display_name} is now following {following.display_name}.'}, status=status.HTTP_201_CREATED)
 
 @api_view(['DELETE'])
@@ -260,187 +272,242 @@ def unfollow_user(request, user_id):
     - Authenticated user can unfollow a user by user_id.
     """
     try:
-        user_info = get_user_info(request)  # Authenticate the request
+        follower = get_current_user(request)  # Authenticate the request
     except ValueError as e:
         return Response({'error': str(e)}, status=status.HTTP_401_UNAUTHORIZED)
 
-    follower = User.objects.get(id=user_info['id'])
     try:
         following = User.objects.get(id=user_id)
     except User.DoesNotExist:
         return Response({'error': 'User not found.'}, status=status.HTTP_404_NOT_FOUND)
 
-    # Check if the relationship exists
-    try:
-        follow_relation = UserFollowRel.objects.get(follower=follower, following=following)
-    except UserFollowRel.DoesNotExist:
-        return Response({'error': 'Not following this user.'}, status=status.HTTP_400_BAD_REQUEST)
-
-    # Delete the follow relationship
-    follow_relation.delete()
+    # Delete the follow relationship if it exists, and uncount it
+    with transaction.atomic():
+        deleted, _ = UserFollowRel.objects.filter(follower=follower, following=following).delete()
+        if not deleted:
+            return Response({'error': 'Not following this user.'}, status=status.HTTP_400_BAD_REQUEST)
+        adjust_follow_counters(follower.id, following.id, -deleted)
+    # Drop the unfollowed user's posts from the follower's timeline
+    remove_from_timeline(follower, following)
     return Response({'message': f'{follower.display_name} has unfollowed {following.display_name}.'}, status=status.HTTP_204_NO_CONTENT)
 
 
+@cached_response('followers:{user_id}')
 @api_view(['GET'])
 def list_followers(request, user_id):
     """
     API to list all followers of a user.
-    - Uses pagination for better performance.
+    - Uses pagination for better performance (pass cursor= for keyset pagination on (created_time, id)).
     """
-    page = request.query_params.get('page', 1)
-    page_size = request.query_params.get('pageSize', 10)
-
     try:
-        # Ensure the user exists
-        User.objects.get(id=user_id)
+        # Ensure the user exists, and read the number of followers from its counter instead of a COUNT(*)
+        user = User.objects.only('followers_count').get(id=user_id)
     except User.DoesNotExist:
         return Response({'error': 'User not found.'}, status=status.HTTP_404_NOT_FOUND)
 
-    # Fetch followers
-    followers = UserFollowRel.objects.filter(following_id=user_id).select_related('follower')
+    # Fetch followers, most recent first
+    followers = UserFollowRel.objects.filter(following_id=user_id).select_related('follower').order_by('-created_time', '-id')
 
     # Paginate the results
-    paginator = Paginator(followers, page_size)
     try:
-        paginated_followers = paginator.page(page)
-    except PageNotAnInteger:
-        return Response({'error': 'Invalid page number.'}, status=status.HTTP_400_BAD_REQUEST)
-    except EmptyPage:
-        return Response({'error': 'Page out of range.'}, status=status.HTTP_404_NOT_FOUND)
+        paginated_followers, pagination = paginate(request, followers, keyset=('-created_time', '-id'), total=user.followers_count)
+    except PaginationError as e:
+        return Response({'error': str(e)}, status=e.status_code)
 
     # Serialize followers
-    results = [{'id': rel.follower.id, 'display_name': rel.follower.display_name, 'email': rel.follower.email, 'avatar_url': rel.follower.avatar_url.url if rel.follower.avatar_url else None}
+    results = [{'id': rel.follower.id, 'display_name': rel.follower.display_name, 'email': rel.follower.email, 'avatar_url': rel.follower.avatar_url.url if rel.follower.avatar_url else None,
+                'avatar_variants': variant_urls(rel.follower.avatar_variants)}
                for rel in paginated_followers]
 
-    return Response({
-        'page': page,
-        'pageSize': page_size,
-        'totalItems': paginator.count,
-        'totalPages': paginator.num_pages,
-        'results': results
-    }, status=status.HTTP_200_OK)
+    return Response({**pagination, 'results': results}, status=status.HTTP_200_OK)
 
 @api_view(['GET'])
 def list_following(request, user_id):
     """
     API to list all users a specific user is following.
-    - Uses pagination for better performance.
+    - Uses pagination for better performance (pass cursor= for keyset pagination on (created_time, id)).
     """
-    page = request.query_params.get('page', 1)
-    page_size = request.query_params.get('pageSize', 10)
-
     try:
-        # Ensure the user exists
-        User.objects.get(id=user_id)
+        # Ensure the user exists, and read the number of followed users from its counter instead of a COUNT(*)
+        user = User.objects.only('following_count').get(id=user_id)
     except User.DoesNotExist:
         return Response({'error': 'User not found.'}, status=status.HTTP_404_NOT_FOUND)
 
-    # Fetch following relationships
-    following = UserFollowRel.objects.filter(follower_id=user_id).select_related('following')
+    # Fetch following relationships, most recent first
+    following = UserFollowRel.objects.filter(follower_id=user_id).select_related('following').order_by('-created_time', '-id')
 
     # Paginate the results
-    paginator = Paginator(following, page_size)
     try:
-        paginated_following = paginator.page(page)
-    except PageNotAnInteger:
-        return Response({'error': 'Invalid page number.'}, status=status.HTTP_400_BAD_REQUEST)
-    except EmptyPage:
-        return Response({'error': 'Page out of range.'}, status=status.HTTP_404_NOT_FOUND)
+        paginated_following, pagination = paginate(request, following, keyset=('-created_time', '-id'), total=user.following_count)
+    except PaginationError as e:
+        return Response({'error': str(e)}, status=e.status_code)
 
     # Serialize following users
-    results = [{'id': rel.following.id, 'display_name': rel.following.display_name, 'email': rel.following.email, 'avatar_url': rel.following.avatar_url.url if rel.following.avatar_url else None}
+    results = [{'id': rel.following.id, 'display_name': rel.following.display_name, 'email': rel.following.email, 'avatar_url': rel.following.avatar_url.url if rel.following.avatar_url else None,
+                'avatar_variants': variant_urls(rel.following.avatar_variants)}
                for rel in paginated_following]
 
-    return Response({
-        'page': page,
-        'pageSize': page_size,
-        'totalItems': paginator.count,
-        'totalPages': paginator.num_pages,
-        'results': results
-    }, status=status.HTTP_200_OK)
+    return Response({**pagination, 'results': results}, status=status.HTTP_200_OK)
+
+# Helper function to serialize users given by id, in the same order, as in list_followers
+def user_summaries(user_ids):
+    users = User.objects.in_bulk(user_ids)
+    return [{'id': user.id, 'display_name': user.display_name, 'email': user.email, 'avatar_url': user.avatar_url.url if user.avatar_url else None,
+             'avatar_variants': variant_urls(user.avatar_variants)}
+            for user in (users.get(user_id) for user_id in user_ids) if user is not None]
+
+@api_view(['GET'])
+def list_mutual_follows(request, user_id):
+    """
+    API to list the users who follow a user and are followed back, by id.
+    - Reads the follow lists from the follow graph cache (see users/follow_graph.py), paginated with page and pageSize.
+    """
+    if not User.objects.filter(id=user_id).exists():
+        return Response({'error': 'User not found.'}, status=status.HTTP_404_NOT_FOUND)
+
+    try:
+        paginated_ids, pagination = paginate(request, mutual_follows(user_id))
+    except PaginationError as e:
+        return Response({'error': str(e)}, status=e.status_code)
+
+    return Response({**pagination, 'results': user_summaries(paginated_ids)}, status=status.HTTP_200_OK)
+
+@api_view(['GET'])
+def get_follow_status(request):
+    """
+    API to tell, for a page of users, whether the authenticated user follows them and is followed by them.
+    - userIds: comma-separated ids (at most FOLLOW_STATUS_MAX_USERS), results come in the same order.
+    """
+    try:
+        user = get_current_user(request)
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_401_UNAUTHORIZED)
+
+    try:
+        user_ids = list(dict.fromkeys(int(user_id) for user_id in request.query_params.get('userIds', '').split(',') if user_id.strip()))
+    except ValueError:
+        return Response({'error': 'userIds must be comma-separated user ids.'}, status=status.HTTP_400_BAD_REQUEST)
+    if not 0 < len(user_ids) <= settings.FOLLOW_STATUS_MAX_USERS:
+        return Response({'error': f'Provide between 1 and {settings.FOLLOW_STATUS_MAX_USERS} userIds.'}, status=status.HTTP_400_BAD_REQUEST)
+
+    statuses = follow_status(user.id, user_ids)
+    return Response({'results': [{'id': user_id, **statuses[user_id]} for user_id in user_ids]}, status=status.HTTP_200_OK)
+
+@api_view(['GET'])
+def list_follow_suggestions(request):
+    """
+    API to suggest users to follow: the users followed by the most users that the authenticated user follows.
+    - limit: number of suggestions (default 10, at most FOLLOW_SUGGESTIONS_MAX_LIMIT).
+    - Each suggestion has followed_by_count, the number of followed users following it.
+    """
+    try:
+        user = get_current_user(request)
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_401_UNAUTHORIZED)
+
+    try:
+        limit = int(request.query_params.get('limit', 10))
+    except ValueError:
+        return Response({'error': 'The limit must be a number.'}, status=status.HTTP_400_BAD_REQUEST)
+    if not 0 < limit <= settings.FOLLOW_SUGGESTIONS_MAX_LIMIT:
+        return Response({'error': f'The limit must be between 1 and {settings.FOLLOW_SUGGESTIONS_MAX_LIMIT}.'}, status=status.HTTP_400_BAD_REQUEST)
+
+    suggestions = follow_suggestions(user.id, limit)
+    counts = dict(suggestions)
+    results = [{**summary, 'followed_by_count': counts[summary['id']]} for summary in user_summaries([user_id for user_id, _ in suggestions])]
+    return Response({'results': results}, status=status.HTTP_200_OK)
 
 @api_view(['PUT'])
 @parser_classes([MultiPartParser, FormParser])
 def update_profile(request):
     try:
         # Get user from token
-        user_info = get_user_info(request)
-        user = User.objects.get(id=user_info['id'])
+        current_user = get_current_user(request)
+
+        with transaction.atomic():
+            # Lock a fresh row to write to: the authenticated user may be a stale cached copy, whose remembered avatar
+            # would be released instead of the one actually replaced (see images/storage.py)
+            user = User.objects.select_for_update().get(pk=current_user.pk)
         
-        data = request.data
+            data = request.data
+            updated_fields = []
         
-        # Update display name if provided
-        if 'display_name' in data:
-            display_name = data['display_name'].strip()
-            if not display_name:
-                return Response(
-                    {'error': 'Username is required'}, 
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            if User.objects.exclude(id=user.id).filter(display_name=display_name).exists():
-                return Response(
-                    {'error': 'Display name already taken'}, 
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            user.display_name = display_name
-            
-        # Update email if provided
-        if 'email' in data:
-            email = data['email'].strip()
-            try:
-                validate_email(email)
-                if not email.endswith('@bu.edu'):
+            # Update display name if provided
+            if 'display_name' in data:
+                display_name = data['display_name'].strip()
+                if not display_name:
                     return Response(
-                        {'error': 'Only @bu.edu email addresses are allowed'}, 
+                        {'error': 'Username is required'}, 
                         status=status.HTTP_400_BAD_REQUEST
                     )
-                if User.objects.exclude(id=user.id).filter(email=email).exists():
+                if User.objects.exclude(id=user.id).filter(display_name=display_name).exists():
                     return Response(
-                        {'error': 'Email already registered'}, 
+                        {'error': 'Display name already taken'}, 
+                        status=status.HTTP_400_BAD_REQUEST
+                    )
+                user.display_name = display_name
+                updated_fields.append('display_name')
+            
+            # Update email if provided
+            if 'email' in data:
+                email = data['email'].strip()
+                try:
+                    validate_email(email)
+                    if not email.endswith('@bu.edu'):
+                        return Response(
+                            {'error': 'Only @bu.edu email addresses are allowed'}, 
+                            status=status.HTTP_400_BAD_REQUEST
+                        )
+                    if User.objects.exclude(id=user.id).filter(email=email).exists():
+                        return Response(
+                            {'error': 'Email already registered'}, 
+                            status=status.HTTP_400_BAD_REQUEST
+                        )
+                    user.email = email
+                    updated_fields.append('email')
+                except ValidationError:
+                    return Response(
+                        {'error': 'Invalid email format'}, 
                         status=status.HTTP_400_BAD_REQUEST
                     )
-                user.email = email
-            except ValidationError:
-                return Response(
-                    {'error': 'Invalid email format'}, 
-                    status=status.HTTP_400_BAD_REQUEST
-                )
                 
-        # Update bio if provided
-        if 'bio' in data:
-            user.bio = data['bio'].strip() if data['bio'] else None
+            # Update bio if provided
+            if 'bio' in data:
+                user.bio = data['bio'].strip() if data['bio'] else None
+                updated_fields.append('bio')
             
-        # Update avatar if provided
-        if 'avatar_url' in request.FILES:
-            avatar = request.FILES['avatar_url']
-            if not avatar.content_type.startswith('image/'):
-                return Response(
-                    {'error': 'File must be an image'}, 
-                    status=status.HTTP_400_BAD_REQUEST
-                )
+            # Update avatar if provided
+            if 'avatar_url' in request.FILES:
+                avatar = request.FILES['avatar_url']
+                if not avatar.content_type.startswith('image/') or not is_image(avatar):
+                    return Response(
+                        {'error': 'File must be an image'}, 
+                        status=status.HTTP_400_BAD_REQUEST
+                    )
             
-            # Delete old avatar if exists
-            if user.avatar_url:
-                default_storage.delete(user.avatar_url.path)
-                
-            avatar_path = default_storage.save(
-                f'user_avatars/{user.id}_{avatar.name}', 
-                avatar
-            )
-            user.avatar_url = avatar_path
+                # The previous avatar is released when the user is saved (see images/storage.py)
+                avatar_path = blob_storage.save(
+                    f'user_avatars/{user.id}_{avatar.name}', 
+                    avatar
+                )
+                user.avatar_url = avatar_path
+                updated_fields.append('avatar_url')
             
-        user.save()
+            user.save(update_fields=updated_fields)
+            if 'avatar_url' in request.FILES:
+                schedule_variants(user, 'avatar_url', 'avatar_variants')  # Resize the new avatar after the response
         
-        return Response({
-            'message': 'Profile updated successfully',
-            'user': {
-                'id': user.id,
-                'email': user.email,
-                'display_name': user.display_name,
-                'bio': user.bio or '',
-                'avatar_url': user.avatar_url.url if user.avatar_url else None
-            }
-        })
+            return Response({
+                'message': 'Profile updated successfully',
+                'user': {
+                    'id': user.id,
+                    'email': user.email,
+                    'display_name': user.display_name,
+                    'bio': user.bio or '',
+                    'avatar_url': user.avatar_url.url if user.avatar_url else None,
+                    'avatar_variants': variant_urls(user.avatar_variants)
+                }
+            })
         
     except ValueError as e:
         return Response(
@@ -460,8 +527,8 @@ def update_profile(request):
 @api_view(['PUT'])
 def change_password(request):
     try:
-        user_info = get_user_info(request)
-        user = User.objects.get(id=user_info['id'])
+        # The authenticated user may be a stale cached copy (see users/authentication.py): write to a fresh row
+        user = User.objects.get(pk=get_current_user(request).pk)
         
         data = request.data
         old_password = data.get('oldPassword')
@@ -500,11 +567,13 @@ def change_password(request):
                 user.password_history = f"{user.password},{user.password_history}"
             else:
                 user.password_history = user.password
-            # Set new password
-            user.set_password(new_password)
-            user.save()
+            # Set new password, writing only the password (password_history is not stored)
+            user.password = make_password(new_password)
+            user.save(update_fields=['password'])
             
-            return Response({'message': 'Password updated successfully'})
+            # The password change revoked the current token, send a new one
+            token = generate_jwt_token(user)
+            return Response({'message': 'Password updated successfully', 'token': token})
             
         except ValidationError as e:
             return Response({'error': e.messages}, 